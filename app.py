@@ -1,25 +1,94 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response
 from flask_cors import CORS
-import requests
 import json
 import os
+import contextvars
+import hmac
+import shutil
+import tempfile
+import time
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait as wait_futures
+import importer
+import jobs
+import record_templates
+import metrics
+import outcomes
+import quota
+import deadlines
+import recorder
+import snapshots
+import drift
+import profiler
+import scheduler
+import sharding
+import streaming
+import warmup
+from circuit_breaker import CircuitOpenError, seconds_until_retry
+from deadlines import DeadlineExceeded
+from domains import prepare_domains, normalize_domain, InvalidDomain
+from http_client import outbound_request
 from config import (
     CLOUDFLARE_EMAIL, CLOUDFLARE_API_KEY,
     CLOUDFLARE_API_BASE, REGISTRAR_API_URL, REGISTRAR_API_KEY,
+    IMPORT_CHUNK_SIZE, JOB_CONTROL_POLL, BREAKER_PARK_MAX_WAIT, JOB_TIME_BUDGET, DOMAIN_TIME_BUDGET,
+    SNAPSHOT_WORKERS, DRIFT_CHECK_ENABLED, SHARDING_ENABLED, SHARD_TASK_SIZE, SHARD_WORKER_TASKS,
+    SHARD_RETENTION, SHARD_ACCOUNTS_FILE,
+    ADMIN_TOKEN, PROFILE_INTERVAL, PROFILE_MAX_SECONDS,
     load_settings_from_file, save_settings_to_file
 )
 from ukraine_registrar import (
     get_ukraine_headers,
     ukraine_get_dns_records,
-    ukraine_delete_dns_record,
-    ukraine_create_dns_record,
     ukraine_update_nameservers,
-    ukraine_update_domain_a_record
+    ukraine_reconcile_dns_records,
+    ukraine_expected_calls,
+    extract_dns_records,
+    normalize_dns_record
 )
 
 app = Flask(__name__)
 CORS(app)
 
+# Запись трафика или воспроизведение записи (RECORD_TRAFFIC / REPLAY_FROM)
+recorder.configure()
+
+# Фоновая проверка дрейфа управляемых доменов (DRIFT_CHECK_ENABLED)
+if DRIFT_CHECK_ENABLED:
+    drift.start()
+
+# Вызовы API, которые пишутся в запись трафика для повторного прогона
+RECORDED_ROUTES = {'/api/stage1', '/api/stage2', '/api/stage3', '/api/stage4', '/api/run-all'}
+
+@app.before_request
+def record_inbound_call():
+    """Запись входящего вызова этапа (ключи замаскированы)"""
+    if recorder.recording() and request.path in RECORDED_ROUTES:
+        recorder.record_inbound(request.path, request.get_json(silent=True) or {})
+
+# Настройки зоны Cloudflare, общие для всех профилей TLS
+TLS_COMMON_SETTINGS = {
+    'always_use_https': 'on',
+    'min_tls_version': '1.2',
+    'tls_1_3': 'on',
+    'automatic_https_rewrites': 'on',
+    # HSTS (Strict-Transport-Security): полгода, без поддоменов и preload
+    'security_header': {'strict_transport_security': {
+        'enabled': True, 'max_age': 15552000, 'include_subdomains': False, 'preload': False, 'nosniff': True,
+    }},
+}
+
+# Профили TLS для этапа 4: значения настроек зоны Cloudflare (любое число
+# настроек ставится одним запросом, см. drift.patch_zone_settings)
+TLS_PROFILES = {
+    'strict': dict(TLS_COMMON_SETTINGS, ssl='strict'),
+    'full': dict(TLS_COMMON_SETTINGS, ssl='full'),
+    'flexible': dict(TLS_COMMON_SETTINGS, ssl='flexible'),
+}
+DEFAULT_TLS_PROFILE = 'strict'
+
+ALL_STAGES = ['stage1', 'stage2', 'stage3', 'stage4']
+
 def get_cloudflare_headers(api_keys=None):
     """Get Cloudflare API headers - использует Global API Key"""
     # Если переданы ключи из запроса, используем их, иначе из конфига
@@ -102,343 +171,1205 @@ def save_settings():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Чтения Cloudflare, которые объединяются с такими же одновременными запросами
+COALESCED_CF_READS = {'zones.list', 'zones.get'}
+
+def cf_request(method, endpoint, path, headers, **kwargs):
+    """Запрос к Cloudflare API через общий клиент (метрики, трассировка)"""
+    coalesce = method == 'GET' and endpoint in COALESCED_CF_READS
+    return outbound_request('cloudflare', endpoint, method, f"{CLOUDFLARE_API_BASE}{path}",
+                            coalesce=coalesce, headers=headers, **kwargs)
+
+def time_budget_param(value, default):
+    """Бюджет времени задания из параметра запроса (сек, 0 - без ограничения)"""
+    try:
+        return max(0, int(value)) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        return default
+
+def normalize_targets(targets):
+    """Цели по доменам (IP или переменные шаблона) с ключами в нормализованном виде"""
+    normalized = {}
+    for domain, target in (targets or {}).items():
+        try:
+            normalized[normalize_domain(domain)] = target
+        except InvalidDomain:
+            continue
+    return normalized
+
+def priority_param(value, default=scheduler.DEFAULT_PRIORITY):
+    """Приоритет задания из параметра запроса (urgent/high/normal/bulk)"""
+    return value if value in scheduler.PRIORITY_WEIGHTS else default
+
+def start_job(kind, stages, domains, data, api_keys, records_per_domain=1):
+    """Создание задания с проверкой оценки запросов против оставшейся квоты"""
+    job = jobs.create_job(kind, trace=data.get('trace'), priority=priority_param(data.get('priority')))
+    job.start_clock(time_budget_param(data.get('time_budget'), JOB_TIME_BUDGET))
+    estimate = quota.estimate_job(stages, domains, api_keys, records_per_domain, bool(data.get('seed_from_registrar')))
+    quota.reserve(job, estimate, api_keys)
+    return job
+
+def finish_job(job):
+    """Снятие резерва квоты и отчёт: фактические запросы против оценки"""
+    quota.release(job)
+    if job.status == 'running':
+        job.status = 'cancelled' if job.cancel_requested else 'done'
+        job.finished_at = time.time()
+    return quota.report(job)
+
+def stream_response(document, job=None):
+    """
+    Потоковый ответ с результатами этапов (см. streaming.py)
+
+    Accept: application/x-ndjson - NDJSON вместо JSON, Accept-Encoding: gzip -
+    сжатие. ID задания - в заголовке X-Job-Id, последним полем документа
+    идёт сводка задания totals. Если клиент отключился до конца ответа,
+    резерв квоты снимается, задание получает статус cancelled.
+    """
+    if job is not None:
+        document['totals'] = lambda: job.summary.as_dict()
+    ndjson = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+    chunks = streaming.iter_ndjson(document) if ndjson else streaming.iter_json(document)
+    compress = request.accept_encodings['gzip'] > 0
+    body = streaming.iter_gzip(chunks) if compress else streaming.iter_encoded(chunks)
+    response = Response(body, mimetype='application/x-ndjson' if ndjson else 'application/json')
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    if job is not None:
+        response.headers['X-Job-Id'] = job.id
+
+        def on_close():
+            if job.status == 'running':
+                quota.release(job)
+                job.status = 'cancelled'
+                job.finished_at = time.time()
+        response.call_on_close(on_close)
+    return response
+
+def deferred_result(domain, error):
+    """Результат для домена, отложенного из-за открытого circuit breaker"""
+    return outcomes.DomainResult(domain, 'deferred', 'deferred', error)
+
+def deadline_result(domain, error, started=True):
+    """Результат для домена, на который не хватило времени задания или домена"""
+    if started:
+        return outcomes.DomainResult(domain, 'deadline_exceeded', 'deadline_exceeded', error)
+    return outcomes.DomainResult(domain, 'cancelled', 'cancelled')
+
+def checkpoint(job):
+    """
+    Проверка управления заданием перед запуском домена
+
+    На паузе ждёт продолжения (или дедлайна задания); резерв квоты на время
+    паузы снят. Returns: False, если задание отменено.
+    """
+    control = job.poll_control()
+    if control == 'paused':
+        quota.release(job)
+        while control == 'paused' and not deadlines.expired():
+            job.wait_control(JOB_CONTROL_POLL)
+            control = job.poll_control()
+        quota.restore(job)
+    return control != 'cancelling'
+
+def run_domain(job, stage, domain, handler):
+    """
+    Обработка одного домена в своём span с дедлайном DOMAIN_TIME_BUDGET
+
+    Сначала проверяется пауза/отмена задания, затем домен ждёт слот
+    планировщика (очередь по приоритетам заданий); ожидание не расходует
+    время домена, только время задания.
+    """
+    if not checkpoint(job):
+        return outcomes.DomainResult(domain, 'cancelled', 'job_cancelled')
+    try:
+        with scheduler.task_slot():
+            with job.span(stage, domain):
+                with deadlines.scope(deadlines.deadline_after(DOMAIN_TIME_BUDGET)):
+                    try:
+                        return handler(domain)
+                    except DeadlineExceeded as e:
+                        return deadline_result(domain, e)
+    except DeadlineExceeded:
+        # Время задания вышло, пока домен ждал слот
+        return deadline_result(domain, None, started=False)
+
+def _iter_parallel(fn, domains, workers, name):
+    """fn(index, domain) в пуле потоков; результаты по мере готовности, в работе не больше 2*workers"""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name) as pool:
+        pending = set()
+        for index, domain in enumerate(domains):
+            pending.add(pool.submit(contextvars.copy_context().run, fn, index, domain))
+            if len(pending) >= workers * 2:
+                done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+def _iter_stage(job, stage, domains, handler, workers=1):
+    """Пары (индекс домена, результат) в порядке готовности (см. iter_stage)"""
+    parked = []
+
+    def process(index, domain):
+        if deadlines.expired():
+            return index, deadline_result(domain, None, started=False)
+        try:
+            return index, run_domain(job, stage, domain, handler)
+        except CircuitOpenError as e:
+            parked.append((index, domain, e))
+            return index, None
+
+    with jobs.activate(job):
+        if workers > 1 and len(domains) > 1:
+            processed = _iter_parallel(process, domains, workers, stage)
+        else:
+            processed = (process(index, domain) for index, domain in enumerate(domains))
+        for index, result in processed:
+            if result is not None:
+                job.tally(stage, result)
+                yield index, result
+        if parked:
+            parked.sort(key=lambda item: item[0])
+            metrics.inc('dns_parked_domains_total', {'stage': stage}, len(parked))
+            for index, result in retry_parked(job, stage, parked, handler):
+                job.tally(stage, result)
+                yield index, result
+        job.set_parked(stage, [domain for _, domain, _ in parked])
+        for index, domain, error in parked:
+            result = deferred_result(domain, error)
+            job.tally(stage, result)
+            yield index, result
+
+def iter_stage(job, stage, domains, handler, workers=1):
+    """
+    Обработка списка доменов на этапе, каждый домен - отдельный span задания
+
+    Генератор: результаты выдаются по мере готовности и не накапливаются,
+    поэтому ответ этапа можно отдавать потоком (см. stream_response).
+    Порядок - порядок завершения: при workers=1 это порядок списка, но
+    отложенные домены выдаются в конце, после повтора.
+
+    workers > 1 - домены обрабатываются параллельно (контекст задания и
+    дедлайн копируются в каждый поток).
+
+    У домена свой дедлайн (не позже дедлайна задания): все его исходящие
+    запросы получают остаток как таймаут. Когда время задания вышло,
+    оставшиеся домены не запускаются и получают статус cancelled.
+
+    Если breaker провайдера открыт, домен не ждёт таймаута, а откладывается.
+    После прохода по списку отложенные домены повторяются, когда breaker
+    пропускает пробный запрос (не дольше BREAKER_PARK_MAX_WAIT секунд);
+    оставшиеся получают статус deferred и перечисляются в статусе задания.
+    """
+    for _index, result in _iter_stage(job, stage, domains, handler, workers):
+        yield result
+
+def run_stage(job, stage, domains, handler, workers=1):
+    """Результаты этапа списком в порядке доменов (см. iter_stage)"""
+    results = [None] * len(domains)
+    for index, result in _iter_stage(job, stage, domains, handler, workers):
+        results[index] = result
+    return results
+
+def track_success(results, succeeded):
+    """Пропуск результатов этапа с запоминанием успешно обработанных доменов"""
+    for result in results:
+        if result.status == 'success':
+            succeeded.add(result.domain)
+        yield result
+
+def register_managed(stage_succeeded, api_keys, known_records, profiles):
+    """
+    Регистрация доменов, успешно прошедших все четыре этапа, для проверки дрейфа
+
+    stage_succeeded - {этап: множество успешных доменов}, profiles - домен -> профиль TLS
+    """
+    succeeded = None
+    for stage in ALL_STAGES:
+        ok = stage_succeeded.get(stage, set())
+        succeeded = ok if succeeded is None else succeeded & ok
+    for domain in succeeded or ():
+        if domain not in known_records:
+            continue
+        tls = TLS_PROFILES.get(profiles(domain) or DEFAULT_TLS_PROFILE)
+        try:
+            drift.register(domain, api_keys, known_records[domain], tls)
+        except Exception as e:
+            print(f"Ошибка регистрации домена {domain} для проверки дрейфа: {e}")
+
+def take_snapshot(job, domains, api_keys):
+    """Параллельный снимок записей регистратора для пакета доменов"""
+    results = run_stage(job, 'snapshot', domains, lambda d: snapshots.snapshot_domain(d, api_keys), SNAPSHOT_WORKERS)
+    return snapshots.save_manifest(job, api_keys, results), results
+
+def guarded_by_snapshot(manifest, handler):
+    """Обработчик, пропускающий домены, для которых снимок не создан"""
+    def guarded(domain):
+        if manifest is not None and domain not in manifest['domains']:
+            return outcomes.error(domain, 'snapshot_missing')
+        return handler(domain)
+    return guarded
+
+def retry_parked(job, stage, parked, handler):
+    """
+    Повтор отложенных доменов по мере закрытия breaker'ов
+
+    Выдаёт (индекс, результат) обработанных доменов; в parked остаются
+    домены, которые так и не удалось обработать, с последней ошибкой.
+    """
+    deadline = time.monotonic() + BREAKER_PARK_MAX_WAIT
+    while parked:
+        if job.poll_control() == 'cancelling':
+            for index, domain, _error in parked:
+                yield index, outcomes.DomainResult(domain, 'cancelled', 'job_cancelled')
+            parked.clear()
+            break
+        # Пауза до пробного запроса (минимум 1 с, если пробный запрос уже идёт)
+        wait = seconds_until_retry() or 1.0
+        left = deadlines.remaining()
+        if time.monotonic() + wait > deadline or (left is not None and wait >= left):
+            break
+        time.sleep(wait)
+        still_parked = []
+        for index, domain, _error in parked:
+            try:
+                yield index, run_domain(job, stage, domain, handler)
+            except CircuitOpenError as e:
+                still_parked.append((index, domain, e))
+        parked[:] = still_parked
+
+def stage1_domain(domain, template, variables, api_keys, fresh=False, known_records=None):
+    """
+    Этап 1 для одного домена: приведение записей к набору из шаблона
+
+    fresh=True - читать текущие записи регистратора в обход кэша.
+    known_records - словарь, куда сохраняется применённый набор записей
+    (используется этапом 2 для засева зоны без повторного чтения у регистратора).
+    """
+    try:
+        records = template.expand(domain, variables)
+
+        # Сверка с текущими записями через API ukraine.com.ua: лишние удаляются,
+        # совпадающие не трогаются, недостающие создаются
+        changes = ukraine_reconcile_dns_records(domain, records, api_keys, fresh)
+        if known_records is not None:
+            known_records[domain] = records
+
+        single_a = len(records) == 1 and records[0]['type'] == 'A'
+        return outcomes.success(domain, 'a_record_updated' if single_a else 'records_applied', changes=changes)
+
+    except (CircuitOpenError, DeadlineExceeded):
+        # Провайдер недоступен или время вышло - обрабатывается в iter_stage
+        raise
+    except Exception as e:
+        return outcomes.error(domain, 'text', e)
+
+def registrar_seed_records(domain, api_keys):
+    """
+    Записи для засева зоны Cloudflare из данных регистратора
+
+    Список берётся из кэша регистратора (обычно уже прочитан на этапе 1),
+    NS записи корня не переносятся - их задаёт Cloudflare.
+    """
+    records = extract_dns_records(ukraine_get_dns_records(domain, api_keys))
+    seed = []
+    for raw in records:
+        record = normalize_dns_record(raw, domain)
+        if not record or record['type'] not in record_templates.SUPPORTED_TYPES:
+            continue
+        if record['type'] == 'NS' and record['name'] == '@':
+            continue
+        seed.append(record)
+    return seed
+
+def seed_source(known_records, api_keys):
+    """Источник записей для засева: набор, применённый на этапе 1, иначе данные регистратора"""
+    return lambda d: known_records[d] if d in known_records else registrar_seed_records(d, api_keys)
+
+def cloudflare_record_payload(record, domain):
+    """Запись из набора (name относительно домена) в формате Cloudflare API"""
+    name = record.get('name') or '@'
+    payload = {
+        'type': record['type'],
+        'name': domain if name == '@' else f"{name}.{domain}",
+        'content': record['content'],
+        'ttl': record.get('ttl', 3600),
+    }
+    if record['type'] == 'MX':
+        payload['priority'] = record.get('priority', 0)
+    return payload
+
+def seed_zone_records(zone_id, domain, records, headers, zone_is_new):
+    """
+    Засев зоны записями одним batch запросом
+
+    Для новой зоны (создана без jump_start) - только создание записей.
+    Для существующей - сверка: лишние удаляются, недостающие создаются
+    в том же batch запросе.
+
+    Returns:
+        (успех, сообщение об ошибке)
+    """
+    posts = [cloudflare_record_payload(r, domain) for r in records]
+    deletes = []
+    if not zone_is_new:
+        records_response = cf_request('GET', 'dns_records.list', f"/zones/{zone_id}/dns_records?per_page=5000", headers)
+        if records_response.status_code == 200:
+            for existing in records_response.json()['result']:
+                match = next((p for p in posts
+                              if p['type'] == existing['type']
+                              and p['name'] == existing['name'].lower()
+                              and str(p['content']).rstrip('.').lower() == str(existing['content']).rstrip('.').lower()), None)
+                if match is not None:
+                    posts.remove(match)
+                else:
+                    deletes.append({'id': existing['id']})
+
+    if not posts and not deletes:
+        return True, ''
+
+    batch_response = cf_request('POST', 'dns_records.batch', f"/zones/{zone_id}/dns_records/batch", headers,
+                                json={'deletes': deletes, 'posts': posts})
+    if batch_response.status_code == 200:
+        return True, ''
+    errors = batch_response.json().get('errors', [{}])
+    return False, '; '.join(e.get('message', 'Неизвестная ошибка') for e in errors) or 'Неизвестная ошибка'
+
+def stage2_domain(domain, headers, seed_records=None):
+    """
+    Этап 2 для одного домена
+
+    seed_records - функция domain -> список записей. Если задана, зона
+    создаётся без jump_start (без сканирования DNS на стороне Cloudflare)
+    и записи загружаются одним batch запросом из уже известных данных
+    регистратора. Иначе - прежнее поведение: jump_start и удаление всех
+    записей кроме A.
+    """
+    try:
+        # Проверяем, существует ли домен уже в Cloudflare
+        zones_response = cf_request('GET', 'zones.list', f"/zones?name={domain}", headers)
+
+        zone_id = None
+        if zones_response.status_code == 200:
+            zones = zones_response.json()['result']
+            if zones:
+                zone_id = zones[0]['id']
+
+        zone_is_new = False
+        # Если домен не существует, добавляем его
+        if not zone_id:
+            zone_data = {
+                'name': domain,
+                'jump_start': seed_records is None  # Импортирует DNS записи автоматически
+            }
+
+            response = cf_request('POST', 'zones.create', '/zones', headers, json=zone_data)
+
+            if response.status_code == 200:
+                zone_info = response.json()
+                zone_id = zone_info['result']['id']
+                zone_is_new = True
+            else:
+                error_data = response.json()
+                error_msg = error_data.get('errors', [{}])[0].get('message', 'Неизвестная ошибка')
+                return outcomes.error(domain, 'zone_add_failed', error_msg)
+
+        if seed_records is not None:
+            ok, error_msg = seed_zone_records(zone_id, domain, seed_records(domain), headers, zone_is_new)
+            if not ok:
+                return outcomes.error(domain, 'zone_seed_failed', error_msg, zone_id=zone_id)
+            return outcomes.success(domain, 'zone_seeded', zone_id=zone_id)
+
+        # Получаем все записи и оставляем только A записи
+        records_response = cf_request('GET', 'dns_records.list', f"/zones/{zone_id}/dns_records", headers)
+
+        if records_response.status_code == 200:
+            all_records = records_response.json()['result']
+
+            # Удаляем все записи кроме A
+            for record in all_records:
+                if record['type'] != 'A':
+                    cf_request('DELETE', 'dns_records.delete', f"/zones/{zone_id}/dns_records/{record['id']}", headers)
+
+        return outcomes.success(domain, 'zone_a_only', zone_id=zone_id)
+
+    except (CircuitOpenError, DeadlineExceeded):
+        # Провайдер недоступен или время вышло - обрабатывается в iter_stage
+        raise
+    except Exception as e:
+        return outcomes.error(domain, 'text', e)
+
+def stage3_domain(domain, headers, api_keys):
+    """Этап 3 для одного домена"""
+    try:
+        # Получаем zone_id домена
+        zones_response = cf_request('GET', 'zones.list', f"/zones?name={domain}", headers)
+
+        if zones_response.status_code != 200:
+            return outcomes.error(domain, 'zone_not_found')
+
+        zones = zones_response.json()['result']
+        if not zones:
+            return outcomes.error(domain, 'zone_not_found')
+
+        zone_id = zones[0]['id']
+
+        # Получаем NS записи из Cloudflare
+        zone_info_response = cf_request('GET', 'zones.get', f"/zones/{zone_id}", headers)
+
+        if zone_info_response.status_code != 200:
+            return outcomes.error(domain, 'zone_info_failed')
+
+        zone_info = zone_info_response.json()['result']
+        nameservers = zone_info.get('name_servers', [])
+
+        if not nameservers:
+            return outcomes.error(domain, 'ns_not_found')
+
+        # Обновляем NS записи у регистратора через API ukraine.com.ua
+        ukraine_update_nameservers(domain, nameservers, api_keys)
+
+        return outcomes.success(domain, 'ns_updated', nameservers=nameservers)
+
+    except (CircuitOpenError, DeadlineExceeded):
+        # Провайдер недоступен или время вышло - обрабатывается в iter_stage
+        raise
+    except Exception as e:
+        return outcomes.error(domain, 'text', e)
+
+def stage4_domain(domain, headers, tls_profile=DEFAULT_TLS_PROFILE):
+    """Этап 4 для одного домена"""
+    profile = TLS_PROFILES.get(tls_profile or DEFAULT_TLS_PROFILE)
+    if not profile:
+        return outcomes.error(domain, 'tls_unknown_profile', tls_profile)
+
+    try:
+        # Получаем zone_id домена
+        zones_response = cf_request('GET', 'zones.list', f"/zones?name={domain}", headers)
+
+        if zones_response.status_code != 200:
+            return outcomes.error(domain, 'zone_not_found')
+
+        zones = zones_response.json()['result']
+        if not zones:
+            return outcomes.error(domain, 'zone_not_found')
+
+        zone_id = zones[0]['id']
+
+        # Все настройки профиля (SSL, TLS 1.2+, Always HTTPS, HSTS...) одним запросом
+        failed = drift.patch_zone_settings(zone_id, profile, headers)
+        if not failed:
+            return outcomes.success(domain, 'tls_configured')
+
+        return outcomes.error(domain, 'tls_failed', ', '.join(f'{setting}: {message}' for setting, message in failed.items()),
+                              failed_settings=sorted(failed))
+
+    except (CircuitOpenError, DeadlineExceeded):
+        # Провайдер недоступен или время вышло - обрабатывается в iter_stage
+        raise
+    except Exception as e:
+        return outcomes.error(domain, 'text', e)
+
 @app.route('/api/stage1', methods=['POST'])
 def stage1():
     """Этап 1: Изменение A записей у регистратора"""
     data = request.json
-    domains = data.get('domains', [])
+    prepared = prepare_domains(data.get('domains') or [])
+    domains = prepared.domains
     ip_address = data.get('ip_address', '')
+    targets = normalize_targets(data.get('targets'))
     api_keys = data.get('api_keys', {})
-    
-    if not domains or not ip_address:
-        return jsonify({'error': 'Домены и IP адрес обязательны'}), 400
-    
+
+    if not domains or not (ip_address or targets):
+        return jsonify({'error': 'Домены и IP адрес обязательны', 'input': prepared.as_dict()}), 400
+
     if not api_keys.get('registrar_api_key'):
         return jsonify({'error': 'API ключи не настроены. Заполните настройки API.'}), 400
-    
-    results = []
-    
-    for domain in domains:
-        try:
-            # Используем функцию для обновления A записи через API ukraine.com.ua
-            ukraine_update_domain_a_record(domain, ip_address, api_keys)
-            
-            results.append({
-                'domain': domain,
-                'status': 'success',
-                'message': 'A запись успешно обновлена'
-            })
-                
-        except Exception as e:
-            results.append({
-                'domain': domain,
-                'status': 'error',
-                'message': str(e)
-            })
-    
-    return jsonify({'results': results})
+
+    # Шаблон компилируется один раз на задание
+    try:
+        template = record_templates.compile_template(data.get('record_template'))
+    except record_templates.TemplateError as e:
+        return jsonify({'error': f'Ошибка в шаблоне записей: {e}'}), 400
+
+    stages = ['snapshot', 'stage1'] if data.get('snapshot') else ['stage1']
+    try:
+        job = start_job('stage1', stages, domains, data, api_keys, len(template))
+    except quota.QuotaExceeded as e:
+        return jsonify({'error': str(e), 'budget': e.details}), 429
+
+    # Снимок текущих записей до изменений (snapshot=true)
+    manifest = snapshot_results = None
+    if data.get('snapshot'):
+        manifest, snapshot_results = take_snapshot(job, domains, api_keys)
+
+    results = iter_stage(job, 'stage1', domains, guarded_by_snapshot(manifest, lambda d: stage1_domain(
+        d, template, record_templates.domain_variables(d, targets, ip_address), api_keys, bool(data.get('refresh')))))
+
+    response = {'results': streaming.Items('stage1', results), 'job_id': job.id, 'input': prepared.as_dict()}
+    if manifest is not None:
+        response['snapshot'] = {'id': manifest['id'], 'results': snapshot_results}
+    response['budget'] = lambda: finish_job(job)
+    return stream_response(response, job)
 
 @app.route('/api/stage2', methods=['POST'])
 def stage2():
     """Этап 2: Добавление доменов в Cloudflare с импортом A записей"""
     data = request.json
-    domains = data.get('domains', [])
+    prepared = prepare_domains(data.get('domains') or [])
+    domains = prepared.domains
     api_keys = data.get('api_keys', {})
-    
+
     if not domains:
-        return jsonify({'error': 'Домены обязательны'}), 400
-    
+        return jsonify({'error': 'Домены обязательны', 'input': prepared.as_dict()}), 400
+
     if not api_keys.get('cloudflare_email') or not api_keys.get('cloudflare_api_key'):
         return jsonify({'error': 'API ключи Cloudflare не настроены. Заполните настройки API.'}), 400
-    
-    results = []
+
+    seed = bool(data.get('seed_from_registrar'))
+    if seed and not api_keys.get('registrar_api_key'):
+        return jsonify({'error': 'API ключи Ukraine.com.ua не настроены. Заполните настройки API.'}), 400
+
     headers = get_cloudflare_headers(api_keys)
-    
-    for domain in domains:
-        try:
-            # Проверяем, существует ли домен уже в Cloudflare
-            zones_url = f"{CLOUDFLARE_API_BASE}/zones?name={domain}"
-            zones_response = requests.get(zones_url, headers=headers)
-            
-            zone_id = None
-            if zones_response.status_code == 200:
-                zones = zones_response.json()['result']
-                if zones:
-                    zone_id = zones[0]['id']
-            
-            # Если домен не существует, добавляем его
-            if not zone_id:
-                add_domain_url = f"{CLOUDFLARE_API_BASE}/zones"
-                zone_data = {
-                    'name': domain,
-                    'jump_start': True  # Импортирует DNS записи автоматически
-                }
-                
-                response = requests.post(add_domain_url, headers=headers, json=zone_data)
-                
-                if response.status_code == 200:
-                    zone_info = response.json()
-                    zone_id = zone_info['result']['id']
-                else:
-                    error_data = response.json()
-                    error_msg = error_data.get('errors', [{}])[0].get('message', 'Неизвестная ошибка')
-                    results.append({
-                        'domain': domain,
-                        'status': 'error',
-                        'message': f'Ошибка добавления домена: {error_msg}'
-                    })
-                    continue
-            
-            if zone_id:
-                # Получаем все записи и оставляем только A записи
-                records_url = f"{CLOUDFLARE_API_BASE}/zones/{zone_id}/dns_records"
-                records_response = requests.get(records_url, headers=headers)
-                
-                if records_response.status_code == 200:
-                    all_records = records_response.json()['result']
-                    
-                    # Удаляем все записи кроме A
-                    for record in all_records:
-                        if record['type'] != 'A':
-                            delete_url = f"{CLOUDFLARE_API_BASE}/zones/{zone_id}/dns_records/{record['id']}"
-                            requests.delete(delete_url, headers=headers)
-                
-                results.append({
-                    'domain': domain,
-                    'status': 'success',
-                    'zone_id': zone_id,
-                    'message': 'Домен настроен в Cloudflare, оставлены только A записи'
-                })
-                
-        except Exception as e:
-            results.append({
-                'domain': domain,
-                'status': 'error',
-                'message': str(e)
-            })
-    
-    return jsonify({'results': results})
+    try:
+        job = start_job('stage2', ['stage2'], domains, data, api_keys)
+    except quota.QuotaExceeded as e:
+        return jsonify({'error': str(e), 'budget': e.details}), 429
+
+    seed_records = seed_source({}, api_keys) if seed else None
+    results = iter_stage(job, 'stage2', domains, lambda d: stage2_domain(d, headers, seed_records))
+
+    return stream_response({'results': streaming.Items('stage2', results), 'job_id': job.id,
+                            'input': prepared.as_dict(), 'budget': lambda: finish_job(job)}, job)
 
 @app.route('/api/stage3', methods=['POST'])
 def stage3():
     """Этап 3: Получение NS из Cloudflare и обновление у регистратора"""
     data = request.json
-    domains = data.get('domains', [])
+    prepared = prepare_domains(data.get('domains') or [])
+    domains = prepared.domains
     api_keys = data.get('api_keys', {})
-    
+
     if not domains:
-        return jsonify({'error': 'Домены обязательны'}), 400
-    
+        return jsonify({'error': 'Домены обязательны', 'input': prepared.as_dict()}), 400
+
     if not api_keys.get('cloudflare_email') or not api_keys.get('cloudflare_api_key'):
         return jsonify({'error': 'API ключи Cloudflare не настроены. Заполните настройки API.'}), 400
-    
+
     if not api_keys.get('registrar_api_key'):
         return jsonify({'error': 'API ключи Ukraine.com.ua не настроены. Заполните настройки API.'}), 400
-    
-    results = []
+
     headers = get_cloudflare_headers(api_keys)
-    
-    for domain in domains:
-        try:
-            # Получаем zone_id домена
-            zones_url = f"{CLOUDFLARE_API_BASE}/zones?name={domain}"
-            zones_response = requests.get(zones_url, headers=headers)
-            
-            if zones_response.status_code != 200:
-                results.append({
-                    'domain': domain,
-                    'status': 'error',
-                    'message': 'Домен не найден в Cloudflare'
-                })
-                continue
-            
-            zones = zones_response.json()['result']
-            if not zones:
-                results.append({
-                    'domain': domain,
-                    'status': 'error',
-                    'message': 'Домен не найден в Cloudflare'
-                })
-                continue
-            
-            zone_id = zones[0]['id']
-            
-            # Получаем NS записи из Cloudflare
-            zone_info_url = f"{CLOUDFLARE_API_BASE}/zones/{zone_id}"
-            zone_info_response = requests.get(zone_info_url, headers=headers)
-            
-            if zone_info_response.status_code == 200:
-                zone_info = zone_info_response.json()['result']
-                nameservers = zone_info.get('name_servers', [])
-                
-                if not nameservers:
-                    results.append({
-                        'domain': domain,
-                        'status': 'error',
-                        'message': 'NS записи не найдены в Cloudflare'
-                    })
-                    continue
-                
-                # Обновляем NS записи у регистратора через API ukraine.com.ua
-                ukraine_update_nameservers(domain, nameservers, api_keys)
-                
-                results.append({
-                    'domain': domain,
-                    'status': 'success',
-                    'nameservers': nameservers,
-                    'message': 'NS записи успешно обновлены'
-                })
-            else:
-                results.append({
-                    'domain': domain,
-                    'status': 'error',
-                    'message': 'Ошибка получения информации о зоне'
-                })
-                
-        except Exception as e:
-            results.append({
-                'domain': domain,
-                'status': 'error',
-                'message': str(e)
-            })
-    
-    return jsonify({'results': results})
+    try:
+        job = start_job('stage3', ['stage3'], domains, data, api_keys)
+    except quota.QuotaExceeded as e:
+        return jsonify({'error': str(e), 'budget': e.details}), 429
+
+    results = iter_stage(job, 'stage3', domains, lambda d: stage3_domain(d, headers, api_keys))
+
+    return stream_response({'results': streaming.Items('stage3', results), 'job_id': job.id,
+                            'input': prepared.as_dict(), 'budget': lambda: finish_job(job)}, job)
 
 @app.route('/api/stage4', methods=['POST'])
 def stage4():
     """Этап 4: Настройка TLS и Always HTTPS в Cloudflare"""
     data = request.json
-    domains = data.get('domains', [])
+    prepared = prepare_domains(data.get('domains') or [])
+    domains = prepared.domains
     api_keys = data.get('api_keys', {})
-    
+
     if not domains:
-        return jsonify({'error': 'Домены обязательны'}), 400
-    
+        return jsonify({'error': 'Домены обязательны', 'input': prepared.as_dict()}), 400
+
     if not api_keys.get('cloudflare_email') or not api_keys.get('cloudflare_api_key'):
         return jsonify({'error': 'API ключи Cloudflare не настроены. Заполните настройки API.'}), 400
-    
-    results = []
+
     headers = get_cloudflare_headers(api_keys)
-    
-    for domain in domains:
-        try:
-            # Получаем zone_id домена
-            zones_url = f"{CLOUDFLARE_API_BASE}/zones?name={domain}"
-            zones_response = requests.get(zones_url, headers=headers)
-            
-            if zones_response.status_code != 200:
-                results.append({
-                    'domain': domain,
-                    'status': 'error',
-                    'message': 'Домен не найден в Cloudflare'
-                })
-                continue
-            
-            zones = zones_response.json()['result']
-            if not zones:
-                results.append({
-                    'domain': domain,
-                    'status': 'error',
-                    'message': 'Домен не найден в Cloudflare'
-                })
-                continue
-            
-            zone_id = zones[0]['id']
-            
-            # Настраиваем TLS минимум 1.2
-            ssl_settings_url = f"{CLOUDFLARE_API_BASE}/zones/{zone_id}/settings/ssl"
-            ssl_data = {
-                'value': 'strict'  # strict использует TLS 1.2+
-            }
-            ssl_response = requests.patch(ssl_settings_url, headers=headers, json=ssl_data)
-            
-            # Включаем Always HTTPS
-            always_https_url = f"{CLOUDFLARE_API_BASE}/zones/{zone_id}/settings/always_use_https"
-            always_https_data = {
-                'value': 'on'
-            }
-            always_https_response = requests.patch(always_https_url, headers=headers, json=always_https_data)
-            
-            if ssl_response.status_code == 200 and always_https_response.status_code == 200:
-                results.append({
-                    'domain': domain,
-                    'status': 'success',
-                    'message': 'TLS и Always HTTPS успешно настроены'
-                })
-            else:
-                ssl_error = ssl_response.json().get('errors', [{}])[0].get('message', '') if ssl_response.status_code != 200 else ''
-                https_error = always_https_response.json().get('errors', [{}])[0].get('message', '') if always_https_response.status_code != 200 else ''
-                results.append({
-                    'domain': domain,
-                    'status': 'error',
-                    'message': f'Ошибки: SSL: {ssl_error}, Always HTTPS: {https_error}'
-                })
-                
-        except Exception as e:
-            results.append({
-                'domain': domain,
-                'status': 'error',
-                'message': str(e)
-            })
-    
-    return jsonify({'results': results})
+    try:
+        job = start_job('stage4', ['stage4'], domains, data, api_keys)
+    except quota.QuotaExceeded as e:
+        return jsonify({'error': str(e), 'budget': e.details}), 429
+
+    results = iter_stage(job, 'stage4', domains, lambda d: stage4_domain(d, headers, data.get('tls_profile')))
+
+    return stream_response({'results': streaming.Items('stage4', results), 'job_id': job.id,
+                            'input': prepared.as_dict(), 'budget': lambda: finish_job(job)}, job)
 
 @app.route('/api/run-all', methods=['POST'])
 def run_all():
     """Запуск всех этапов последовательно"""
     data = request.json
-    domains = data.get('domains', [])
+    prepared = prepare_domains(data.get('domains') or [])
+    domains = prepared.domains
     ip_address = data.get('ip_address', '')
+    targets = normalize_targets(data.get('targets'))
     api_keys = data.get('api_keys', {})
-    
-    if not domains or not ip_address:
-        return jsonify({'error': 'Домены и IP адрес обязательны'}), 400
-    
+
+    if not domains or not (ip_address or targets):
+        return jsonify({'error': 'Домены и IP адрес обязательны', 'input': prepared.as_dict()}), 400
+
     if not api_keys.get('cloudflare_email') or not api_keys.get('cloudflare_api_key'):
         return jsonify({'error': 'API ключи Cloudflare не настроены. Заполните настройки API.'}), 400
-    
+
     if not api_keys.get('registrar_api_key'):
         return jsonify({'error': 'API ключи Ukraine.com.ua не настроены. Заполните настройки API.'}), 400
-    
+
+    try:
+        template = record_templates.compile_template(data.get('record_template'))
+    except record_templates.TemplateError as e:
+        return jsonify({'error': f'Ошибка в шаблоне записей: {e}'}), 400
+
+    headers = get_cloudflare_headers(api_keys)
+    # Все четыре этапа - одно задание, чтобы трассировка была сквозной
+    stages = (['snapshot'] if data.get('snapshot') else []) + ALL_STAGES
+    try:
+        job = start_job('run-all', stages, domains, data, api_keys, len(template))
+    except quota.QuotaExceeded as e:
+        return jsonify({'error': str(e), 'budget': e.details}), 429
+
+    # Снимок текущих записей до изменений (snapshot=true)
+    manifest = snapshot_results = None
+    if data.get('snapshot'):
+        manifest, snapshot_results = take_snapshot(job, domains, api_keys)
+
+    # Применённые на этапе 1 наборы записей - для засева зон на этапе 2
+    known_records = {}
+    seed_records = seed_source(known_records, api_keys) if data.get('seed_from_registrar') else None
+
+    # Этапы выполняются по очереди по мере отдачи ответа; в памяти только
+    # множества успешно обработанных доменов (для регистрации в реестре дрейфа)
+    succeeded = {stage: set() for stage in ALL_STAGES}
+    handlers = {
+        'stage1': guarded_by_snapshot(manifest, lambda d: stage1_domain(
+            d, template, record_templates.domain_variables(d, targets, ip_address), api_keys,
+            bool(data.get('refresh')), known_records)),
+        'stage2': lambda d: stage2_domain(d, headers, seed_records),
+        'stage3': lambda d: stage3_domain(d, headers, api_keys),
+        'stage4': lambda d: stage4_domain(d, headers, data.get('tls_profile')),
+    }
     all_results = {
-        'stage1': None,
-        'stage2': None,
-        'stage3': None,
-        'stage4': None
+        stage: {'results': streaming.Items(stage, track_success(
+            iter_stage(job, stage, domains, handlers[stage]), succeeded[stage]))}
+        for stage in ALL_STAGES
     }
-    
-    # Используем test_client для вызова эндпоинтов
-    with app.test_client() as client:
-        # Этап 1
-        stage1_response = client.post('/api/stage1', json={
-            'domains': domains,
-            'ip_address': ip_address,
-            'api_keys': api_keys
-        })
-        all_results['stage1'] = stage1_response.get_json()
-        
-        # Этап 2
-        stage2_response = client.post('/api/stage2', json={
-            'domains': domains,
-            'api_keys': api_keys
-        })
-        all_results['stage2'] = stage2_response.get_json()
-        
-        # Этап 3
-        stage3_response = client.post('/api/stage3', json={
-            'domains': domains,
-            'api_keys': api_keys
-        })
-        all_results['stage3'] = stage3_response.get_json()
-        
-        # Этап 4
-        stage4_response = client.post('/api/stage4', json={
-            'domains': domains,
-            'api_keys': api_keys
+    all_results['job_id'] = job.id
+    all_results['input'] = prepared.as_dict()
+    if manifest is not None:
+        all_results['snapshot'] = {'id': manifest['id'], 'results': snapshot_results}
+
+    def finish():
+        register_managed(succeeded, api_keys, known_records, lambda d: data.get('tls_profile'))
+        return finish_job(job)
+
+    all_results['budget'] = finish
+    return stream_response(all_results, job)
+
+def iter_import_chunk(job, rows, stages, accounts, template, seed=False, workers=1):
+    """
+    Обработка пачки строк импорта всеми выбранными этапами
+
+    Генератор пар (этап, результат) по мере готовности. Строки группируются
+    по аккаунту: у каждого свой набор ключей и своя квота.
+    """
+    by_account = {}
+    for row in rows:
+        by_account.setdefault(row['account'], []).append(row)
+
+    for account, account_rows in by_account.items():
+        api_keys = accounts.get(account)
+        if api_keys is None:
+            for row in account_rows:
+                result = outcomes.error(row['domain'], 'unknown_account', account)
+                job.tally('import', result)
+                yield 'import', result
+            continue
+
+        domains = [row['domain'] for row in account_rows]
+        quota.reserve(job, quota.estimate_job(stages, domains, api_keys, len(template), seed), api_keys)
+
+        headers = get_cloudflare_headers(api_keys)
+        known_records = {}
+        seed_records = seed_source(known_records, api_keys) if seed else None
+        profiles = {row['domain']: row['tls_profile'] for row in account_rows}
+        targets = {row['domain']: dict(row['vars'], ip=row['ip']) for row in account_rows}
+        handlers = {
+            'stage1': lambda d: stage1_domain(d, template, targets[d], api_keys, known_records=known_records),
+            'stage2': lambda d: stage2_domain(d, headers, seed_records),
+            'stage3': lambda d: stage3_domain(d, headers, api_keys),
+            'stage4': lambda d: stage4_domain(d, headers, profiles[d]),
+        }
+        stage_succeeded = {}
+        for stage in stages:
+            stage_succeeded[stage] = set()
+            for result in track_success(iter_stage(job, stage, domains, handlers[stage], workers),
+                                        stage_succeeded[stage]):
+                yield stage, result
+        register_managed(stage_succeeded, api_keys, known_records, profiles.get)
+
+def run_import_chunk(job, rows, stages, accounts, template, seed=False):
+    """Обработка пачки строк импорта с сохранением результатов в задании"""
+    for stage, result in iter_import_chunk(job, rows, stages, accounts, template, seed):
+        job.add_results(stage, [result])
+
+def account_fingerprint(api_keys):
+    """Необратимый отпечаток ключей аккаунта: узлы сверяют ключи, не передавая их"""
+    return quota.account_key('\n'.join(
+        api_keys.get(field) or '' for field in ('cloudflare_email', 'cloudflare_api_key', 'registrar_api_key')
+    ))
+
+def shard_accounts():
+    """
+    Аккаунты этого узла для задач распределённого импорта: аккаунт по
+    умолчанию ('') из настроек приложения и именованные из SHARD_ACCOUNTS_FILE
+    """
+    accounts = {'': drift.configured_api_keys()}
+    if SHARD_ACCOUNTS_FILE:
+        try:
+            with open(SHARD_ACCOUNTS_FILE, encoding='utf-8') as f:
+                accounts.update(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Ошибка загрузки аккаунтов SHARD_ACCOUNTS_FILE: {e}")
+    return accounts
+
+def run_shard_task(task):
+    """Выполнение задачи распределённого импорта на этом узле (см. sharding.py)"""
+    payload = task['payload']
+    # В задаче только имена и отпечатки аккаунтов; ключи - из настроек узла.
+    # Аккаунт, которого на узле нет или ключи которого другие, даёт unknown_account.
+    local = shard_accounts()
+    accounts = {name: local[name] for name, fingerprint in payload['accounts'].items()
+                if name in local and account_fingerprint(local[name]) == fingerprint}
+    deadline_at = task['deadline_at']
+    if deadline_at and time.time() >= deadline_at:
+        return [('import', deadline_result(row['domain'], None, started=False).to_record())
+                for row in payload['rows']]
+
+    job = jobs.create_job('shard', priority=payload['priority'])
+    job.status = 'running'
+    job.started_at = time.time()
+    job.start_clock(deadline_at - time.time() if deadline_at else 0)
+    template = record_templates.compile_template(payload['record_template'])
+    try:
+        with jobs.activate(job):
+            return [(stage, result.to_record()) for stage, result in iter_import_chunk(
+                job, payload['rows'], payload['stages'], accounts, template, payload['seed'])]
+    finally:
+        quota.release(job)
+        job.status = 'done'
+        job.finished_at = time.time()
+
+def distribute_import(job, chunks, stages, accounts, record_template, seed, stats):
+    """
+    Импорт через общее хранилище: пачки становятся задачами, которые
+    выполняют рабочие потоки всех узлов; результаты собираются в задание
+    """
+    store = sharding.get_store()
+    store.purge(time.time() - SHARD_RETENTION)
+    left = deadlines.remaining()
+    store.create_job(job.id, job.kind, time.time() + left if left is not None else None)
+    # Ключи в общее хранилище не пишем: узлы найдут аккаунт по имени у себя
+    account_refs = {name: account_fingerprint(keys) for name, keys in accounts.items()}
+    cursor = 0
+    applied = 'running'
+
+    def sync_control():
+        """Команда, пришедшая этому заданию, - в хранилище, пришедшая через хранилище - заданию"""
+        nonlocal applied
+        local = job.poll_control()
+        shared = store.job_status(job.id)['control']
+        if shared != applied:
+            job.set_control(shared)
+            applied = shared
+        elif local != applied:
+            if local == 'cancelling':
+                store.cancel_job(job.id)
+            else:
+                store.pause_job(job.id, local == 'paused')
+            applied = local
+        return job.control
+
+    def collect():
+        nonlocal cursor
+        while True:
+            batch = store.results(job.id, after=cursor)
+            if not batch:
+                return
+            for cursor, stage, record in batch:
+                result = outcomes.coerce(record)
+                job.tally(stage, result)
+                job.add_results(stage, [result])
+
+    for chunk in chunks:
+        control = sync_control()
+        while control == 'paused':
+            # Файл дальше не читаем; узлы не берут задачи приостановленного задания
+            job.wait_control(JOB_CONTROL_POLL)
+            control = sync_control()
+        if control == 'cancelling':
+            # Новые пачки не ставятся, поставленные отменены; взятые в работу узлы доделают
+            break
+        store.add_task(job.id, {
+            'rows': chunk,
+            'stages': stages,
+            'accounts': account_refs,
+            'record_template': record_template,
+            'seed': seed,
+            'priority': job.priority,
         })
-        all_results['stage4'] = stage4_response.get_json()
-    
-    return jsonify(all_results)
+        job.update_progress(**stats.as_dict())
+        collect()
+    store.seal(job.id)
+
+    while True:
+        collect()
+        shards = store.job_status(job.id)['tasks']
+        job.update_progress(shards=shards)
+        if not shards['pending'] and not shards['claimed']:
+            break
+        if sync_control() == 'cancelling':
+            collect()
+            return
+        if deadlines.expired():
+            # Узлы сами не начнут задачи после дедлайна задания
+            job.status = 'deadline_exceeded'
+            job.error = 'Превышен бюджет времени задания'
+            return
+        time.sleep(sharding.POLL_INTERVAL)
+
+    collect()
+    for _task_id, payload, error in store.failed_tasks(job.id):
+        for row in payload['rows']:
+            result = outcomes.error(row['domain'], 'task_failed', error)
+            job.tally('import', result)
+            job.add_results('import', [result])
+
+# Рабочий поток распределённых задач (SHARDING_ENABLED, SHARD_WORKER_TASKS > 0)
+if SHARDING_ENABLED and SHARD_WORKER_TASKS > 0:
+    sharding.start(run_shard_task)
+
+def process_import(job, path, fmt, stages, defaults, accounts, template, seed=False, record_template=None):
+    """Фоновая обработка файла импорта: потоковый разбор и пачки по этапам"""
+    stats = importer.ImportStats()
+    try:
+        with open(path, 'rb') as f:
+            if SHARDING_ENABLED:
+                chunks = importer.iter_import_chunks(f, fmt, SHARD_TASK_SIZE, stats, defaults)
+                distribute_import(job, chunks, stages, accounts, record_template, seed, stats)
+                return
+            for chunk in importer.iter_import_chunks(f, fmt, IMPORT_CHUNK_SIZE, stats, defaults):
+                job.update_progress(**stats.as_dict())
+                try:
+                    run_import_chunk(job, chunk, stages, accounts, template, seed)
+                except quota.QuotaExceeded as e:
+                    job.status = 'quota_exceeded'
+                    job.error = str(e)
+                    job.update_progress(budget=e.details)
+                    return
+                if deadlines.expired():
+                    # Оставшиеся строки файла не обрабатываются
+                    job.status = 'deadline_exceeded'
+                    job.error = 'Превышен бюджет времени задания'
+                    return
+                if job.cancel_requested:
+                    return
+    finally:
+        job.update_progress(**stats.as_dict())
+        quota.release(job)
+        os.remove(path)
+
+@app.route('/api/import', methods=['POST'])
+def import_domains():
+    """
+    Массовый импорт доменов из CSV или NDJSON
+
+    Файл сохраняется на диск по частям, разбирается и обрабатывается в фоне.
+    Принимает multipart (поле file) или тело запроса целиком
+    (Content-Type: text/csv / application/x-ndjson), параметры - в query/form:
+    stages, ip_address, tls_profile, format, api_keys (JSON), accounts (JSON),
+    record_template (JSON), seed_from_registrar, time_budget (сек, по умолчанию
+    без ограничения), priority (по умолчанию bulk). Дополнительные колонки файла -
+    переменные шаблона.
+    """
+    params = request.form if request.files else request.args
+    upload = request.files.get('file')
+
+    try:
+        api_keys = json.loads(params.get('api_keys') or '{}')
+        accounts = json.loads(params.get('accounts') or '{}')
+        record_template = json.loads(params['record_template']) if params.get('record_template') else None
+    except ValueError:
+        return jsonify({'error': 'api_keys, accounts и record_template должны быть JSON'}), 400
+
+    try:
+        template = record_templates.compile_template(record_template)
+    except record_templates.TemplateError as e:
+        return jsonify({'error': f'Ошибка в шаблоне записей: {e}'}), 400
+
+    stages = [s.strip() for s in (params.get('stages') or ','.join(ALL_STAGES)).split(',') if s.strip()]
+    if not stages or any(s not in ALL_STAGES for s in stages):
+        return jsonify({'error': f'Неизвестный этап. Допустимые: {", ".join(ALL_STAGES)}'}), 400
+
+    # Ключи без имени аккаунта - аккаунт по умолчанию
+    accounts = dict(accounts)
+    if api_keys:
+        accounts[''] = api_keys
+    if not accounts:
+        return jsonify({'error': 'API ключи не настроены. Заполните настройки API.'}), 400
+    if SHARDING_ENABLED:
+        # Узлы берут ключи из своих настроек: ключи из запроса должны с ними совпадать
+        local = shard_accounts()
+        unknown = sorted(name for name, keys in accounts.items()
+                         if name not in local or account_fingerprint(local[name]) != account_fingerprint(keys))
+        if unknown:
+            names = ', '.join(name or '(по умолчанию)' for name in unknown)
+            return jsonify({'error': f'Распределённый импорт берёт ключи из настроек узлов: аккаунты {names} '
+                                     f'не настроены (SHARD_ACCOUNTS_FILE) или ключи отличаются'}), 400
+
+    fmt = importer.detect_format(upload.filename if upload else '', request.content_type, params.get('format'))
+    defaults = {
+        'ip': (params.get('ip_address') or '').strip(),
+        'tls_profile': (params.get('tls_profile') or '').strip(),
+    }
+
+    # Копируем загрузку во временный файл блоками, не читая её в память целиком
+    fd, path = tempfile.mkstemp(prefix='dns-import-', suffix=f'.{fmt}')
+    with os.fdopen(fd, 'wb') as f:
+        shutil.copyfileobj(upload.stream if upload else request.stream, f, 1024 * 1024)
+
+    job = jobs.create_job('import', trace=params.get('trace') == 'true', priority=priority_param(params.get('priority'), 'bulk'))
+    job.time_budget = time_budget_param(params.get('time_budget'), 0)
+    jobs.submit(job, process_import, path, fmt, stages, defaults, accounts, template,
+                params.get('seed_from_registrar') == 'true', record_template)
+
+    return jsonify({'job_id': job.id, 'status': job.status}), 202
+
+@app.route('/api/snapshot', methods=['POST'])
+def snapshot():
+    """Снимок текущих DNS записей регистратора для списка доменов"""
+    data = request.json
+    prepared = prepare_domains(data.get('domains') or [])
+    domains = prepared.domains
+    api_keys = data.get('api_keys', {})
+
+    if not domains:
+        return jsonify({'error': 'Список доменов обязателен', 'input': prepared.as_dict()}), 400
+
+    if not api_keys.get('registrar_api_key'):
+        return jsonify({'error': 'API ключи не настроены. Заполните настройки API.'}), 400
+
+    try:
+        job = start_job('snapshot', ['snapshot'], domains, data, api_keys)
+    except quota.QuotaExceeded as e:
+        return jsonify({'error': str(e), 'budget': e.details}), 429
+
+    manifest, results = take_snapshot(job, domains, api_keys)
+    return jsonify({'snapshot_id': manifest['id'], 'results': [r.as_dict() for r in results], 'job_id': job.id,
+                    'input': prepared.as_dict(), 'totals': job.summary.as_dict(), 'budget': finish_job(job)})
+
+@app.route('/api/snapshots/<snapshot_id>', methods=['GET'])
+def snapshot_info(snapshot_id):
+    """Состав снимка: домены и хеши наборов записей"""
+    try:
+        return jsonify(snapshots.load_manifest(snapshot_id))
+    except snapshots.SnapshotNotFound as e:
+        return jsonify({'error': str(e)}), 404
+
+@app.route('/api/rollback', methods=['POST'])
+def rollback():
+    """
+    Откат DNS записей к снимку
+
+    domains - подмножество доменов снимка (по умолчанию весь пакет).
+    Записи приводятся к снимку сверкой: совпадающие не трогаются.
+    """
+    data = request.json
+    api_keys = data.get('api_keys', {})
+
+    if not api_keys.get('registrar_api_key'):
+        return jsonify({'error': 'API ключи не настроены. Заполните настройки API.'}), 400
+
+    try:
+        manifest = snapshots.load_manifest(data.get('snapshot_id', ''))
+    except snapshots.SnapshotNotFound as e:
+        return jsonify({'error': str(e)}), 404
+
+    if manifest['account'] != quota.accounts_for(api_keys)['ukraine']:
+        return jsonify({'error': 'Снимок сделан с другим API ключом регистратора'}), 400
+
+    domains = prepare_domains(data['domains']).domains if data.get('domains') else list(manifest['domains'])
+
+    def restore_calls(domain):
+        try:
+            records = snapshots.snapshot_records(manifest, domain)
+        except snapshots.SnapshotNotFound:
+            # Объект снимка пропал или повреждён: домен завершится ошибкой rollback_failed без запросов
+            return 0
+        return ukraine_expected_calls('restore', domain, api_keys, len(records or []))
+
+    # Оценка: чтение списка и сверка с набором из снимка для каждого домена
+    registrar_calls = sum(restore_calls(d) for d in domains)
+    estimate = {'ukraine': registrar_calls, 'cloudflare': 0,
+                'per_stage': {'rollback': {'ukraine': registrar_calls, 'cloudflare': 0}}}
+    job = jobs.create_job('rollback', trace=data.get('trace'), priority=priority_param(data.get('priority')))
+    job.start_clock(time_budget_param(data.get('time_budget'), JOB_TIME_BUDGET))
+    try:
+        quota.reserve(job, estimate, api_keys)
+    except quota.QuotaExceeded as e:
+        return jsonify({'error': str(e), 'budget': e.details}), 429
+
+    results = iter_stage(job, 'rollback', domains, lambda d: snapshots.rollback_domain(d, manifest, api_keys),
+                         SNAPSHOT_WORKERS)
+    return stream_response({'snapshot_id': manifest['id'], 'results': streaming.Items('rollback', results),
+                            'job_id': job.id, 'budget': lambda: finish_job(job)}, job)
+
+@app.route('/api/drift', methods=['GET'])
+def drift_summary():
+    """Реестр управляемых доменов: размер, давность проверок, домены с дрейфом"""
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    return jsonify(drift.summary(limit))
+
+@app.route('/api/drift/<domain>', methods=['GET', 'DELETE'])
+def drift_domain(domain):
+    """Состояние проверки домена; DELETE - снять домен с проверки"""
+    if request.method == 'DELETE':
+        if not drift.unregister(domain):
+            return jsonify({'error': 'Домен не найден в реестре'}), 404
+        return jsonify({'domain': domain, 'status': 'removed'})
+    status = drift.domain_status(domain)
+    if status is None:
+        return jsonify({'error': 'Домен не найден в реестре'}), 404
+    return jsonify(status)
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Статус задания и страница результатов (offset, limit)"""
+    job = jobs.get_job(job_id)
+    offset = request.args.get('offset', 0, type=int)
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    if not job and SHARDING_ENABLED:
+        # Задание другого узла - статус и результаты из общего хранилища
+        store = sharding.get_store()
+        status = store.job_status(job_id)
+        if status:
+            status['results'] = [outcomes.coerce(dict(record, stage=stage)).as_dict()
+                                 for _, stage, record in store.results(job_id, limit=limit, offset=offset)]
+            return jsonify(status)
+    if not job:
+        return jsonify({'error': 'Задание не найдено'}), 404
+    return jsonify(job.status_dump(offset, limit))
+
+@app.route('/api/jobs/<job_id>/trace', methods=['GET'])
+def job_trace(job_id):
+    """Дамп трассировки задания (span'ы записываются при trace=true)"""
+    job = jobs.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Задание не найдено'}), 404
+    return jsonify(job.trace_dump())
+
+@app.route('/api/jobs/<job_id>/budget', methods=['GET'])
+def job_budget(job_id):
+    """Учёт запросов задания: оценка, факт, разбивка по endpoint и доменам"""
+    job = jobs.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Задание не найдено'}), 404
+    budget = quota.report(job)
+    budget['per_stage'] = (job.budget_estimate or {}).get('per_stage', {})
+    budget['by_domain'] = job.calls_by_domain()
+    return jsonify(budget)
+
+@app.route('/api/jobs/<job_id>/<action>', methods=['POST'])
+def job_control(job_id, action):
+    """
+    Управление заданием: pause, resume или cancel
+
+    Задание другого воркера получает команду через JOB_CONTROL_DIR
+    (local=false в ответе), распределённый импорт - ещё и через общее
+    хранилище задач; команда действует перед следующим доменом.
+    """
+    if action not in jobs.CONTROL_ACTIONS:
+        return jsonify({'error': f'Неизвестная команда: {action}'}), 404
+    if not job_id.isalnum():
+        return jsonify({'error': 'Задание не найдено'}), 404
+    job = jobs.get_job(job_id)
+    if job is not None and job.status not in ('queued', 'running'):
+        return jsonify({'error': f'Задание уже завершено ({job.status})'}), 409
+    control = jobs.request_control(job_id, action)
+    if job is not None and control == 'paused':
+        # Резерв квоты не держим, пока задание стоит
+        quota.release(job)
+    return jsonify({
+        'job_id': job_id,
+        'control': control or jobs.CONTROL_ACTIONS[action],
+        'local': job is not None,
+    }), 202
+
+@app.route('/healthz/ready', methods=['GET'])
+def readiness():
+    """Готовность воркера: 503, пока идёт прогрев"""
+    state = warmup.state()
+    return jsonify(state), 200 if state['ready'] else 503
+
+def admin_only(view):
+    """Доступ только с заголовком X-Admin-Token = ADMIN_TOKEN (без токена endpoint выключен)"""
+    @wraps(view)
+    def guarded(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({'error': 'Не найдено'}), 404
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+            return jsonify({'error': 'Нет доступа'}), 403
+        return view(*args, **kwargs)
+    return guarded
+
+@app.route('/api/admin/profiles', methods=['GET', 'POST'])
+@admin_only
+def profiles():
+    """
+    Профилирование процесса (воркера, который принял запрос)
+
+    POST {job_id?, interval?, duration?} запускает сэмплирующий профилировщик:
+    с job_id - только потоки, обрабатывающие домены задания, без - все потоки.
+    GET - список последних профилей.
+    """
+    if request.method == 'GET':
+        return jsonify({'profiles': profiler.list_profiles()})
+    data = request.json or {}
+    job_id = data.get('job_id')
+    if job_id and not jobs.get_job(job_id):
+        return jsonify({'error': 'Задание не найдено в этом процессе'}), 404
+    try:
+        interval = max(float(data.get('interval') or PROFILE_INTERVAL), 0.001)
+        duration = int(data.get('duration') or PROFILE_MAX_SECONDS)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'interval и duration должны быть числами'}), 400
+    try:
+        profile = profiler.start(job_id, interval, duration)
+    except profiler.ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(profile.summary()), 201
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET', 'DELETE'])
+@admin_only
+def profile_detail(profile_id):
+    """
+    GET - сводка профиля, с ?format=collapsed - свёрнутые стеки для flamegraph;
+    DELETE - остановка профилирования
+    """
+    profile = profiler.get(profile_id)
+    if not profile:
+        return jsonify({'error': 'Профиль не найден'}), 404
+    if request.method == 'DELETE':
+        profile.stop()
+    elif request.args.get('format') == 'collapsed':
+        return Response(profile.collapsed(), mimetype='text/plain',
+                        headers={'Content-Disposition': f'attachment; filename=profile-{profile.id}.folded'})
+    return jsonify(profile.summary())
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Метрики исходящих запросов в формате Prometheus"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 def check_config():
     """Проверка конфигурации при запуске"""
@@ -0,0 +1,82 @@
+"""
+Кэш в памяти с TTL и вытеснением по LRU
+
+Потокобезопасен; размер ограничен max_size, самые давно использованные
+записи вытесняются первыми.
+
+Поколения ключей защищают от записи устаревшего значения: чтение, начатое до
+invalidate(), берёт generation(key) до запроса и передаёт его в set() - если
+ключ за это время сбросили, значение не сохраняется.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """LRU кэш с ограничением по размеру и временем жизни записей"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        # Ключ -> номер сброса; хранятся последние сброшенные ключи (самые
+        # старые вытесняются - незнакомое поколение тоже не совпадёт)
+        self._generations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Значение или None, если ключа нет или запись устарела"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= now:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def generation(self, key):
+        """Текущее поколение ключа (меняется при каждом invalidate)"""
+        with self._lock:
+            return self._generations.get(key, 0)
+
+    def set(self, key, value, ttl=None, generation=None):
+        """
+        Сохранение значения
+
+        generation - поколение ключа на момент начала чтения значения; если
+        ключ с тех пор сбросили, значение устарело и не сохраняется.
+        Returns: True, если значение сохранено.
+        """
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and self._generations.get(key, 0) != generation:
+                return False
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+        return True
+
+    def contains(self, key):
+        return self.get(key) is not None
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._generations[key] = self._generations.pop(key, 0) + 1
+            while len(self._generations) > self.max_size:
+                self._generations.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,212 @@
+"""
+Circuit breaker для исходящих запросов по провайдеру и endpoint
+
+Состояния:
+    closed    - запросы идут как обычно, считается доля ошибок в окне
+    open      - доля ошибок превысила порог: запросы сразу отклоняются
+                (CircuitOpenError) без ожидания таймаута
+    half_open - после паузы пропускается один пробный запрос; успех закрывает
+                breaker, ошибка снова открывает
+
+Ошибкой считаются сетевые исключения, таймауты, HTTP 5xx и 429.
+Ответы 4xx (в том числе 400 при переборе форматов регистратора) - не ошибка
+провайдера.
+
+Для каждого запроса проверяются два breaker'а: endpoint и провайдер целиком.
+"""
+
+import threading
+import time
+from collections import deque
+
+import metrics
+from config import (
+    BREAKER_WINDOW_SECONDS, BREAKER_MIN_CALLS, BREAKER_FAILURE_RATE, BREAKER_OPEN_SECONDS
+)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Endpoint провайдера целиком
+ALL_ENDPOINTS = '*'
+
+
+class CircuitOpenError(Exception):
+    """Запрос отклонён: breaker провайдера или endpoint открыт"""
+
+    def __init__(self, provider, endpoint, retry_in):
+        super().__init__(
+            f'{provider} ({endpoint}) временно недоступен: слишком много ошибок, '
+            f'повтор через {int(retry_in) + 1} с'
+        )
+        self.provider = provider
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Breaker с окном доли ошибок"""
+
+    def __init__(self, provider, endpoint):
+        self.provider = provider
+        self.endpoint = endpoint
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._outcomes = deque()  # (время, успех)
+        self._lock = threading.Lock()
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge('dns_circuit_breaker_state',
+                          {'provider': self.provider, 'endpoint': self.endpoint},
+                          _STATE_VALUES[self.state])
+
+    def _trim(self, now):
+        while self._outcomes and self._outcomes[0][0] < now - BREAKER_WINDOW_SECONDS:
+            self._outcomes.popleft()
+
+    def retry_in(self, now=None):
+        """Секунд до перехода в half_open (0, если breaker не открыт)"""
+        if self.state != OPEN:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.opened_at + BREAKER_OPEN_SECONDS - now)
+
+    def allow(self):
+        """
+        Проверка перед запросом
+
+        Returns:
+            True, если это пробный запрос в состоянии half_open
+
+        Raises:
+            CircuitOpenError: если запрос нужно отклонить
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN:
+                if now - self.opened_at < BREAKER_OPEN_SECONDS:
+                    raise CircuitOpenError(self.provider, self.endpoint, self.retry_in(now))
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+                self._publish()
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    raise CircuitOpenError(self.provider, self.endpoint, 1.0)
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def release_probe(self):
+        """Отмена пробного запроса, который так и не был отправлен"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record(self, success):
+        """Учёт результата запроса"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                if success:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                else:
+                    self.state = OPEN
+                    self.opened_at = now
+                self._publish()
+                return
+
+            self._outcomes.append((now, success))
+            self._trim(now)
+            if self.state == CLOSED and not success and len(self._outcomes) >= BREAKER_MIN_CALLS:
+                failures = sum(1 for _, ok in self._outcomes if not ok)
+                if failures / len(self._outcomes) >= BREAKER_FAILURE_RATE:
+                    self.state = OPEN
+                    self.opened_at = now
+                    self._publish()
+
+    def snapshot(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            total = len(self._outcomes)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            return {
+                'provider': self.provider,
+                'endpoint': self.endpoint,
+                'state': self.state,
+                'calls_in_window': total,
+                'failure_rate': round(failures / total, 3) if total else 0.0,
+                'retry_in': round(self.retry_in(), 1),
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider, endpoint):
+    key = (provider, endpoint)
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(key)
+            if breaker is None:
+                breaker = _breakers[key] = CircuitBreaker(provider, endpoint)
+    return breaker
+
+
+def before_call(provider, endpoint):
+    """
+    Проверка breaker'ов провайдера и endpoint перед запросом
+
+    Returns:
+        список breaker'ов, в которые нужно записать результат
+
+    Raises:
+        CircuitOpenError
+    """
+    breakers = [get_breaker(provider, ALL_ENDPOINTS), get_breaker(provider, endpoint)]
+    probes = []
+    for breaker in breakers:
+        try:
+            if breaker.allow():
+                probes.append(breaker)
+        except CircuitOpenError:
+            for probe in probes:
+                probe.release_probe()
+            metrics.inc('dns_circuit_breaker_rejections_total', {'provider': provider, 'endpoint': endpoint})
+            raise
+    return breakers
+
+
+def after_call(breakers, success):
+    for breaker in breakers:
+        breaker.record(success)
+
+
+def is_failure(status_code):
+    """Считается ли HTTP статус отказом провайдера"""
+    return status_code >= 500 or status_code == 429
+
+
+def seconds_until_retry():
+    """Через сколько секунд ближайший открытый breaker пропустит пробный запрос"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    waits = [b.retry_in() for b in breakers if b.state == OPEN]
+    return min(waits) if waits else 0.0
+
+
+def states(only_unhealthy=False):
+    """Состояние всех breaker'ов (для статуса заданий)"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    snapshots = [b.snapshot() for b in breakers]
+    if only_unhealthy:
+        snapshots = [s for s in snapshots if s['state'] != CLOSED]
+    return snapshots
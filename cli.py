@@ -0,0 +1,152 @@
+"""
+Запуск этапов из командной строки, без веб-сервера
+
+Домены читаются потоком из файла или stdin (CSV или NDJSON, как в
+/api/import), обрабатываются пачками тем же кодом этапов из app.py - с теми
+же пулами, очередями планировщика, лимитами API и circuit breaker'ами.
+Результаты пишутся в stdout в NDJSON, как в потоковом ответе этапов:
+
+    {"stage": "stage1", "result": {...}}
+    ...
+    {"summary": {"job_id": ..., "status": ..., "import": {...}, "budget": {...}}}
+
+Пример (cron/CI):
+
+    python cli.py run --stages stage1,stage2 --ip 203.0.113.10 domains.csv > results.ndjson
+    cut -d, -f1 domains.csv | python cli.py run --keys keys.json - > results.ndjson
+
+Код выхода: 0 - все домены обработаны успешно, 1 - есть ошибки доменов,
+3 - задание остановлено (квота или бюджет времени), 2 - ошибка параметров.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+EXIT_OK = 0
+EXIT_DOMAIN_ERRORS = 1
+EXIT_USAGE = 2
+EXIT_STOPPED = 3
+
+
+def _load_json(path, what):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f'Не удалось прочитать {what} из {path}: {e}', file=sys.stderr)
+        raise SystemExit(EXIT_USAGE)
+
+
+def run_batch(args, out):
+    """Потоковая обработка списка доменов; возвращает код выхода"""
+    # Фоновый планировщик дрейфа, рабочий поток задач и прогрев в одноразовом процессе не нужны
+    os.environ['DRIFT_CHECK_ENABLED'] = '0'
+    os.environ['SHARD_WORKER_TASKS'] = '0'
+    os.environ['WARMUP_ENABLED'] = '0'
+    import app as web_app
+    import deadlines
+    import drift
+    import importer
+    import jobs
+    import outcomes
+    import quota
+    import record_templates
+
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    if not stages or any(s not in web_app.ALL_STAGES for s in stages):
+        print(f'Неизвестный этап. Допустимые: {", ".join(web_app.ALL_STAGES)}', file=sys.stderr)
+        return EXIT_USAGE
+
+    api_keys = _load_json(args.keys, 'API ключи') if args.keys else drift.configured_api_keys()
+    accounts = _load_json(args.accounts, 'аккаунты') if args.accounts else {}
+    accounts = dict(accounts)
+    if api_keys:
+        accounts[''] = api_keys
+    try:
+        template = record_templates.compile_template(
+            _load_json(args.record_template, 'шаблон записей') if args.record_template else None)
+    except record_templates.TemplateError as e:
+        print(f'Ошибка в шаблоне записей: {e}', file=sys.stderr)
+        return EXIT_USAGE
+
+    defaults = {'ip': args.ip or '', 'tls_profile': args.tls_profile or ''}
+    fmt = importer.detect_format('' if args.input == '-' else args.input, '', args.format)
+    source = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+
+    job = jobs.create_job('cli', priority=web_app.priority_param(args.priority))
+    job.start_clock(args.time_budget)
+    stats = importer.ImportStats()
+    failed = 0
+
+    def emit(line):
+        out.write(json.dumps(line, ensure_ascii=False, default=outcomes.to_json) + '\n')
+        out.flush()
+
+    try:
+        with jobs.activate(job), source:
+            for chunk in importer.iter_import_chunks(source, fmt, args.chunk_size, stats, defaults):
+                try:
+                    for stage, result in web_app.iter_import_chunk(
+                            job, chunk, stages, accounts, template, args.seed_from_registrar, args.workers):
+                        if result.status != 'success':
+                            failed += 1
+                        emit({'stage': stage, 'result': result})
+                except quota.QuotaExceeded as e:
+                    job.status = 'quota_exceeded'
+                    job.error = str(e)
+                    break
+                if deadlines.expired():
+                    job.status = 'deadline_exceeded'
+                    job.error = 'Превышен бюджет времени задания'
+                    break
+    finally:
+        if job.status == 'running':
+            job.status = 'done'
+        quota.release(job)
+        emit({'summary': {
+            'job_id': job.id,
+            'status': job.status,
+            'error': job.error,
+            'import': stats.as_dict(),
+            'budget': quota.report(job),
+            'timing': job.timing(),
+            'totals': job.summary.as_dict(),
+        }})
+
+    if job.status != 'done':
+        return EXIT_STOPPED
+    return EXIT_DOMAIN_ERRORS if failed or stats.invalid else EXIT_OK
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Запуск этапов DNS/Cloudflare без веб-сервера')
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help='обработать список доменов и вывести результаты в NDJSON')
+    run.add_argument('input', help='файл CSV/NDJSON с доменами или - для stdin')
+    run.add_argument('--stages', default='stage1,stage2,stage3,stage4', help='этапы через запятую')
+    run.add_argument('--format', choices=('csv', 'ndjson'), help='формат входа (по умолчанию по расширению, иначе CSV)')
+    run.add_argument('--keys', help='JSON файл с API ключами (по умолчанию - из настроек приложения)')
+    run.add_argument('--accounts', help='JSON файл с наборами ключей по имени аккаунта (колонка account)')
+    run.add_argument('--ip', help='IP адрес по умолчанию для этапа 1')
+    run.add_argument('--tls-profile', help='профиль TLS по умолчанию для этапа 4')
+    run.add_argument('--record-template', help='JSON файл с шаблоном записей этапа 1')
+    run.add_argument('--seed-from-registrar', action='store_true', help='засев зон Cloudflare записями регистратора')
+    run.add_argument('--chunk-size', type=int, default=500, help='доменов в пачке')
+    run.add_argument('--workers', type=int, default=4, help='доменов пачки, обрабатываемых параллельно')
+    run.add_argument('--priority', default='bulk', help='приоритет задания: urgent, high, normal, bulk')
+    run.add_argument('--time-budget', type=int, default=0, help='бюджет времени задания, сек (0 - без ограничения)')
+    args = parser.parse_args(argv)
+
+    # Посторонний вывод (print в модулях) - в stderr, stdout только для NDJSON
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        return run_batch(args, out)
+    finally:
+        sys.stdout = out
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,8 +7,28 @@ load_dotenv()
 # Путь к файлу настроек
 SETTINGS_FILE = os.path.join(os.path.dirname(__file__), 'settings.json')
 
+# Прочитанные настройки и (mtime, размер) файла, из которого они прочитаны
+_settings_cache = {'stamp': None, 'settings': None}
+
+def _settings_stamp():
+    try:
+        stat = os.stat(SETTINGS_FILE)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
 def load_settings_from_file():
-    """Загрузка настроек из файла settings.json"""
+    """
+    Загрузка настроек из файла settings.json
+
+    Файл перечитывается, только если изменились его mtime или размер (в том
+    числе после сохранения настроек другим воркером).
+    """
+    stamp = _settings_stamp()
+    cached = _settings_cache['settings']
+    if cached is not None and _settings_cache['stamp'] == stamp:
+        return dict(cached)
+
     settings = {}
     
     # Сначала загружаем из переменных окружения
@@ -26,6 +46,8 @@ def load_settings_from_file():
         except Exception as e:
             print(f"Ошибка загрузки настроек из файла: {e}")
     
+    _settings_cache['stamp'] = stamp
+    _settings_cache['settings'] = dict(settings)
     return settings
 
 def save_settings_to_file(settings):
@@ -33,6 +55,7 @@ def save_settings_to_file(settings):
     try:
         with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
             json.dump(settings, f, indent=2, ensure_ascii=False)
+        _settings_cache['settings'] = None
         return True
     except Exception as e:
         print(f"Ошибка сохранения настроек: {e}")
@@ -53,3 +76,117 @@ REGISTRAR_API_KEY = _settings.get('REGISTRAR_API_KEY', '')
 # Cloudflare API base URL
 CLOUDFLARE_API_BASE = 'https://api.cloudflare.com/client/v4'
 
+# Лимиты API ukraine.com.ua: 300 запросов/час, 5000/сутки
+REGISTRAR_HOURLY_LIMIT = int(os.getenv('REGISTRAR_HOURLY_LIMIT', '300'))
+REGISTRAR_DAILY_LIMIT = int(os.getenv('REGISTRAR_DAILY_LIMIT', '5000'))
+
+# Лимит Cloudflare API: 1200 запросов за 5 минут на пользователя
+CLOUDFLARE_RATE_LIMIT = int(os.getenv('CLOUDFLARE_RATE_LIMIT', '1200'))
+
+# Фоновые задания: число потоков и размер пачки доменов при импорте из файла
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '500'))
+
+# Полный список публичных суффиксов (public_suffix_list.dat с publicsuffix.org);
+# пусто - встроенный список gTLD и зон .ua (см. domains.py)
+PUBLIC_SUFFIX_FILE = os.getenv('PUBLIC_SUFFIX_FILE', '')
+
+# Пауза и отмена заданий: каталог, через который команды доходят до
+# процесса-владельца задания (общий для воркеров gunicorn), и как часто
+# (сек) задание проверяет команды
+JOB_CONTROL_DIR = os.getenv('JOB_CONTROL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'job-control'))
+JOB_CONTROL_POLL = float(os.getenv('JOB_CONTROL_POLL', '0.5'))
+
+# Справедливое распределение между заданиями: сколько доменов всех заданий
+# обрабатываются одновременно (очередь по приоритетам, см. scheduler.py)
+TASK_SLOTS = int(os.getenv('TASK_SLOTS', '8'))
+
+# Распределение импорта между узлами (SHARDING_ENABLED=1): общее хранилище
+# (sqlite:///путь), доменов в задаче, срок аренды задачи (сек), сколько раз
+# аренда может истечь до признания задачи неудачной, задач на узел одновременно
+SHARDING_ENABLED = os.getenv('SHARDING_ENABLED', '').lower() in ('1', 'true', 'yes')
+SHARD_STORE = os.getenv('SHARD_STORE', 'sqlite:///' + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shards.db'))
+SHARD_TASK_SIZE = int(os.getenv('SHARD_TASK_SIZE', '50'))
+SHARD_LEASE_SECONDS = int(os.getenv('SHARD_LEASE_SECONDS', '30'))
+SHARD_MAX_ATTEMPTS = int(os.getenv('SHARD_MAX_ATTEMPTS', '3'))
+SHARD_WORKER_TASKS = int(os.getenv('SHARD_WORKER_TASKS', '2'))
+# Сколько секунд завершённое распределённое задание хранится в SHARD_STORE;
+# именованные аккаунты узла для задач импорта (JSON: имя -> ключи, как поле
+# accounts в /api/import) - ключи в общее хранилище не попадают
+SHARD_RETENTION = int(os.getenv('SHARD_RETENTION', str(7 * 24 * 3600)))
+SHARD_ACCOUNTS_FILE = os.getenv('SHARD_ACCOUNTS_FILE', '')
+
+# Прогрев воркера gunicorn после fork (WARMUP_ENABLED, включает
+# gunicorn.conf.py; вне gunicorn - скрипты, тесты, flask run - выключен):
+# соединений на провайдера, страниц списка зон в индекс дрейфа и через сколько
+# секунд считать воркер готовым, даже если прогрев не закончен (/healthz/ready)
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', '0').lower() in ('1', 'true', 'yes')
+WARMUP_CONNECTIONS = int(os.getenv('WARMUP_CONNECTIONS', '2'))
+WARMUP_ZONE_PAGES = int(os.getenv('WARMUP_ZONE_PAGES', '20'))
+WARMUP_TIMEOUT = int(os.getenv('WARMUP_TIMEOUT', '30'))
+# Блокировка хоста: индекс зон при прогреве заполняет один воркер на хост
+WARMUP_LOCK_FILE = os.getenv('WARMUP_LOCK_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'warmup.lock'))
+
+# Администрирование: токен для /api/admin/* (заголовок X-Admin-Token; без
+# токена эти endpoint'ы выключены), интервал сэмплирования профилировщика (сек)
+# и максимальная длительность профилирования (сек)
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.01'))
+PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', '300'))
+
+# Потоковые ответы этапов: как часто (сек) отдавать клиенту накопленную часть
+STREAM_FLUSH_SECONDS = float(os.getenv('STREAM_FLUSH_SECONDS', '1'))
+
+# Кэш списков DNS записей регистратора: время жизни (сек) и число доменов
+REGISTRAR_CACHE_TTL = int(os.getenv('REGISTRAR_CACHE_TTL', '300'))
+REGISTRAR_CACHE_SIZE = int(os.getenv('REGISTRAR_CACHE_SIZE', '10000'))
+
+# Таймаут исходящих запросов по умолчанию (сек)
+OUTBOUND_TIMEOUT = int(os.getenv('OUTBOUND_TIMEOUT', '30'))
+
+# Hedged чтения Cloudflare (HEDGE_ENABLED=1): endpoints, квантиль задержки,
+# после которой уходит дублирующий запрос, минимум наблюдений для оценки
+# квантиля, доля дублей от числа чтений и потоков для параллельных запросов
+HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', '').lower() in ('1', 'true', 'yes')
+HEDGE_ENDPOINTS = {e.strip() for e in os.getenv('HEDGE_ENDPOINTS', 'zones.list,zones.get').split(',') if e.strip()}
+HEDGE_QUANTILE = float(os.getenv('HEDGE_QUANTILE', '0.95'))
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '50'))
+HEDGE_MAX_RATE = float(os.getenv('HEDGE_MAX_RATE', '0.05'))
+HEDGE_WORKERS = int(os.getenv('HEDGE_WORKERS', '16'))
+
+# Circuit breaker: окно (сек), минимум запросов в окне, доля ошибок для
+# открытия, пауза до пробного запроса (сек) и сколько ждать закрытия
+# breaker'а для отложенных доменов (сек)
+BREAKER_WINDOW_SECONDS = int(os.getenv('BREAKER_WINDOW_SECONDS', '60'))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '5'))
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', '0.5'))
+BREAKER_OPEN_SECONDS = int(os.getenv('BREAKER_OPEN_SECONDS', '30'))
+BREAKER_PARK_MAX_WAIT = int(os.getenv('BREAKER_PARK_MAX_WAIT', '120'))
+
+# Бюджеты времени (сек): задание этапа/всех этапов и один домен на этапе.
+# Импорт из файла по умолчанию без общего ограничения (параметр time_budget)
+JOB_TIME_BUDGET = int(os.getenv('JOB_TIME_BUDGET', '3600'))
+DOMAIN_TIME_BUDGET = int(os.getenv('DOMAIN_TIME_BUDGET', '120'))
+
+# Запись исходящего трафика в JSONL (RECORD_TRAFFIC=1): каталог, размер файла
+# до ротации (МБ) и число старых файлов. Воспроизведение: REPLAY_FROM - файлы
+# записи через запятую, REPLAY_SPEED - ускорение (0 - без задержек)
+RECORD_TRAFFIC = os.getenv('RECORD_TRAFFIC', '').lower() in ('1', 'true', 'yes')
+RECORDINGS_DIR = os.getenv('RECORDINGS_DIR', os.path.join(os.path.dirname(__file__), 'recordings'))
+RECORDING_MAX_MB = int(os.getenv('RECORDING_MAX_MB', '50'))
+RECORDING_BACKUPS = int(os.getenv('RECORDING_BACKUPS', '10'))
+REPLAY_FROM = os.getenv('REPLAY_FROM', '')
+REPLAY_SPEED = float(os.getenv('REPLAY_SPEED', '1'))
+
+# Снимки DNS записей регистратора: каталог хранилища и число параллельных чтений
+SNAPSHOTS_DIR = os.getenv('SNAPSHOTS_DIR', os.path.join(os.path.dirname(__file__), 'snapshots'))
+SNAPSHOT_WORKERS = int(os.getenv('SNAPSHOT_WORKERS', '4'))
+
+# Проверка дрейфа управляемых доменов: включение фонового планировщика,
+# файл реестра, длительность такта (сек), доля лимитов API на проверку и
+# автоматическое исправление найденного расхождения
+DRIFT_CHECK_ENABLED = os.getenv('DRIFT_CHECK_ENABLED', '').lower() in ('1', 'true', 'yes')
+FLEET_DB = os.getenv('FLEET_DB', os.path.join(os.path.dirname(__file__), 'fleet.db'))
+DRIFT_INTERVAL = int(os.getenv('DRIFT_INTERVAL', '60'))
+DRIFT_QUOTA_SHARE = float(os.getenv('DRIFT_QUOTA_SHARE', '0.2'))
+DRIFT_AUTO_FIX = os.getenv('DRIFT_AUTO_FIX', '1').lower() in ('1', 'true', 'yes')
@@ -0,0 +1,83 @@
+"""
+Дедлайны заданий и доменов
+
+Дедлайн хранится в contextvar как момент time.monotonic(). Вложенные
+области только сужают его: домен не может получить больше времени, чем
+осталось у задания. outbound_request() берёт остаток как таймаут запроса,
+а после истечения дедлайна запросы не отправляются вовсе (DeadlineExceeded),
+так что переборы endpoint'ов регистратора не умножают время ожидания.
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+
+import metrics
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Время задания или домена истекло"""
+
+    def __init__(self, message='Превышено время выполнения'):
+        super().__init__(message)
+
+
+def deadline_after(seconds):
+    """Момент (monotonic) через seconds секунд; None для 0/None - без ограничения"""
+    if not seconds:
+        return None
+    return time.monotonic() + float(seconds)
+
+
+@contextmanager
+def scope(deadline):
+    """Область с дедлайном (не позже уже действующего)"""
+    current = _deadline.get()
+    if current is not None and (deadline is None or current < deadline):
+        deadline = current
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Оставшееся время в секундах (None - без ограничения)"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired():
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check(what='запрос'):
+    """Исключение, если дедлайн уже истёк"""
+    if expired():
+        metrics.inc('dns_deadline_exceeded_total', {'what': what})
+        raise DeadlineExceeded(f'Превышено время выполнения, {what} отменён')
+
+
+def timeout_for(requested):
+    """
+    Таймаут исходящего запроса с учётом дедлайна
+
+    Returns:
+        requested, если дедлайна нет или он дальше; иначе остаток времени
+
+    Raises:
+        DeadlineExceeded: дедлайн уже истёк
+    """
+    check()
+    left = remaining()
+    if left is None:
+        return requested
+    if isinstance(requested, tuple):
+        return tuple(min(t, left) for t in requested)
+    return min(requested, left)
@@ -0,0 +1,648 @@
+"""
+Фоновая проверка дрейфа управляемых доменов
+
+Домен, прошедший все четыре этапа, регистрируется в реестре (SQLite,
+FLEET_DB) вместе с желаемым состоянием: набор записей этапа 1 и настройки
+TLS этапа 4. Планировщик (DRIFT_CHECK_ENABLED=1) периодически перепроверяет
+реестр и исправляет только то, что разошлось:
+
+- Cloudflare: статус зоны берётся из постраничного списка зон (50 зон за
+  запрос, индекс обновляется по странице за такт). Зона в индексе не active -
+  статус перепроверяется свежим GET /zones/{id} (индекс может отставать на
+  полный проход), и если NS у регистратора действительно вернули назад, они
+  выставляются заново; зона pending ещё ждёт NS после переноса и только
+  попадает в отчёт. Настройки зоны
+  читаются одним запросом GET /zones/{id}/settings, отличающиеся
+  исправляются одним PATCH /zones/{id}/settings (patch_zone_settings).
+- Регистратор: список записей читается в обход кэша и сверяется с желаемым
+  набором; при расхождении - сверка ukraine_reconcile_dns_records.
+
+Проверки Cloudflare и регистратора идут независимо, каждая в порядке
+давности последней проверки. На такт (DRIFT_INTERVAL секунд) планировщик
+получает DRIFT_QUOTA_SHARE от лимита провайдера и распределяет проверки
+равномерно по такту, без всплесков. Бюджет (TickBudget) считается в запросах:
+худший случай проверки и исправления списывается заранее
+(ukraine_expected_calls, cloudflare_check_calls), неиспользованное
+возвращается, остаток копится между тактами. Исправление NS тратит тот же
+бюджет регистратора, что и сверка записей; проверка, которой не хватило
+бюджета, откладывается (DeferredCheck) и идёт первой в следующем такте.
+
+Проверка работает с ключами из настроек приложения (settings.json/.env):
+домены, зарегистрированные с другими ключами, пропускаются.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import deadlines
+import metrics
+import quota
+from circuit_breaker import CircuitOpenError
+from config import (
+    CLOUDFLARE_API_BASE, FLEET_DB, DRIFT_INTERVAL, DRIFT_QUOTA_SHARE, DRIFT_AUTO_FIX,
+    DOMAIN_TIME_BUDGET, REGISTRAR_HOURLY_LIMIT, CLOUDFLARE_RATE_LIMIT,
+    load_settings_from_file
+)
+from http_client import outbound_request
+from ukraine_registrar import (
+    ukraine_get_dns_records,
+    ukraine_reconcile_dns_records,
+    ukraine_update_nameservers,
+    ukraine_expected_calls,
+    extract_dns_records,
+    dns_records_drift
+)
+
+# Зон в одной странице списка Cloudflare (максимум API)
+ZONE_PAGE_SIZE = 50
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS managed_domains (
+    domain TEXT PRIMARY KEY,
+    account TEXT NOT NULL,
+    records TEXT NOT NULL,
+    tls TEXT NOT NULL,
+    registered_at REAL NOT NULL,
+    cloudflare_checked REAL NOT NULL DEFAULT 0,
+    registrar_checked REAL NOT NULL DEFAULT 0,
+    cloudflare_drift TEXT,
+    registrar_drift TEXT,
+    last_fixed REAL
+);
+CREATE INDEX IF NOT EXISTS managed_cloudflare_stale ON managed_domains(account, cloudflare_checked);
+CREATE INDEX IF NOT EXISTS managed_registrar_stale ON managed_domains(account, registrar_checked);
+'''
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def _connect():
+    global _schema_ready
+    conn = sqlite3.connect(FLEET_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.executescript(_SCHEMA)
+                _schema_ready = True
+    return conn
+
+
+def fleet_account(api_keys):
+    """Аккаунт реестра: пара аккаунтов регистратора и Cloudflare"""
+    accounts = quota.accounts_for(api_keys)
+    return f"{accounts['ukraine']}:{accounts['cloudflare']}"
+
+
+def register(domain, api_keys, records, tls):
+    """Регистрация (или обновление желаемого состояния) управляемого домена"""
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                '''INSERT INTO managed_domains (domain, account, records, tls, registered_at)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(domain) DO UPDATE SET account = excluded.account,
+                       records = excluded.records, tls = excluded.tls,
+                       cloudflare_drift = NULL, registrar_drift = NULL''',
+                (domain, fleet_account(api_keys), json.dumps(records), json.dumps(tls), time.time())
+            )
+    finally:
+        conn.close()
+
+
+def unregister(domain):
+    conn = _connect()
+    try:
+        with conn:
+            return conn.execute('DELETE FROM managed_domains WHERE domain = ?', (domain,)).rowcount > 0
+    finally:
+        conn.close()
+
+
+def _stalest(account, column, limit):
+    if limit <= 0:
+        return []
+    conn = _connect()
+    try:
+        return conn.execute(
+            f'SELECT * FROM managed_domains WHERE account = ? ORDER BY {column} LIMIT ?',
+            (account, limit)
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def _save_check(domain, provider, drift, fixed):
+    column = 'cloudflare' if provider == 'cloudflare' else 'registrar'
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                f'''UPDATE managed_domains SET {column}_checked = ?, {column}_drift = ?,
+                        last_fixed = CASE WHEN ? THEN ? ELSE last_fixed END
+                    WHERE domain = ?''',
+                (time.time(), json.dumps(drift) if drift else None, bool(fixed), time.time(), domain)
+            )
+    finally:
+        conn.close()
+
+
+def _row_dict(row):
+    item = dict(row)
+    for key in ('records', 'tls', 'cloudflare_drift', 'registrar_drift'):
+        item[key] = json.loads(item[key]) if item[key] else None
+    return item
+
+
+def domain_status(domain):
+    conn = _connect()
+    try:
+        row = conn.execute('SELECT * FROM managed_domains WHERE domain = ?', (domain,)).fetchone()
+    finally:
+        conn.close()
+    return _row_dict(row) if row else None
+
+
+def summary(limit=100):
+    """Размер реестра, давность проверок и домены с непогашенным дрейфом"""
+    conn = _connect()
+    try:
+        totals = conn.execute(
+            '''SELECT COUNT(*) AS total,
+                      MIN(cloudflare_checked) AS oldest_cloudflare_check,
+                      MIN(registrar_checked) AS oldest_registrar_check,
+                      SUM(cloudflare_drift IS NOT NULL OR registrar_drift IS NOT NULL) AS drifted
+               FROM managed_domains'''
+        ).fetchone()
+        drifted = conn.execute(
+            '''SELECT * FROM managed_domains
+               WHERE cloudflare_drift IS NOT NULL OR registrar_drift IS NOT NULL
+               ORDER BY domain LIMIT ?''', (limit,)
+        ).fetchall()
+    finally:
+        conn.close()
+    result = dict(totals)
+    result['drifted'] = result['drifted'] or 0
+    result['drifted_domains'] = [_row_dict(row) for row in drifted]
+    result['scheduler'] = _scheduler.state() if _scheduler else None
+    return result
+
+
+def _cf(method, endpoint, path, headers, **kwargs):
+    return outbound_request('cloudflare', endpoint, method, f'{CLOUDFLARE_API_BASE}{path}', headers=headers, **kwargs)
+
+
+def _error_message(response):
+    try:
+        errors = response.json().get('errors') or [{}]
+    except ValueError:
+        return f'HTTP {response.status_code}'
+    return errors[0].get('message') or f'HTTP {response.status_code}'
+
+
+def patch_zone_settings(zone_id, settings, headers):
+    """
+    Установка настроек зоны одним запросом PATCH /zones/{id}/settings (items)
+
+    Если Cloudflare отклонил пакет как некорректный (400), настройки ставятся
+    по одной - так применяются исправные и видно, какая именно не прошла.
+    Любой другой ответ (429, 403, 5xx) - ошибка для всех настроек сразу:
+    лимит или недоступный API поштучными запросами только добивать.
+
+    Returns:
+        {настройка: текст ошибки} для не применённых настроек (пусто - все применены)
+    """
+    if not settings:
+        return {}
+    items = [{'id': setting, 'value': value} for setting, value in settings.items()]
+    response = _cf('PATCH', 'settings.edit', f'/zones/{zone_id}/settings', headers, json={'items': items})
+    if response.status_code == 200:
+        applied = {item.get('id') for item in response.json().get('result') or []}
+        return {setting: 'Cloudflare не применил настройку' for setting in settings if setting not in applied}
+    if response.status_code != 400 or len(settings) == 1:
+        return {setting: _error_message(response) for setting in settings}
+    failed = {}
+    for setting, value in settings.items():
+        single = _cf('PATCH', f'settings.{setting}', f'/zones/{zone_id}/settings/{setting}', headers,
+                     json={'value': value})
+        if single.status_code != 200:
+            failed[setting] = _error_message(single)
+    return failed
+
+
+class ZoneIndex:
+    """
+    Индекс зон Cloudflare, обновляемый постранично
+
+    Каждый вызов fetch_page() читает следующую страницу списка зон; после
+    последней страницы проход начинается заново, зоны, не встретившиеся за
+    весь проход, удаляются из индекса.
+    """
+
+    def __init__(self):
+        self.zones = {}
+        self.next_page = 1
+        self.total_pages = None
+        self.cycle_started = time.time()
+        self._seen = {}
+        # Страницы читают планировщик и прогрев: без блокировки оба возьмут
+        # один номер страницы, а удаление устаревших зон пересечётся с записью
+        self._lock = threading.Lock()
+
+    def fetch_page(self, headers):
+        with self._lock:
+            response = _cf('GET', 'zones.list',
+                           f'/zones?page={self.next_page}&per_page={ZONE_PAGE_SIZE}&order=name', headers)
+            if response.status_code != 200:
+                return False
+            body = response.json()
+            now = time.time()
+            for zone in body.get('result', []):
+                self.zones[zone['name']] = zone
+                self._seen[zone['name']] = now
+            self.total_pages = (body.get('result_info') or {}).get('total_pages') or 1
+            self.next_page += 1
+            if self.next_page > self.total_pages:
+                stale = [name for name, seen in self._seen.items() if seen < self.cycle_started]
+                for name in stale:
+                    self.zones.pop(name, None)
+                    self._seen.pop(name, None)
+                self.next_page = 1
+                self.cycle_started = now
+            size = len(self.zones)
+        metrics.set_gauge('dns_drift_zone_index_size', {}, size)
+        return True
+
+    def _store(self, zone):
+        with self._lock:
+            self.zones[zone['name']] = zone
+            self._seen[zone['name']] = time.time()
+
+    def get(self, domain, headers):
+        """Зона из индекса; если домена там ещё нет - отдельный запрос"""
+        zone = self.zones.get(domain)
+        if zone is not None:
+            return zone
+        response = _cf('GET', 'zones.list', f'/zones?name={domain}', headers, coalesce=True)
+        if response.status_code == 200 and response.json().get('result'):
+            zone = response.json()['result'][0]
+            self._store(zone)
+            return zone
+        return None
+
+    def refresh(self, zone, headers):
+        """Свежее состояние зоны (GET /zones/{id}); при ошибке - None"""
+        response = _cf('GET', 'zones.get', f"/zones/{zone['id']}", headers)
+        if response.status_code != 200 or not response.json().get('result'):
+            return None
+        zone = response.json()['result']
+        self._store(zone)
+        return zone
+
+
+class TickBudget:
+    """
+    Запросы к провайдеру, доступные планировщику
+
+    Доля на такт копится между тактами до capacity (доля одного окна лимита),
+    так что проверка дороже доли одного такта выполняется, когда накопится.
+    Первый не поместившийся запрос закрывает бюджет до конца такта: иначе
+    дешёвые проверки съедали бы всё накопленное для отложенной.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.left = 0.0
+        self.blocked = False
+
+    def refill(self, calls, available=None):
+        """Начало такта: доля такта calls; available - остаток в окнах квоты (None - не ограничен)"""
+        self.left = min(self.left + calls, self.capacity)
+        if available is not None:
+            self.left = min(self.left, available)
+        self.blocked = False
+
+    def take(self, calls=1):
+        """Списать calls запросов; False, если не помещаются (бюджет закрывается до конца такта)"""
+        if self.blocked:
+            return False
+        # Дороже полного бюджета - в долг, следующие такты его вернут
+        if calls <= self.left or (self.left >= self.capacity and calls > self.capacity):
+            self.left -= calls
+            return True
+        self.blocked = True
+        return False
+
+    def refund(self, calls):
+        """Возврат списанных заранее, но не сделанных запросов"""
+        self.left += calls
+
+
+class DeferredCheck(Exception):
+    """Запросам проверки не хватило бюджета такта - домен проверится в следующем"""
+
+
+def _charge(budgets, provider, calls):
+    if budgets is not None and calls > 0 and not budgets[provider].take(calls):
+        raise DeferredCheck(provider)
+
+
+def _refund(budgets, provider, calls):
+    if budgets is not None and calls > 0:
+        budgets[provider].refund(calls)
+
+
+# Статусы зоны, ожидающей смены NS после переноса: их выставил этап 3,
+# повторная отправка NS ничего не ускорит
+_AWAITING_NS = ('pending', 'initializing')
+
+
+def cloudflare_check_calls(row, index, fix):
+    """Худший случай запросов к Cloudflare на проверку зоны"""
+    tls = json.loads(row['tls'])
+    calls = 2 + (row['domain'] not in index.zones)  # свежий статус зоны, настройки, поиск зоны мимо индекса
+    if fix and tls:
+        # Пакетный PATCH и поштучные после отказа пакета с 400
+        calls += 1 + (len(tls) if len(tls) > 1 else 0)
+    return calls
+
+
+def check_cloudflare(row, api_keys, headers, index, fix, budgets=None):
+    """
+    Проверка зоны: статус (NS) и настройки TLS
+
+    Статус не active из индекса подтверждается свежим запросом зоны; зона,
+    ещё ждущая NS после переноса (pending), не исправляется. budgets -
+    {'cloudflare': TickBudget, 'ukraine': TickBudget} или None (без
+    ограничения): худший случай запросов к Cloudflare списывается до проверки,
+    несделанные возвращаются; запросы к регистратору - перед исправлением NS.
+
+    Returns:
+        (найденный дрейф, оставшийся после исправления дрейф, исправлено)
+
+    Raises:
+        DeferredCheck: не хватило бюджета (уже сделанные запросы списаны)
+    """
+    domain = row['domain']
+    charged = cloudflare_check_calls(row, index, fix)
+    _charge(budgets, 'cloudflare', charged)
+    used = 0
+    try:
+        used += domain not in index.zones
+        zone = index.get(domain, headers)
+        if zone is None:
+            # Зону заново не создаём - это работа этапа 2
+            return {'zone': 'missing'}, {'zone': 'missing'}, []
+
+        found = {}
+        fixed = []
+        status = zone.get('status')
+        if status != 'active' and status not in _AWAITING_NS:
+            # Индекс мог прочитать зону до активации (полный проход - много тактов)
+            used += 1
+            zone = index.refresh(zone, headers) or zone
+            status = zone.get('status')
+        if status != 'active':
+            found['zone_status'] = status
+            if fix and status not in _AWAITING_NS and zone.get('name_servers'):
+                _charge(budgets, 'ukraine', ukraine_expected_calls('update_nameservers', domain, api_keys))
+                ukraine_update_nameservers(domain, zone['name_servers'], api_keys)
+                fixed.append('zone_status')
+
+        used += 1
+        response = _cf('GET', 'settings.list', f"/zones/{zone['id']}/settings", headers)
+        if response.status_code != 200:
+            found['settings'] = 'unavailable'
+        else:
+            values = {item['id']: item.get('value') for item in response.json().get('result', [])}
+            wanted = {setting: value for setting, value in json.loads(row['tls']).items()
+                      if values.get(setting) != value}
+            found.update({setting: values.get(setting) for setting in wanted})
+            if fix and wanted:
+                # Сколько запросов ушло на поштучную установку, снаружи не видно - худший случай
+                used += 1 + (len(wanted) if len(wanted) > 1 else 0)
+                failed = patch_zone_settings(zone['id'], wanted, headers)
+                fixed.extend(setting for setting in wanted if setting not in failed)
+        remaining = {k: v for k, v in found.items() if k not in fixed}
+        return found, remaining, fixed
+    finally:
+        _refund(budgets, 'cloudflare', charged - used)
+
+
+def check_registrar(row, api_keys, fix, budgets=None):
+    """
+    Сверка записей регистратора с желаемым набором
+
+    С budgets до проверки списывается худший случай чтения и сверки
+    (ukraine_expected_calls 'restore'), после - возвращается несделанное.
+
+    Returns:
+        (найденный дрейф, оставшийся после исправления дрейф, исправлено)
+
+    Raises:
+        DeferredCheck: не хватило бюджета (уже сделанные запросы списаны)
+    """
+    domain = row['domain']
+    desired = json.loads(row['records'])
+    read_calls = ukraine_expected_calls('snapshot', domain, api_keys)
+    charged = ukraine_expected_calls('restore', domain, api_keys, len(desired)) if fix else read_calls
+    _charge(budgets, 'ukraine', charged)
+    records = extract_dns_records(ukraine_get_dns_records(domain, api_keys, fresh=True))
+    found = dns_records_drift(domain, records, desired)
+    spare = charged - read_calls
+    if not found['missing'] and not found['extra']:
+        _refund(budgets, 'ukraine', spare)
+        return {}, {}, []
+    if not fix:
+        return found, found, []
+    # Правка записи заменяет пару удаление + создание, так что это верхняя граница
+    fix_calls = found['missing'] + found['extra']
+    if fix_calls > spare:
+        _charge(budgets, 'ukraine', fix_calls - spare)
+    else:
+        _refund(budgets, 'ukraine', spare - fix_calls)
+    # Список только что прочитан и лежит в кэше - сверка не читает его повторно
+    ukraine_reconcile_dns_records(domain, desired, api_keys)
+    return found, {}, ['records']
+
+
+def configured_api_keys():
+    """Ключи из настроек приложения (планировщик работает без запроса пользователя)"""
+    settings = load_settings_from_file()
+    return {
+        'cloudflare_email': settings.get('CLOUDFLARE_EMAIL', ''),
+        'cloudflare_api_key': settings.get('CLOUDFLARE_API_KEY', ''),
+        'registrar_api_key': settings.get('REGISTRAR_API_KEY', ''),
+        'registrar_api_url': settings.get('REGISTRAR_API_URL', ''),
+    }
+
+
+# Бюджеты планировщика по провайдерам: доля такта копится между тактами
+_budgets = {
+    'ukraine': TickBudget(int(DRIFT_QUOTA_SHARE * REGISTRAR_HOURLY_LIMIT)),
+    'cloudflare': TickBudget(int(DRIFT_QUOTA_SHARE * CLOUDFLARE_RATE_LIMIT)),
+}
+
+
+def tick_budget(api_keys, interval=DRIFT_INTERVAL):
+    """
+    Пополнение бюджетов на такт: доля DRIFT_QUOTA_SHARE от лимита провайдера
+    за интервал такта, но не больше, чем осталось в окнах квоты
+
+    Returns:
+        {'ukraine': TickBudget, 'cloudflare': TickBudget}
+    """
+    accounts = quota.accounts_for(api_keys)
+    share = {
+        'ukraine': DRIFT_QUOTA_SHARE * REGISTRAR_HOURLY_LIMIT * interval / 3600,
+        'cloudflare': DRIFT_QUOTA_SHARE * CLOUDFLARE_RATE_LIMIT * interval / 300,
+    }
+    for provider, budget in _budgets.items():
+        left = quota.remaining(provider, accounts[provider]) if provider in accounts else None
+        budget.refill(share[provider], max(0, min(left.values())) if left else None)
+    return _budgets
+
+
+def _timed(fn, *args):
+    with deadlines.scope(deadlines.deadline_after(DOMAIN_TIME_BUDGET)):
+        return fn(*args)
+
+
+def run_tick(stop_event=None, interval=DRIFT_INTERVAL, fix=DRIFT_AUTO_FIX):
+    """
+    Один такт проверки
+
+    Returns:
+        dict со счётчиками такта
+    """
+    api_keys = configured_api_keys()
+    stats = {'cloudflare': 0, 'registrar': 0, 'drift': 0, 'fixed': 0, 'errors': 0, 'pages': 0,
+             'deferred': 0}
+    if not api_keys['registrar_api_key'] or not api_keys['cloudflare_api_key']:
+        return stats
+
+    account = fleet_account(api_keys)
+    headers = {
+        'X-Auth-Email': api_keys['cloudflare_email'],
+        'X-Auth-Key': api_keys['cloudflare_api_key'],
+        'Content-Type': 'application/json'
+    }
+    # Сверка записей и исправление NS берут запросы к регистратору из одного бюджета
+    budgets = tick_budget(api_keys, interval)
+
+    # Одна страница индекса зон за такт, остальное - проверка настроек доменов
+    if budgets['cloudflare'].take():
+        try:
+            if _index.fetch_page(headers):
+                stats['pages'] += 1
+        except Exception:
+            stats['errors'] += 1
+    # Проверка стоит не меньше запроса - больше строк бюджет не пропустит
+    cloudflare_rows = _stalest(account, 'cloudflare_checked', max(0, int(budgets['cloudflare'].left)))
+    registrar_rows = _stalest(account, 'registrar_checked', max(0, int(budgets['ukraine'].left)))
+
+    # Чередуем провайдеров и равномерно распределяем запросы по такту
+    tasks = sorted(
+        [(i / len(cloudflare_rows), 'cloudflare', row) for i, row in enumerate(cloudflare_rows)] +
+        [(i / len(registrar_rows), 'registrar', row) for i, row in enumerate(registrar_rows)],
+        key=lambda t: (t[0], t[1])
+    )
+    spacing = interval * 0.9 / len(tasks) if tasks else 0
+
+    for _position, provider, row in tasks:
+        if stop_event is not None and stop_event.is_set():
+            break
+        if budgets['ukraine' if provider == 'registrar' else provider].blocked:
+            # Бюджет закрыт до конца такта - домен останется самым давним и проверится первым
+            continue
+        try:
+            if provider == 'cloudflare':
+                found, remaining, fixed = _timed(check_cloudflare, row, api_keys, headers, _index, fix,
+                                                 budgets)
+            else:
+                found, remaining, fixed = _timed(check_registrar, row, api_keys, fix, budgets)
+        except DeferredCheck:
+            # Время проверки не обновляем: домен уйдёт в начало следующего такта
+            stats['deferred'] += 1
+            metrics.inc('dns_drift_checks_total', {'provider': provider, 'result': 'deferred'})
+            continue
+        except CircuitOpenError:
+            # Провайдер недоступен - остаток такта не тратим
+            stats['errors'] += 1
+            break
+        except Exception as e:
+            found = remaining = {'error': str(e)}
+            fixed = []
+            stats['errors'] += 1
+        _save_check(row['domain'], provider, remaining, fixed)
+        stats[provider] += 1
+        if found:
+            stats['drift'] += 1
+        if fixed:
+            stats['fixed'] += 1
+        result = 'fixed' if fixed else ('drift' if found else 'ok')
+        metrics.inc('dns_drift_checks_total', {'provider': provider, 'result': result})
+        if spacing and stop_event is not None:
+            stop_event.wait(spacing)
+    return stats
+
+
+class DriftScheduler:
+    """Фоновый поток, выполняющий run_tick() раз в DRIFT_INTERVAL секунд"""
+
+    def __init__(self, interval=DRIFT_INTERVAL):
+        self.interval = interval
+        self.last_tick = None
+        self.last_stats = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='drift', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def state(self):
+        return {'interval': self.interval, 'last_tick': self.last_tick, 'last_stats': self.last_stats,
+                'zone_index_size': len(_index.zones)}
+
+    def _loop(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.last_stats = run_tick(self._stop, self.interval)
+            except Exception as e:
+                self.last_stats = {'error': str(e)}
+            self.last_tick = time.time()
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+_index = ZoneIndex()
+_scheduler = None
+
+
+def zone_index():
+    """Индекс зон Cloudflare процесса (заполняется также при прогреве, см. warmup.py)"""
+    return _index
+
+
+def scheduler_running():
+    """Планировщик запущен в этом процессе (только он читает индекс зон)"""
+    return _scheduler is not None
+
+
+def start():
+    """Запуск планировщика (один раз на процесс)"""
+    global _scheduler
+    if _scheduler is None:
+        os.makedirs(os.path.dirname(os.path.abspath(FLEET_DB)), exist_ok=True)
+        _scheduler = DriftScheduler()
+        _scheduler.start()
+    return _scheduler
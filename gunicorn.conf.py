@@ -0,0 +1,25 @@
+"""
+Настройки gunicorn (подхватываются автоматически: gunicorn app:app)
+
+Каждый воркер после fork прогревается (warmup.py) и отвечает 200 на
+/healthz/ready только после прогрева. Воркеры многопоточные (gthread):
+пока поток отдаёт длинный поток результатов, другие запросы - статус,
+пауза и отмена задания - обслуживаются тем же воркером.
+"""
+
+import os
+
+# Прогрев нужен только воркерам gunicorn: по умолчанию он выключен (config.py),
+# здесь включается, если не задан явно. Файл читается до импорта приложения.
+os.environ.setdefault('WARMUP_ENABLED', '1')
+
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+
+def post_worker_init(worker):
+    # После fork и загрузки приложения в воркере: recorder уже настроен
+    from config import WARMUP_ENABLED
+    if WARMUP_ENABLED:
+        import warmup
+        warmup.start()
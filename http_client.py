@@ -0,0 +1,250 @@
+"""
+Общий HTTP клиент для исходящих запросов к Cloudflare и регистраторам
+
+Все исходящие вызовы из app.py и модулей регистраторов идут через
+outbound_request(): здесь пул соединений на провайдера, таймаут по умолчанию
+(урезается до остатка дедлайна задания/домена), общий бюджет запросов
+аккаунта с очередью по приоритетам заданий (scheduler.py), circuit breaker
+по провайдеру и endpoint, метрики задержек, счётчики байт и повторов, учёт квоты, запись
+событий в трассировку задания, а также запись и воспроизведение трафика
+(recorder.py). Медленные чтения Cloudflare могут дублироваться (hedged
+запросы, HEDGE_ENABLED).
+"""
+
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+import requests
+
+import circuit_breaker
+import deadlines
+import jobs
+import metrics
+import quota
+import recorder
+import scheduler
+import singleflight
+from config import (
+    OUTBOUND_TIMEOUT, HEDGE_ENABLED, HEDGE_ENDPOINTS, HEDGE_QUANTILE, HEDGE_MIN_SAMPLES,
+    HEDGE_MAX_RATE, HEDGE_WORKERS
+)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# Одинаковые одновременные чтения (coalesce=True) выполняются один раз
+_inflight = singleflight.Group('http')
+
+# Hedged чтения: окно последних задержек endpoint и запас дублей (не больше
+# HEDGE_BURST подряд, пополняется на HEDGE_MAX_RATE с каждым чтением)
+HEDGE_WINDOW = 256
+HEDGE_BURST = 5.0
+
+_latencies = {}
+_hedge_lock = threading.Lock()
+_hedge_credit = HEDGE_BURST
+_hedge_executor = None
+
+
+def get_session(provider):
+    """Сессия requests (пул keep-alive соединений) для провайдера"""
+    session = _sessions.get(provider)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(provider)
+            if session is None:
+                session = requests.Session()
+                _sessions[provider] = session
+    return session
+
+
+def _body_size(body):
+    if body is None:
+        return 0
+    return len(body)
+
+
+def _credentials_key(headers):
+    """Отпечаток учётных данных запроса (ключ объединения запросов)"""
+    headers = headers or {}
+    return quota.account_key('|'.join(
+        str(headers.get(name, '')) for name in ('Authorization', 'X-Auth-Email', 'X-Auth-Key')
+    ))
+
+
+def outbound_request(provider, endpoint, method, url, attempt=0, coalesce=False, **kwargs):
+    """
+    Выполнение исходящего запроса
+
+    Args:
+        provider: провайдер ('cloudflare', 'ukraine', 'namecheap')
+        endpoint: логическое имя endpoint для метрик (например 'zones.list')
+        method: HTTP метод
+        url: полный URL
+        attempt: номер попытки (0 - первая, >0 - повтор/перебор вариантов)
+        coalesce: объединять с таким же запросом, уже выполняющимся в другом
+            потоке (только для чтений). Ключ включает аккаунт из заголовков,
+            поэтому разные аккаунты ответы не делят
+        **kwargs: параметры requests (headers, json, data, params, timeout)
+
+    Raises:
+        CircuitOpenError: breaker провайдера или endpoint открыт - запрос
+            не отправляется
+        DeadlineExceeded: дедлайн истёк до запроса (в том числе в очереди
+            планировщика) или во время него
+    """
+    send = _send_hedged if _hedge_eligible(provider, endpoint, method) else _send
+    if coalesce:
+        key = (provider, method, url, repr(kwargs.get('params')), repr(kwargs.get('data')),
+               _credentials_key(kwargs.get('headers')))
+        response, _shared = _inflight.do(key, lambda: send(provider, endpoint, method, url, attempt, kwargs))
+        return response
+    return send(provider, endpoint, method, url, attempt, kwargs)
+
+
+class _LatencyWindow:
+    """Последние задержки endpoint и их квантиль HEDGE_QUANTILE"""
+
+    def __init__(self):
+        self.samples = deque(maxlen=HEDGE_WINDOW)
+        self.quantile = None
+        self._added = 0
+        self._lock = threading.Lock()
+
+    def add(self, duration):
+        with self._lock:
+            self.samples.append(duration)
+            self._added += 1
+            # Квантиль пересчитывается раз в 16 наблюдений
+            if len(self.samples) >= HEDGE_MIN_SAMPLES and (self.quantile is None or self._added >= 16):
+                ordered = sorted(self.samples)
+                self.quantile = ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_QUANTILE))]
+                self._added = 0
+
+
+def _hedge_eligible(provider, endpoint, method):
+    return (HEDGE_ENABLED and provider == 'cloudflare' and method == 'GET' and endpoint in HEDGE_ENDPOINTS
+            and not recorder.recording() and not recorder.replaying())
+
+
+def _latency_window(provider, endpoint):
+    window = _latencies.get((provider, endpoint))
+    if window is None:
+        with _hedge_lock:
+            window = _latencies.setdefault((provider, endpoint), _LatencyWindow())
+    return window
+
+
+def _take_hedge():
+    """Разрешение на дублирующий запрос (доля дублей - не больше HEDGE_MAX_RATE)"""
+    global _hedge_credit
+    with _hedge_lock:
+        if _hedge_credit >= 1:
+            _hedge_credit -= 1
+            return True
+        return False
+
+
+def _get_hedge_executor():
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='hedge')
+    return _hedge_executor
+
+
+def _send_hedged(provider, endpoint, method, url, attempt, kwargs):
+    """
+    Идемпотентное чтение с дублированием: если ответа нет дольше квантиля
+    HEDGE_QUANTILE задержек endpoint, уходит такой же второй запрос, и
+    побеждает первый успешный ответ. Дубль проходит через те же очередь,
+    бюджет запросов аккаунта, breaker и квоту, что и основной запрос.
+    """
+    global _hedge_credit
+    window = _latency_window(provider, endpoint)
+    with _hedge_lock:
+        _hedge_credit = min(HEDGE_BURST, _hedge_credit + HEDGE_MAX_RATE)
+
+    def timed_send():
+        started = time.perf_counter()
+        response = _send(provider, endpoint, method, url, attempt, dict(kwargs))
+        window.add(time.perf_counter() - started)
+        return response
+
+    delay = window.quantile
+    if delay is None:
+        # Квантиль ещё не известен - обычный запрос
+        return timed_send()
+
+    labels = {'provider': provider, 'endpoint': endpoint}
+    started = time.perf_counter()
+    executor = _get_hedge_executor()
+    primary = executor.submit(contextvars.copy_context().run, timed_send)
+    try:
+        if not wait((primary,), timeout=delay).done and _take_hedge():
+            hedge = executor.submit(contextvars.copy_context().run, timed_send)
+            for future in as_completed((primary, hedge)):
+                if future.exception() is None:
+                    metrics.inc('dns_outbound_hedges_total', dict(labels, result='won' if future is hedge else 'lost'))
+                    return future.result()
+            # Оба запроса с ошибкой - ошибка основного
+            metrics.inc('dns_outbound_hedges_total', dict(labels, result='failed'))
+        return primary.result()
+    finally:
+        metrics.observe('dns_outbound_effective_duration_seconds', labels, time.perf_counter() - started)
+
+
+def _send(provider, endpoint, method, url, attempt, kwargs):
+    """Отправка запроса: очередь, дедлайн, breaker, метрики, квота, трассировка"""
+    account = quota.account_from_headers(kwargs.get('headers'))
+    replaying = recorder.replaying()
+    if not replaying:
+        # Воспроизведение записи не расходует лимиты провайдера и не ждёт токенов
+        scheduler.acquire_request(provider, account)
+    requested_timeout = kwargs.get('timeout') or OUTBOUND_TIMEOUT
+    kwargs['timeout'] = deadlines.timeout_for(requested_timeout)
+    clipped = kwargs['timeout'] != requested_timeout
+    breakers = circuit_breaker.before_call(provider, endpoint)
+    session = get_session(provider)
+    start = time.perf_counter()
+    status = 'error'
+    sent = received = 0
+    response = error = None
+    try:
+        if replaying:
+            response = recorder.replay_response(provider, method, url, kwargs)
+        else:
+            response = session.request(method, url, **kwargs)
+        status = str(response.status_code)
+        sent = _body_size(response.request.body)
+        # Тело читается здесь: ответ может быть отдан другим потокам (coalesce)
+        received = len(response.content)
+        return response
+    except requests.exceptions.Timeout as e:
+        error = e
+        if clipped:
+            # Таймаут из-за дедлайна - не отказ провайдера
+            status = 'deadline'
+            metrics.inc('dns_deadline_exceeded_total', {'what': 'запрос'})
+            raise deadlines.DeadlineExceeded(f'Превышено время выполнения, запрос {endpoint} прерван') from e
+        raise
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        if recorder.recording():
+            recorder.record_exchange(provider, endpoint, method, url, attempt, kwargs, response, error, duration)
+        if status == 'deadline':
+            for breaker in breakers:
+                breaker.release_probe()
+        else:
+            circuit_breaker.after_call(breakers, status != 'error' and not circuit_breaker.is_failure(int(status)))
+        metrics.observe_request(provider, endpoint, method, status, duration, sent, received, attempt)
+        if not replaying:
+            quota.record_call(provider, account)
+        jobs.record_call(provider, endpoint, method, status, duration, sent, received, attempt, account)
@@ -0,0 +1,164 @@
+"""
+Потоковый импорт списка доменов из CSV или NDJSON
+
+Файл читается построчно, строки валидируются и нормализуются по одной,
+дубликаты отбрасываются по нормализованному имени. Наружу отдаются пачки
+фиксированного размера, так что файл на 100k строк никогда не лежит в
+памяти целиком.
+
+Колонки CSV / ключи NDJSON:
+    domain       - доменное имя (обязательно)
+    ip           - целевой IP для A записи (синонимы: target_ip, ip_address)
+    account      - имя набора API ключей из поля accounts
+    registrar    - регистратор (поддерживается ukraine)
+    tls_profile  - профиль TLS для этапа 4
+
+Остальные колонки передаются как переменные шаблона записей (ipv6, mx, ...).
+"""
+
+import csv
+import io
+import ipaddress
+import json
+
+from domains import normalize_domain, InvalidDomain
+
+SUPPORTED_REGISTRARS = {'ukraine'}
+
+_IP_KEYS = ('ip', 'target_ip', 'ip_address')
+_KNOWN_KEYS = {'domain', 'account', 'registrar', 'tls_profile'}.union(_IP_KEYS)
+
+
+class ImportStats:
+    """Счётчики разбора файла"""
+
+    def __init__(self):
+        self.rows = 0
+        self.accepted = 0
+        self.duplicates = 0
+        self.invalid = 0
+        # Первые ошибки разбора (остальные только считаем)
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.invalid += 1
+        if len(self.errors) < 100:
+            self.errors.append({'line': line, 'message': message})
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'accepted': self.accepted,
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+            'errors': list(self.errors),
+        }
+
+
+def detect_format(filename='', content_type='', explicit=''):
+    """Определение формата по явному параметру, имени файла или Content-Type"""
+    value = (explicit or '').lower()
+    if value in ('csv', 'ndjson'):
+        return value
+    filename = (filename or '').lower()
+    content_type = (content_type or '').lower()
+    if filename.endswith(('.ndjson', '.jsonl')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'ndjson'
+    return 'csv'
+
+
+def _iter_raw_rows(binary_file, fmt):
+    """Построчное чтение файла: (номер строки, dict)"""
+    text = io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
+    if fmt == 'ndjson':
+        for line_no, line in enumerate(text, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_no, None
+                continue
+            yield line_no, row if isinstance(row, dict) else {'domain': row if isinstance(row, str) else ''}
+        return
+
+    reader = csv.reader(text)
+    header = None
+    for row in reader:
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        first = row[0].strip().lower()
+        if header is None:
+            if first == 'domain':
+                header = [cell.strip().lower() for cell in row]
+                continue
+            # Файл без заголовка: domain[,ip]
+            header = ['domain', 'ip']
+        yield reader.line_num, dict(zip(header, (cell.strip() for cell in row)))
+
+
+def _parse_row(row, defaults):
+    """Валидация и нормализация одной строки"""
+    domain = normalize_domain(str(row.get('domain', '')))
+
+    ip = next((str(row[k]).strip() for k in _IP_KEYS if row.get(k)), '') or defaults.get('ip', '')
+    if ip:
+        try:
+            ipaddress.ip_address(ip)
+        except ValueError:
+            raise InvalidDomain(f'Некорректный IP адрес: {ip}')
+
+    registrar = str(row.get('registrar') or defaults.get('registrar') or 'ukraine').strip().lower()
+    if registrar not in SUPPORTED_REGISTRARS:
+        raise InvalidDomain(f'Регистратор не поддерживается: {registrar}')
+
+    return {
+        'domain': domain,
+        'ip': ip,
+        'account': str(row.get('account') or defaults.get('account') or '').strip(),
+        'registrar': registrar,
+        'tls_profile': str(row.get('tls_profile') or defaults.get('tls_profile') or '').strip(),
+        'vars': {
+            str(k): str(v).strip()
+            for k, v in row.items()
+            if k not in _KNOWN_KEYS and v not in (None, '')
+        },
+    }
+
+
+def iter_import_chunks(binary_file, fmt, chunk_size, stats, defaults=None):
+    """
+    Генератор пачек валидных уникальных строк
+
+    Args:
+        binary_file: файл, открытый в бинарном режиме
+        fmt: 'csv' или 'ndjson'
+        chunk_size: размер пачки
+        stats: ImportStats для счётчиков
+        defaults: значения по умолчанию для пустых колонок (ip, account, ...)
+    """
+    defaults = defaults or {}
+    seen = set()
+    chunk = []
+    for line_no, row in _iter_raw_rows(binary_file, fmt):
+        stats.rows += 1
+        if row is None:
+            stats.add_error(line_no, 'Некорректная JSON строка')
+            continue
+        try:
+            parsed = _parse_row(row, defaults)
+        except InvalidDomain as e:
+            stats.add_error(line_no, str(e))
+            continue
+        if parsed['domain'] in seen:
+            stats.duplicates += 1
+            continue
+        seen.add(parsed['domain'])
+        stats.accepted += 1
+        chunk.append(parsed)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
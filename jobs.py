@@ -0,0 +1,396 @@
+"""
+Задания (jobs) и трассировка их выполнения
+
+Каждый запуск этапа (или всех этапов) - это задание с коротким ID.
+Внутри задания обработка домена на этапе оборачивается в span, а каждый
+исходящий запрос добавляет в текущий span событие (endpoint, статус, время).
+Запись span'ов включается только по запросу (trace=true), иначе накладные
+расходы - одна проверка флага.
+
+Долгие задания (импорт из файла) выполняются в фоне через submit(),
+их статус и результаты доступны по ID задания.
+
+Задание можно поставить на паузу, продолжить и отменить (request_control):
+команда применяется сразу, если задание в этом процессе, иначе пишется
+файлом в JOB_CONTROL_DIR - процесс-владелец (другой воркер) проверяет его не
+чаще раза в JOB_CONTROL_POLL секунд. Команда действует перед запуском следующего
+домена, уже начатые домены дорабатывают. Распределённому импорту
+(SHARDING_ENABLED) команда пишется и в общее хранилище задач: её видят узлы,
+выполняющие задачи, и координатор на любом хосте.
+"""
+
+import contextvars
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import circuit_breaker
+import deadlines
+import metrics
+import outcomes
+import sharding
+from config import JOB_WORKERS, JOB_CONTROL_DIR, JOB_CONTROL_POLL, SHARDING_ENABLED
+
+# Сколько последних заданий храним в памяти
+MAX_JOBS = 200
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+
+_current_job = contextvars.ContextVar('current_job', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+_current_domain = contextvars.ContextVar('current_domain', default=None)
+
+# Команды управления заданием -> состояние
+CONTROL_ACTIONS = {'pause': 'paused', 'resume': 'running', 'cancel': 'cancelling'}
+
+# Поток -> (ID задания, этап), пока поток обрабатывает домен (для profiler.py)
+_thread_activity = {}
+
+
+class Job:
+    """Задание: набор доменов, обрабатываемых одним или несколькими этапами"""
+
+    def __init__(self, kind, trace=False, priority='normal'):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.trace = bool(trace)
+        # Приоритет в очередях планировщика (urgent/high/normal/bulk, см. scheduler.py)
+        self.priority = priority
+        self.created_at = time.time()
+        self.spans = []
+        # (провайдер, endpoint, домен) -> число исходящих запросов
+        self.calls = {}
+        self._account_calls = {}
+        # Оценка запросов до запуска, аккаунты провайдеров и резервы квоты
+        # (провайдер, аккаунт) -> зарезервировано (см. quota.py)
+        self.budget_estimate = None
+        self.accounts = None
+        self.reservations = {}
+        # Состояние фонового выполнения
+        self.status = 'running'
+        self.error = None
+        self.started_at = self.created_at
+        self.finished_at = None
+        self.progress = {}
+        # Сохранённые результаты фоновых заданий (outcomes.DomainResult) и
+        # сводка по всем результатам задания, в том числе отданным потоком
+        self.results = []
+        self.summary = outcomes.Summary()
+        # Домены, отложенные из-за открытого circuit breaker: этап -> [домен]
+        self.parked = {}
+        # Время обработки доменов по этапам: этап -> [wall, cpu, доменов]
+        self.stage_times = {}
+        # Бюджет времени задания (сек, 0 - без ограничения) и дедлайн
+        # (monotonic), отсчитывается с момента запуска
+        self.time_budget = 0
+        self.deadline = None
+        # Управление: running, paused или cancelling (см. request_control)
+        self.control = 'running'
+        self._control_changed = threading.Condition()
+        self._control_checked = 0.0
+        self._lock = threading.Lock()
+
+    def add_results(self, stage, results):
+        """Сохранение результатов этапа (для фоновых заданий)"""
+        records = [outcomes.coerce(r) for r in results]
+        for record in records:
+            record.stage = stage
+        with self._lock:
+            self.results.extend(records)
+
+    def tally(self, stage, result):
+        """Учёт результата домена в сводке задания"""
+        self.summary.add(stage, result)
+
+    def start_clock(self, time_budget=None):
+        """Запуск отсчёта бюджета времени задания"""
+        if time_budget is not None:
+            self.time_budget = time_budget
+        self.deadline = deadlines.deadline_after(self.time_budget)
+
+    def set_parked(self, stage, domains):
+        """Домены этапа, которые так и не удалось обработать из-за открытого breaker'а"""
+        with self._lock:
+            if domains:
+                self.parked[stage] = list(domains)
+            else:
+                self.parked.pop(stage, None)
+
+    def set_control(self, state):
+        """Смена состояния управления (отменённое задание не продолжается)"""
+        with self._control_changed:
+            if self.control != 'cancelling':
+                self.control = state
+            self._control_changed.notify_all()
+        return self.control
+
+    def poll_control(self):
+        """Текущее состояние с учётом команды из файла (не чаще JOB_CONTROL_POLL)"""
+        now = time.monotonic()
+        if now - self._control_checked >= JOB_CONTROL_POLL:
+            self._control_checked = now
+            path = _control_path(self.id)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    action = f.read().strip()
+                os.remove(path)
+            except OSError:
+                action = None
+            if action in CONTROL_ACTIONS:
+                self.set_control(CONTROL_ACTIONS[action])
+        return self.control
+
+    def wait_control(self, timeout):
+        """Ожидание смены состояния управления (не дольше timeout)"""
+        with self._control_changed:
+            self._control_changed.wait(timeout)
+
+    @property
+    def cancel_requested(self):
+        return self.control == 'cancelling'
+
+    def update_progress(self, **values):
+        with self._lock:
+            self.progress.update(values)
+
+    def status_dump(self, offset=0, limit=100):
+        """Статус задания и страница результатов"""
+        with self._lock:
+            total = len(self.results)
+            page = self.results[offset:offset + limit]
+            progress = dict(self.progress)
+            parked = {stage: list(domains) for stage, domains in self.parked.items()}
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'priority': self.priority,
+            'status': self.status,
+            'control': self.control,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'time_budget': self.time_budget,
+            'progress': progress,
+            'parked': parked,
+            'timing': self.timing(),
+            'totals': self.summary.as_dict(),
+            'breakers': circuit_breaker.states(only_unhealthy=True),
+            'results_total': total,
+            'results': [result.as_dict() for result in page],
+        }
+
+    def count_call(self, provider, endpoint, domain, account=None):
+        key = (provider, endpoint, domain)
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+            self._account_calls[(provider, account)] = self._account_calls.get((provider, account), 0) + 1
+
+    def account_calls(self, provider, account):
+        """Число запросов задания к провайдеру от имени аккаунта"""
+        return self._account_calls.get((provider, account), 0)
+
+    def call_counts(self):
+        with self._lock:
+            return dict(self.calls)
+
+    def calls_by_domain(self):
+        """Число запросов по доменам: {домен: {провайдер: n}}"""
+        by_domain = {}
+        for (provider, _endpoint, domain), count in self.call_counts().items():
+            per_provider = by_domain.setdefault(domain or '', {})
+            per_provider[provider] = per_provider.get(provider, 0) + count
+        return by_domain
+
+    def timing(self):
+        """Wall и CPU время обработки доменов по этапам (сек)"""
+        with self._lock:
+            return {
+                stage: {'wall_seconds': round(wall, 3), 'cpu_seconds': round(cpu, 3), 'domains': count}
+                for stage, (wall, cpu, count) in self.stage_times.items()
+            }
+
+    @contextmanager
+    def span(self, stage, domain):
+        """Span обработки одного домена на одном этапе"""
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        span = {'stage': stage, 'domain': domain, 'start': time.time(), 'calls': []} if self.trace else None
+        token = _current_span.set(span)
+        domain_token = _current_domain.set(domain)
+        thread = threading.get_ident()
+        _thread_activity[thread] = (self.id, stage)
+        try:
+            yield span
+        finally:
+            _thread_activity.pop(thread, None)
+            _current_domain.reset(domain_token)
+            _current_span.reset(token)
+            elapsed = time.perf_counter() - start
+            cpu = time.thread_time() - cpu_start
+            metrics.observe('dns_stage_domain_duration_seconds', {'stage': stage}, elapsed)
+            if span is not None:
+                span['duration'] = round(elapsed, 6)
+                span['cpu'] = round(cpu, 6)
+            with self._lock:
+                totals = self.stage_times.setdefault(stage, [0.0, 0.0, 0])
+                totals[0] += elapsed
+                totals[1] += cpu
+                totals[2] += 1
+                if span is not None:
+                    self.spans.append(span)
+
+    def trace_dump(self):
+        """Дамп трассировки задания"""
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'created_at': self.created_at,
+            'trace': self.trace,
+            'spans': spans,
+        }
+
+
+def create_job(kind, trace=False, priority='normal'):
+    """Создание задания и регистрация его в памяти"""
+    job = Job(kind, trace, priority)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        while len(_jobs) > MAX_JOBS:
+            _jobs.popitem(last=False)
+    return job
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job')
+    return _executor
+
+
+def submit(job, fn, *args):
+    """
+    Постановка задания в фоновую очередь
+
+    fn(job, *args) выполняется в пуле потоков с активным заданием.
+    """
+    job.status = 'queued'
+    job.started_at = None
+
+    def runner():
+        if job.poll_control() == 'cancelling':
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+            return
+        job.status = 'running'
+        job.started_at = time.time()
+        job.start_clock()
+        try:
+            with activate(job):
+                fn(job, *args)
+            if job.status == 'running':
+                job.status = 'cancelled' if job.cancel_requested else 'done'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+
+    _get_executor().submit(runner)
+    return job
+
+
+def _control_path(job_id):
+    return os.path.join(JOB_CONTROL_DIR, job_id)
+
+
+def request_control(job_id, action):
+    """
+    Команда заданию: pause, resume или cancel
+
+    Returns:
+        состояние задания, если оно в этом процессе или в общем хранилище
+        распределённых заданий, иначе None
+    """
+    job = get_job(job_id)
+    shared = None
+    if SHARDING_ENABLED:
+        store = sharding.get_store()
+        if action == 'cancel':
+            shared = store.cancel_job(job_id)
+        else:
+            shared = store.pause_job(job_id, action == 'pause')
+    if job is not None:
+        return job.set_control(CONTROL_ACTIONS[action])
+    if shared is not None:
+        return shared
+    os.makedirs(JOB_CONTROL_DIR, exist_ok=True)
+    path = _control_path(job_id)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(action)
+    os.replace(tmp, path)
+    return None
+
+
+def get_job(job_id):
+    """Получение задания по ID (None, если не найдено)"""
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+@contextmanager
+def activate(job):
+    """Делает задание текущим для исходящих запросов в этом контексте (с его дедлайном)"""
+    token = _current_job.set(job)
+    try:
+        with deadlines.scope(job.deadline):
+            yield job
+    finally:
+        _current_job.reset(token)
+
+
+def current_job():
+    return _current_job.get()
+
+
+def thread_activity(thread_id):
+    """(ID задания, этап), если поток сейчас обрабатывает домен, иначе None"""
+    return _thread_activity.get(thread_id)
+
+
+def current_domain():
+    """Домен, который сейчас обрабатывается в этом контексте"""
+    return _current_domain.get()
+
+
+def record_call(provider, endpoint, method, status, duration, sent, received, attempt, account=None):
+    """Учёт исходящего запроса в задании и в текущем span (если трассировка включена)"""
+    job = _current_job.get()
+    if job is not None:
+        job.count_call(provider, endpoint, _current_domain.get(), account)
+    span = _current_span.get()
+    if span is None:
+        return
+    span['calls'].append({
+        'provider': provider,
+        'endpoint': endpoint,
+        'method': method,
+        'status': status,
+        'duration': round(duration, 6),
+        'bytes_sent': sent,
+        'bytes_received': received,
+        'attempt': attempt,
+    })
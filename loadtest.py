@@ -0,0 +1,418 @@
+"""
+Нагрузочный тест веб-слоя (Flask + gunicorn) без обращений к провайдерам
+
+Для каждой конфигурации воркеров gunicorn поднимается локально на свободном
+порту, Cloudflare подменяется воспроизведением синтетической записи трафика
+(recorder.py, REPLAY_FROM) с задержкой ответа --provider-latency. На каждый
+сценарий и уровень параллельности --duration секунд идут запросы из
+параллельных клиентов, считаются пропускная способность и задержки.
+
+Сценарии:
+    settings    GET /api/settings
+    ready       GET /healthz/ready
+    metrics     GET /metrics
+    job_status  GET /api/jobs/<id> - опрос статуса заданий этапа 4 (задание
+                другого воркера отвечает 404, это тоже обслуженный запрос)
+    stage4      POST /api/stage4 на --batch доменов (JSON ответ целиком)
+
+Конфигурации воркеров: класс:воркеры[xпотоки], например sync:1, sync:4,
+gthread:2x8. Каждый замер повторяется --repeat раз (конфигурации чередуются,
+сервер каждый раз запускается заново), итог - медиана. Результат - NDJSON в
+stdout, строка на (конфигурация, сценарий, параллельность) и повтор, затем
+медианы:
+
+    {"key": "gthread:2x8/settings/16", "run": 0, "rps": ..., "p50_ms": ...,
+     "p95_ms": ..., "p99_ms": ..., "requests": ..., "errors": ...}
+    {"key": "gthread:2x8/settings/16", "run": "median", ..., "ratio": 1.02}
+
+Абсолютные rps и задержки зависят от машины и её загрузки, поэтому с базой
+(loadtest_baseline.json) сравниваются только отношения внутри одного прогона:
+ratio - rps конфигурации к rps первой (опорной) конфигурации --configs на том
+же сценарии и параллельности. Замер - регрессия, если отношение ниже базового
+больше чем на --tolerance (выигрыш базы меньше --tolerance - шум, такое
+отношение сравнивается с 1). Абсолютные значения в базе - справка о машине, на
+которой она снята, и в проверке не участвуют.
+
+    python loadtest.py --check
+    python loadtest.py --configs sync:1,gthread:1x8 --duration 10 --save-baseline
+
+Код выхода: 0 - без регрессий, 1 - есть регрессии или ошибки ответов,
+2 - ошибка параметров или сервер не запустился.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+EXIT_OK = 0
+EXIT_REGRESSION = 1
+EXIT_USAGE = 2
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(BASE_DIR, 'loadtest_baseline.json')
+
+CLOUDFLARE_API_BASE = 'https://api.cloudflare.com/client/v4'
+SCENARIOS = ('settings', 'ready', 'metrics', 'job_status', 'stage4')
+API_KEYS = {'cloudflare_email': 'loadtest@example.com', 'cloudflare_api_key': 'loadtest', 'registrar_api_key': 'loadtest'}
+
+# Сколько заданий этапа 4 создаётся заранее для опроса статуса
+STATUS_JOBS = 20
+
+
+def parse_config(value):
+    """'gthread:2x8' -> ('gthread', 2, 8)"""
+    worker_class, _, size = value.partition(':')
+    workers, _, threads = (size or '1').partition('x')
+    if worker_class not in ('sync', 'gthread'):
+        raise ValueError(f'Неизвестный класс воркеров: {worker_class}')
+    return worker_class, int(workers), int(threads or 1)
+
+
+def write_replay(path, domains, latency):
+    """Синтетическая запись трафика Cloudflare для этапа 4 (см. recorder.Replayer)"""
+    now = time.time()
+    with open(path, 'w', encoding='utf-8') as f:
+        for index, domain in enumerate(domains):
+            zone_id = f'zone{index}'
+            exchanges = [
+                ('GET', 'zones.list', f'{CLOUDFLARE_API_BASE}/zones?name={domain}',
+                 {'success': True, 'result': [{'id': zone_id, 'name': domain, 'status': 'active'}]}),
+                ('PATCH', 'settings.edit', f'{CLOUDFLARE_API_BASE}/zones/{zone_id}/settings',
+                 {'success': True, 'result': [{'id': setting} for setting in (
+                     'ssl', 'always_use_https', 'min_tls_version', 'tls_1_3',
+                     'automatic_https_rewrites', 'security_header')]}),
+            ]
+            for method, endpoint, url, body in exchanges:
+                f.write(json.dumps({
+                    'type': 'outbound', 'ts': now, 'provider': 'cloudflare', 'endpoint': endpoint,
+                    'method': method, 'url': url, 'request': {}, 'duration': latency,
+                    'status': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(body),
+                }) + '\n')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(config, replay_path, workdir, startup_timeout=30):
+    """Запуск gunicorn с воркерами config; возвращает (процесс, базовый URL)"""
+    worker_class, workers, threads = config
+    port = _free_port()
+    env = dict(
+        os.environ,
+        REPLAY_FROM=replay_path,
+        REPLAY_SPEED='1',
+        WARMUP_ENABLED='0',
+        DRIFT_CHECK_ENABLED='0',
+        SHARD_WORKER_TASKS='0',
+        RECORD_TRAFFIC='0',
+        CLOUDFLARE_RATE_LIMIT='1000000000',
+        REGISTRAR_HOURLY_LIMIT='1000000000',
+        REGISTRAR_DAILY_LIMIT='1000000000',
+        JOB_CONTROL_DIR=os.path.join(workdir, 'job-control'),
+        FLEET_DB=os.path.join(workdir, 'fleet.db'),
+    )
+    command = [
+        sys.executable, '-m', 'gunicorn', 'app:app',
+        '--config', os.path.join(BASE_DIR, 'gunicorn.conf.py'),
+        '--worker-class', worker_class, '--workers', str(workers), '--threads', str(threads),
+        '--bind', f'127.0.0.1:{port}', '--log-level', 'warning',
+    ]
+    process = subprocess.Popen(command, cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=sys.stderr)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            if requests.get(f'{base_url}/healthz/ready', timeout=1).status_code == 200:
+                return process, base_url
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f'gunicorn не запустился: {format_config(config)}')
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def format_config(config):
+    worker_class, workers, threads = config
+    return f'{worker_class}:{workers}' + (f'x{threads}' if worker_class == 'gthread' else '')
+
+
+def _percentile(values, share):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def make_requests(base_url, domains, batch, job_ids):
+    """Функции сценариев: session -> (HTTP статус, запрос считается успешным)"""
+    payload = {'domains': domains[:batch], 'api_keys': API_KEYS}
+    counter = itertools.count()
+
+    def stage4(session):
+        response = session.post(f'{base_url}/api/stage4', json=payload, timeout=60)
+        response.content
+        return response.status_code, response.status_code == 200
+
+    def job_status(session):
+        job_id = job_ids[next(counter) % len(job_ids)]
+        response = session.get(f'{base_url}/api/jobs/{job_id}', params={'limit': 10}, timeout=30)
+        return response.status_code, response.status_code in (200, 404)
+
+    def simple(path):
+        def call(session):
+            response = session.get(f'{base_url}{path}', timeout=30)
+            response.content
+            return response.status_code, response.status_code == 200
+        return call
+
+    return {
+        'settings': simple('/api/settings'),
+        'ready': simple('/healthz/ready'),
+        'metrics': simple('/metrics'),
+        'job_status': job_status,
+        'stage4': stage4,
+    }
+
+
+def run_scenario(call, concurrency, duration):
+    """Нагрузка call из concurrency потоков в течение duration секунд"""
+    latencies = []
+    statuses = {}
+    errors = 0
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def client():
+        nonlocal errors
+        own = []
+        own_statuses = {}
+        own_errors = 0
+        with requests.Session() as session:
+            while time.monotonic() < stop_at:
+                started = time.perf_counter()
+                try:
+                    status, ok = call(session)
+                except requests.exceptions.RequestException:
+                    status, ok = 'exception', False
+                own.append(time.perf_counter() - started)
+                own_statuses[status] = own_statuses.get(status, 0) + 1
+                own_errors += not ok
+        with lock:
+            latencies.extend(own)
+            errors += own_errors
+            for status, count in own_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    as_ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': {str(status): count for status, count in statuses.items()},
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': as_ms(_percentile(latencies, 0.5)),
+        'p95_ms': as_ms(_percentile(latencies, 0.95)),
+        'p99_ms': as_ms(_percentile(latencies, 0.99)),
+    }
+
+
+def seed_jobs(base_url, count):
+    """Задания этапа 4 для опроса статуса (ID из заголовка X-Job-Id)"""
+    job_ids = []
+    with requests.Session() as session:
+        for _ in range(count):
+            response = session.post(f'{base_url}/api/stage4', json={'domains': ['loadtest0.com'], 'api_keys': API_KEYS},
+                                    timeout=60)
+            if response.headers.get('X-Job-Id'):
+                job_ids.append(response.headers['X-Job-Id'])
+    return job_ids
+
+
+def median_result(runs):
+    """Медиана повторов замера (запросы и ошибки - сумма)"""
+    result = {
+        'runs': len(runs),
+        'requests': sum(r['requests'] for r in runs),
+        'errors': sum(r['errors'] for r in runs),
+    }
+    for field in ('rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+        values = [r[field] for r in runs if r[field] is not None]
+        result[field] = round(statistics.median(values), 2) if values else None
+    return result
+
+
+def rps_ratios(measured, reference):
+    """Отношение rps каждой конфигурации к опорной на том же сценарии и параллельности"""
+    ratios = {}
+    for key, result in measured.items():
+        config, _, rest = key.partition('/')
+        base = measured.get(f'{reference}/{rest}')
+        if config == reference or not base or not base['rps']:
+            continue
+        ratios[key] = round(result['rps'] / base['rps'], 3)
+    return ratios
+
+
+def compare(ratios, baseline, tolerance):
+    """
+    Регрессии отношений rps относительно базы: [(ключ, текст)]
+
+    Выигрыш базы меньше tolerance считается шумом, и такое отношение
+    сравнивается с 1: короткие запросы упираются в CPU, класс воркеров их
+    пропускную способность не меняет, а разброс замеров на одном ядре - до 30%.
+    """
+    regressions = []
+    for key, ratio in ratios.items():
+        base = baseline.get(key)
+        if base and base <= 1 + tolerance:
+            base = min(base, 1.0)
+        if base and ratio < base * (1 - tolerance):
+            regressions.append((key, f"rps к опорной конфигурации {ratio} < {base} - {int(tolerance * 100)}%"))
+    return regressions
+
+
+def run(args, out):
+    try:
+        configs = [parse_config(value) for value in args.configs.split(',') if value]
+        scenarios = [value for value in args.scenarios.split(',') if value]
+        concurrency_levels = [int(value) for value in args.concurrency.split(',') if value]
+    except ValueError as e:
+        print(f'Ошибка параметров: {e}', file=sys.stderr)
+        return EXIT_USAGE
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown or not configs or not concurrency_levels:
+        print(f'Сценарии: {", ".join(SCENARIOS)}', file=sys.stderr)
+        return EXIT_USAGE
+
+    if args.repeat < 1:
+        print('--repeat должен быть не меньше 1', file=sys.stderr)
+        return EXIT_USAGE
+
+    baseline = None
+    reference = format_config(configs[0])
+    if args.check:
+        try:
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+            baseline_reference, baseline_ratios = baseline['reference'], baseline['ratios']
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f'Не удалось прочитать базу {args.baseline} (старый формат - снимите заново '
+                  f'с --save-baseline): {e}', file=sys.stderr)
+            return EXIT_USAGE
+        if baseline_reference != reference:
+            print(f'База снята относительно {baseline_reference}: укажите её первой в --configs',
+                  file=sys.stderr)
+            return EXIT_USAGE
+
+    domains = [f'loadtest{i}.com' for i in range(max(args.batch, 1))]
+    runs = {}
+    failed = False
+    with tempfile.TemporaryDirectory(prefix='loadtest-') as workdir:
+        replay_path = os.path.join(workdir, 'replay.jsonl')
+        write_replay(replay_path, domains, args.provider_latency)
+        # Повторы чередуют конфигурации: фоновая нагрузка машины в один момент
+        # не ложится целиком на одну из них
+        for run_index in range(args.repeat):
+            for config in configs:
+                try:
+                    process, base_url = start_server(config, replay_path, workdir)
+                except RuntimeError as e:
+                    print(e, file=sys.stderr)
+                    return EXIT_USAGE
+                try:
+                    job_ids = seed_jobs(base_url, STATUS_JOBS) if 'job_status' in scenarios else []
+                    calls = make_requests(base_url, domains, args.batch, job_ids or ['missing'])
+                    for scenario in scenarios:
+                        for concurrency in concurrency_levels:
+                            key = f'{format_config(config)}/{scenario}/{concurrency}'
+                            result = run_scenario(calls[scenario], concurrency, args.duration)
+                            runs.setdefault(key, []).append(result)
+                            failed = failed or result['errors'] > 0
+                            out.write(json.dumps(dict(key=key, run=run_index, **result), ensure_ascii=False) + '\n')
+                            out.flush()
+                finally:
+                    stop_server(process)
+
+    measured = {key: median_result(key_runs) for key, key_runs in runs.items()}
+    ratios = rps_ratios(measured, reference)
+    for key, result in measured.items():
+        out.write(json.dumps(dict(key=key, run='median', ratio=ratios.get(key), **result), ensure_ascii=False) + '\n')
+    out.flush()
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({
+                'reference': reference,
+                'ratios': ratios,
+                # Только для справки: зависят от машины и в проверке не участвуют
+                'machine': {'platform': platform.platform(), 'cpus': os.cpu_count(),
+                            'duration': args.duration, 'repeat': args.repeat},
+                'measured': {key: {'rps': r['rps'], 'p95_ms': r['p95_ms']} for key, r in measured.items()},
+            }, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'База сохранена: {args.baseline}', file=sys.stderr)
+        return EXIT_REGRESSION if failed else EXIT_OK
+
+    if args.check:
+        regressions = compare(ratios, baseline_ratios, args.tolerance)
+        for key, message in regressions:
+            print(f'Регрессия {key}: {message}', file=sys.stderr)
+        failed = failed or bool(regressions)
+    return EXIT_REGRESSION if failed else EXIT_OK
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный тест веб-слоя без обращений к провайдерам')
+    parser.add_argument('--configs', default='sync:1,sync:4,gthread:1x8,gthread:4x8',
+                        help='конфигурации воркеров gunicorn через запятую (класс:воркеры[xпотоки]); '
+                             'первая - опорная для отношений rps')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='сценарии через запятую')
+    parser.add_argument('--concurrency', default='1,16', help='параллельных клиентов через запятую')
+    parser.add_argument('--duration', type=float, default=5, help='секунд на сценарий и уровень параллельности')
+    parser.add_argument('--repeat', type=int, default=3, help='повторов каждого замера (итог - медиана)')
+    parser.add_argument('--batch', type=int, default=5, help='доменов в запросе этапа 4')
+    parser.add_argument('--provider-latency', type=float, default=0.02,
+                        help='задержка ответа подменённого Cloudflare, сек')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='файл базы')
+    parser.add_argument('--check', action='store_true', help='сравнить с базой')
+    parser.add_argument('--save-baseline', action='store_true', help='записать замер как базу')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='допустимое снижение отношения rps к опорной конфигурации (доля)')
+    args = parser.parse_args(argv)
+    return run(args, sys.stdout)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+Метрики исходящих запросов в формате Prometheus
+
+Собирает счётчики и гистограммы задержек по провайдеру и endpoint.
+Все операции - O(1) под одной блокировкой, чтобы не замедлять цикл по доменам.
+"""
+
+import bisect
+import threading
+
+# Границы корзин гистограммы задержек (секунды)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+
+_HELP = {
+    'dns_outbound_requests_total': 'Количество исходящих запросов',
+    'dns_outbound_retries_total': 'Количество повторных попыток (перебор endpoints/форматов)',
+    'dns_outbound_request_bytes_total': 'Отправлено байт в теле запросов',
+    'dns_outbound_response_bytes_total': 'Получено байт в теле ответов',
+    'dns_outbound_request_duration_seconds': 'Длительность исходящих запросов',
+    'dns_outbound_hedges_total': 'Дублирующие (hedged) чтения: won - первым ответил дубль, lost - основной запрос',
+    'dns_outbound_effective_duration_seconds': 'Время ответа hedged чтения для вызывающего кода',
+    'dns_stage_domain_duration_seconds': 'Длительность обработки домена на этапе',
+    'dns_registrar_cache_total': 'Обращения к кэшу списков записей регистратора',
+    'dns_circuit_breaker_state': 'Состояние circuit breaker (0 - closed, 1 - half_open, 2 - open)',
+    'dns_circuit_breaker_rejections_total': 'Запросы, отклонённые открытым circuit breaker',
+    'dns_deadline_exceeded_total': 'Работа, отменённая по истечении дедлайна',
+    'dns_singleflight_shared_total': 'Запросы, получившие результат одновременного такого же запроса',
+    'dns_drift_checks_total': 'Проверки дрейфа управляемых доменов',
+    'dns_drift_zone_index_size': 'Зон в индексе Cloudflare планировщика дрейфа',
+    'dns_scheduler_queue_depth': 'Ожидающих в очереди справедливого планировщика',
+    'dns_scheduler_wait_seconds': 'Ожидание слота или токена в очереди планировщика',
+    'dns_shard_tasks_total': 'Задачи распределённых заданий, выполненные узлом',
+    'dns_shard_leases_reclaimed_total': 'Аренды задач, забранные у узлов с истёкшим heartbeat',
+    'dns_worker_ready': 'Воркер прогрет и принимает трафик (1) или ещё прогревается (0)',
+    'dns_warmup_duration_seconds': 'Длительность прогрева воркера',
+    'dns_parked_domains_total': 'Домены, отложенные из-за открытого circuit breaker',
+}
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, labels, value=1):
+    """Увеличение счётчика"""
+    key = _key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+
+
+def set_gauge(name, labels, value):
+    """Установка значения gauge"""
+    with _lock:
+        _gauges.setdefault(name, {})[_key(labels)] = value
+
+
+def observe(name, labels, value):
+    """Добавление наблюдения в гистограмму"""
+    key = _key(labels)
+    index = bisect.bisect_left(LATENCY_BUCKETS, value)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+        hist[0][index] += 1
+        hist[1] += value
+        hist[2] += 1
+
+
+def observe_request(provider, endpoint, method, status, duration, sent=0, received=0, attempt=0):
+    """Запись метрик одного исходящего запроса"""
+    labels = {'provider': provider, 'endpoint': endpoint, 'method': method}
+    inc('dns_outbound_requests_total', dict(labels, status=status))
+    observe('dns_outbound_request_duration_seconds', labels, duration)
+    if attempt:
+        inc('dns_outbound_retries_total', labels)
+    if sent:
+        inc('dns_outbound_request_bytes_total', labels, sent)
+    if received:
+        inc('dns_outbound_response_bytes_total', labels, received)
+
+
+def histogram_quantile(name, labels, q):
+    """
+    Оценка квантиля по гистограмме (верхняя граница корзины)
+
+    Возвращает None, если наблюдений ещё нет.
+    """
+    with _lock:
+        hist = _histograms.get(name, {}).get(_key(labels))
+        if not hist or not hist[2]:
+            return None
+        buckets, _, count = hist[0][:], hist[1], hist[2]
+    rank = q * count
+    cumulative = 0
+    for bound, bucket_count in zip(LATENCY_BUCKETS + (float('inf'),), buckets):
+        cumulative += bucket_count
+        if cumulative >= rank:
+            return bound
+    return None
+
+
+def _format_labels(key, extra=None):
+    items = list(key)
+    if extra:
+        items.extend(extra)
+    if not items:
+        return ''
+    parts = []
+    for k, v in items:
+        value = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{k}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def render_prometheus():
+    """Формирование текста в формате Prometheus exposition 0.0.4"""
+    with _lock:
+        counters = {n: dict(s) for n, s in _counters.items()}
+        gauges = {n: dict(s) for n, s in _gauges.items()}
+        histograms = {n: {k: (h[0][:], h[1], h[2]) for k, h in s.items()} for n, s in _histograms.items()}
+
+    lines = []
+    for name, series in sorted(counters.items()):
+        lines.append(f'# HELP {name} {_HELP.get(name, name)}')
+        lines.append(f'# TYPE {name} counter')
+        for key, value in sorted(series.items()):
+            lines.append(f'{name}{_format_labels(key)} {value}')
+
+    for name, series in sorted(gauges.items()):
+        lines.append(f'# HELP {name} {_HELP.get(name, name)}')
+        lines.append(f'# TYPE {name} gauge')
+        for key, value in sorted(series.items()):
+            lines.append(f'{name}{_format_labels(key)} {value}')
+
+    for name, series in sorted(histograms.items()):
+        lines.append(f'# HELP {name} {_HELP.get(name, name)}')
+        lines.append(f'# TYPE {name} histogram')
+        for key, (buckets, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS + (float('inf'),), buckets):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{_format_labels(key, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(key)} {total}')
+            lines.append(f'{name}_count{_format_labels(key)} {count}')
+
+    return '\n'.join(lines) + '\n'
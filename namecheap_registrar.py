@@ -5,6 +5,8 @@
 
 import requests
 from config import REGISTRAR_API_URL, REGISTRAR_API_KEY, REGISTRAR_API_SECRET
+from domains import split_domain
+from http_client import outbound_request
 
 def get_namecheap_headers():
     """Получение заголовков для API Namecheap"""
@@ -38,10 +40,8 @@ def namecheap_get_dns_records(domain, api_keys=None):
         user_name = api_user
         client_ip = '127.0.0.1'
     
-    # Разделяем домен на SLD и TLD
-    parts = domain.split('.')
-    sld = parts[0]
-    tld = '.'.join(parts[1:])
+    # Разделяем домен на SLD и TLD по публичным суффиксам (example.com.ua -> example, com.ua)
+    _subdomain, sld, tld = split_domain(domain)
     
     params = {
         'ApiUser': api_user,
@@ -54,7 +54,7 @@ def namecheap_get_dns_records(domain, api_keys=None):
     }
     
     try:
-        response = requests.get(api_url, params=params, timeout=30)
+        response = outbound_request('namecheap', params['Command'], 'GET', api_url, params=params)
         response.raise_for_status()
         # Namecheap возвращает XML, нужно парсить
         return response.text  # Или используйте xml.etree.ElementTree для парсинга
@@ -87,9 +87,7 @@ def namecheap_set_dns_records(domain, ip_address, api_keys=None):
         user_name = api_user
         client_ip = '127.0.0.1'
     
-    parts = domain.split('.')
-    sld = parts[0]
-    tld = '.'.join(parts[1:])
+    _subdomain, sld, tld = split_domain(domain)
     
     params = {
         'ApiUser': api_user,
@@ -106,7 +104,7 @@ def namecheap_set_dns_records(domain, ip_address, api_keys=None):
     }
     
     try:
-        response = requests.post(api_url, params=params, timeout=30)
+        response = outbound_request('namecheap', params['Command'], 'POST', api_url, params=params)
         response.raise_for_status()
         return response.text
     except requests.exceptions.RequestException as e:
@@ -154,9 +152,7 @@ def namecheap_update_nameservers(domain, nameservers, api_keys=None):
         user_name = api_user
         client_ip = '127.0.0.1'
     
-    parts = domain.split('.')
-    sld = parts[0]
-    tld = '.'.join(parts[1:])
+    _subdomain, sld, tld = split_domain(domain)
     
     # Формируем параметры для NS записей
     params = {
@@ -174,7 +170,7 @@ def namecheap_update_nameservers(domain, nameservers, api_keys=None):
         params[f'Nameserver{i}'] = ns
     
     try:
-        response = requests.post(api_url, params=params, timeout=30)
+        response = outbound_request('namecheap', params['Command'], 'POST', api_url, params=params)
         response.raise_for_status()
         return response.text
     except requests.exceptions.RequestException as e:
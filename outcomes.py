@@ -0,0 +1,178 @@
+"""
+Компактные результаты обработки доменов и сводки заданий
+
+Результат домена на этапе - DomainResult с __slots__: домен, статус, код
+сообщения, необязательная деталь (текст ошибки провайдера) и редкие
+дополнительные поля (zone_id, nameservers, changes...). Статусы и коды -
+одни и те же строки из таблиц ниже на все результаты задания; текст
+сообщения на русском собирается из шаблона только при выдаче клиенту
+(as_dict, JSON ответа и NDJSON).
+
+Сводка задания (Summary) хранится по колонкам: список этапов, список
+статусов и матрица счётчиков этап x статус, плюс гистограммы кодов ошибок
+по этапам - её размер не зависит от числа доменов.
+"""
+
+import sys
+import threading
+
+STATUSES = ('success', 'error', 'deferred', 'deadline_exceeded', 'cancelled')
+
+# Код -> шаблон сообщения ({detail} - деталь результата)
+MESSAGES = {
+    'a_record_updated': 'A запись успешно обновлена',
+    'records_applied': 'Набор DNS записей успешно применён',
+    'zone_seeded': 'Домен настроен в Cloudflare, записи загружены из данных регистратора',
+    'zone_a_only': 'Домен настроен в Cloudflare, оставлены только A записи',
+    'ns_updated': 'NS записи успешно обновлены',
+    'tls_configured': 'TLS, Always HTTPS и HSTS успешно настроены',
+    'snapshot_saved': 'Снимок сохранён ({detail} записей)',
+    'rollback_done': 'Записи восстановлены из снимка',
+    'zone_add_failed': 'Ошибка добавления домена: {detail}',
+    'zone_seed_failed': 'Ошибка загрузки записей в Cloudflare: {detail}',
+    'zone_not_found': 'Домен не найден в Cloudflare',
+    'zone_info_failed': 'Ошибка получения информации о зоне',
+    'ns_not_found': 'NS записи не найдены в Cloudflare',
+    'tls_unknown_profile': 'Неизвестный профиль TLS: {detail}',
+    'tls_failed': 'Ошибки: {detail}',
+    'snapshot_failed': 'Ошибка снимка: {detail}',
+    'snapshot_missing': 'Снимок записей не создан, домен пропущен',
+    'rollback_not_in_snapshot': 'Домена нет в снимке',
+    'rollback_failed': 'Ошибка отката: {detail}',
+    'unknown_account': 'Неизвестный аккаунт: {detail}',
+    'task_failed': 'Задача не выполнена: {detail}',
+    'deferred': 'Домен отложен: {detail}',
+    'deadline_exceeded': '{detail}',
+    'cancelled': 'Время задания истекло, домен не обработан',
+    'job_cancelled': 'Задание отменено, домен не обработан',
+    # Текст ошибки как есть (исключения при обработке домена)
+    'text': '{detail}',
+}
+
+_STATUS_IDS = {status: status for status in STATUSES}
+_CODE_IDS = {code: code for code in MESSAGES}
+
+
+class DomainResult:
+    """Результат домена на этапе"""
+
+    __slots__ = ('domain', 'stage', 'status', 'code', 'detail', 'extra')
+
+    def __init__(self, domain, status, code, detail=None, extra=None, stage=None):
+        self.domain = domain
+        self.stage = stage
+        self.status = _STATUS_IDS.get(status) or sys.intern(status)
+        self.code = _CODE_IDS.get(code) or sys.intern(code)
+        # Детали (тексты ошибок провайдеров) повторяются от домена к домену
+        self.detail = None if detail is None else sys.intern(str(detail))
+        self.extra = extra or None
+
+    @property
+    def message(self):
+        template = MESSAGES.get(self.code, '{detail}')
+        return template.format(detail=self.detail if self.detail is not None else '')
+
+    def as_dict(self):
+        """Результат в виде ответа API (с текстом сообщения)"""
+        result = {'domain': self.domain, 'status': self.status, 'code': self.code}
+        if self.extra:
+            result.update(self.extra)
+        result['message'] = self.message
+        if self.stage is not None:
+            result['stage'] = self.stage
+        return result
+
+    def to_record(self):
+        """Компактная форма без текста сообщения (передача между узлами)"""
+        record = {'domain': self.domain, 'status': self.status, 'code': self.code}
+        if self.detail is not None:
+            record['detail'] = self.detail
+        if self.extra:
+            record['extra'] = self.extra
+        return record
+
+    def get(self, key, default=None):
+        """Доступ к полям как у словаря результата (для старого кода)"""
+        if key in ('domain', 'stage', 'status', 'code', 'detail'):
+            return getattr(self, key)
+        if key == 'message':
+            return self.message
+        return (self.extra or {}).get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, KeyError)
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def __repr__(self):
+        return f'DomainResult({self.domain!r}, {self.status!r}, {self.code!r})'
+
+
+def success(domain, code, detail=None, **extra):
+    return DomainResult(domain, 'success', code, detail, extra)
+
+
+def error(domain, code, detail=None, **extra):
+    return DomainResult(domain, 'error', code, detail, extra)
+
+
+def coerce(value):
+    """DomainResult из результата-словаря (to_record или старого формата с message)"""
+    if isinstance(value, DomainResult) or value is None:
+        return value
+    value = dict(value)
+    domain = value.pop('domain', None)
+    status = value.pop('status', 'error')
+    stage = value.pop('stage', None)
+    code = value.pop('code', None)
+    detail = value.pop('detail', None)
+    message = value.pop('message', None)
+    extra = value.pop('extra', None) or value
+    if code is None:
+        code, detail = 'text', message
+    return DomainResult(domain, status, code, detail, extra, stage)
+
+
+def to_json(value):
+    """default для json.dumps: результаты домена в виде ответа API"""
+    if isinstance(value, DomainResult):
+        return value.as_dict()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class Summary:
+    """Счётчики результатов задания по этапам и статусам, гистограммы кодов ошибок"""
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, result):
+        with self._lock:
+            counts, codes = self._stages.get(stage) or self._stages.setdefault(stage, ({}, {}))
+            counts[result.status] = counts.get(result.status, 0) + 1
+            if result.status != 'success':
+                codes[result.code] = codes.get(result.code, 0) + 1
+
+    def as_dict(self):
+        """
+        Сводка по колонкам:
+
+            {"stages": [...], "statuses": [...], "counts": [[n по статусам] по этапам],
+             "error_codes": {этап: {код: n}}, "total": n}
+        """
+        with self._lock:
+            stages = list(self._stages)
+            statuses = list(STATUSES) + sorted({
+                status for counts, _ in self._stages.values() for status in counts if status not in _STATUS_IDS
+            })
+            counts = [[self._stages[stage][0].get(status, 0) for status in statuses] for stage in stages]
+            error_codes = {stage: dict(self._stages[stage][1]) for stage in stages if self._stages[stage][1]}
+        return {
+            'stages': stages,
+            'statuses': statuses,
+            'counts': counts,
+            'error_codes': error_codes,
+            'total': sum(map(sum, counts)),
+        }
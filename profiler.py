@@ -0,0 +1,163 @@
+"""
+Сэмплирующий профилировщик для живых заданий
+
+Фоновый поток раз в PROFILE_INTERVAL секунд снимает стеки всех потоков
+процесса (sys._current_frames) и считает одинаковые стеки. Профиль задания
+берёт только потоки, которые в момент снимка обрабатывают домен этого
+задания (jobs.thread_activity), первым кадром стека идёт этап. Профиль
+воркера - все потоки процесса, первым кадром идёт имя потока.
+
+Результат - свёрнутые стеки ("кадр;кадр;кадр число"), формат flamegraph.pl,
+speedscope и inferno. Пока профилировщик не запущен, он ничего не стоит:
+сбор идёт только в его собственном потоке.
+"""
+
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+import jobs
+from config import PROFILE_INTERVAL, PROFILE_MAX_SECONDS
+
+# Сколько последних профилей храним в памяти
+MAX_PROFILES = 10
+
+_profiles = OrderedDict()
+_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Профилировщик уже запущен в этом процессе"""
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        stack.append(_frame_name(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class Profile(threading.Thread):
+    """Один сеанс профилирования (задания или всего процесса)"""
+
+    def __init__(self, job_id=None, interval=PROFILE_INTERVAL, max_seconds=PROFILE_MAX_SECONDS):
+        super().__init__(name='profiler', daemon=True)
+        self.id = uuid.uuid4().hex[:12]
+        self.job_id = job_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.started_at = time.time()
+        self.stopped_at = None
+        self.samples = 0
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+        self._stacks_lock = threading.Lock()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def _sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        sampled = []
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            if self.job_id:
+                activity = jobs.thread_activity(ident)
+                if activity is None or activity[0] != self.job_id:
+                    continue
+                root = activity[1]
+            else:
+                root = names.get(ident, str(ident))
+            sampled.append(';'.join([root] + _collapse(frame)))
+        with self._stacks_lock:
+            self.stacks.update(sampled)
+            self.samples += 1
+
+    def _snapshot(self):
+        with self._stacks_lock:
+            return dict(self.stacks)
+
+    def run(self):
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop_event.wait(self.interval):
+            self._sample()
+            if time.monotonic() >= deadline:
+                break
+            if self.job_id and _job_finished(self.job_id):
+                break
+        self.stopped_at = time.time()
+
+    @property
+    def running(self):
+        return self.stopped_at is None
+
+    def collapsed(self):
+        """Свёрнутые стеки для flamegraph"""
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self._snapshot().items()))
+
+    def summary(self, top=20):
+        """Состояние и самые частые функции (собственное время по последнему кадру)"""
+        stacks = self._snapshot()
+        own = Counter()
+        for stack, count in stacks.items():
+            own[stack.rsplit(';', 1)[-1]] += count
+        total = sum(stacks.values()) or 1
+        return {
+            'profile_id': self.id,
+            'job_id': self.job_id,
+            'pid': os.getpid(),
+            'running': self.running,
+            'interval': self.interval,
+            'started_at': self.started_at,
+            'stopped_at': self.stopped_at,
+            'samples': self.samples,
+            'stacks': len(stacks),
+            'top': [{'frame': frame, 'samples': count, 'share': round(count / total, 4)}
+                    for frame, count in own.most_common(top)],
+        }
+
+
+def _job_finished(job_id):
+    job = jobs.get_job(job_id)
+    return job is None or job.status not in ('queued', 'running')
+
+
+def start(job_id=None, interval=PROFILE_INTERVAL, max_seconds=PROFILE_MAX_SECONDS):
+    """
+    Запуск профилирования (в процессе одновременно не больше одного)
+
+    Raises:
+        ProfilerBusy: профилировщик уже работает
+    """
+    with _lock:
+        if any(profile.running for profile in _profiles.values()):
+            raise ProfilerBusy('Профилировщик уже запущен')
+        profile = Profile(job_id, interval, min(max_seconds, PROFILE_MAX_SECONDS))
+        _profiles[profile.id] = profile
+        while len(_profiles) > MAX_PROFILES:
+            _profiles.popitem(last=False)
+    profile.start()
+    return profile
+
+
+def get(profile_id):
+    with _lock:
+        return _profiles.get(profile_id)
+
+
+def list_profiles():
+    with _lock:
+        return [profile.summary(top=0) for profile in _profiles.values()]
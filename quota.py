@@ -0,0 +1,297 @@
+"""
+Учёт квоты исходящих запросов
+
+- Скользящие окна использования API по провайдеру и аккаунту (час/сутки для
+  ukraine.com.ua, 5 минут для Cloudflare)
+- Оценка числа запросов задания до запуска по закэшированному состоянию
+  (известный рабочий endpoint, число записей домена при прошлом запуске)
+- Резервирование оценки на время задания, чтобы два параллельных задания
+  не прошли проверку одновременно
+- Отчёт: фактическое число запросов против оценки
+- Ожидание свободного места в окнах (throttle) для параллельных чтений
+"""
+
+import hashlib
+import threading
+import time
+from collections import deque
+
+from config import REGISTRAR_HOURLY_LIMIT, REGISTRAR_DAILY_LIMIT, CLOUDFLARE_RATE_LIMIT
+import deadlines
+import ukraine_registrar
+
+# Окна лимитов: провайдер -> [(имя окна, длительность в секундах, лимит)]
+LIMITS = {
+    'ukraine': [('hour', 3600, REGISTRAR_HOURLY_LIMIT), ('day', 86400, REGISTRAR_DAILY_LIMIT)],
+    'cloudflare': [('5min', 300, CLOUDFLARE_RATE_LIMIT)],
+}
+
+# Окна, превышение которых приводит к отказу в запуске задания.
+# Часовое окно и окно Cloudflare восстанавливаются быстро - только показываем.
+ENFORCED_WINDOWS = {'day'}
+
+# Запросов к Cloudflare на домен по этапам (поиск зоны + операции этапа)
+CLOUDFLARE_CALLS_PER_DOMAIN = {
+    'stage1': 0,
+    'stage2': 4,  # zones?name, создание зоны, список записей, удаление не-A (или batch)
+    'stage3': 2,  # zones?name, zones/{id}
+    'stage4': 2,  # zones?name, settings (все настройки профиля одним запросом)
+}
+# Поштучная установка настроек после отказа пакета (drift.patch_zone_settings,
+# до 6 запросов) в оценку stage4 не входит: она бывает только при 400 - ошибке
+# в значениях профиля, а не в обычной работе. Окно Cloudflare к тому же не
+# блокирует запуск (ENFORCED_WINDOWS), а темп запросов держит планировщик.
+
+_lock = threading.Lock()
+_usage = {}         # (провайдер, аккаунт) -> deque времён запросов за сутки
+_reservations = {}  # (провайдер, аккаунт) -> {job_id: задание}
+
+
+class QuotaExceeded(Exception):
+    """Задание превысит оставшуюся квоту"""
+
+    def __init__(self, message, details):
+        super().__init__(message)
+        self.details = details
+
+
+def account_key(secret):
+    """Короткий необратимый идентификатор аккаунта по токену/email"""
+    if not secret:
+        return 'default'
+    return hashlib.sha256(secret.encode('utf-8')).hexdigest()[:12]
+
+
+def accounts_for(api_keys):
+    """Аккаунты провайдеров для ключей из запроса"""
+    api_keys = api_keys or {}
+    return {
+        'ukraine': account_key(api_keys.get('registrar_api_key', '')),
+        'cloudflare': account_key(api_keys.get('cloudflare_email', '')),
+    }
+
+
+def account_from_headers(headers):
+    """Аккаунт по заголовкам исходящего запроса"""
+    if not headers:
+        return 'default'
+    auth = headers.get('Authorization', '')
+    if auth.startswith('Bearer '):
+        return account_key(auth[len('Bearer '):])
+    return account_key(headers.get('X-Auth-Email', ''))
+
+
+def record_call(provider, account):
+    """Учёт выполненного запроса в скользящих окнах"""
+    now = time.time()
+    with _lock:
+        window = _usage.setdefault((provider, account), deque())
+        window.append(now)
+        # Храним не больше суток
+        while window and window[0] < now - 86400:
+            window.popleft()
+
+
+def _used(provider, account, seconds, now):
+    window = _usage.get((provider, account))
+    if not window:
+        return 0
+    since = now - seconds
+    # deque отсортирован по времени: считаем с конца до границы окна
+    count = 0
+    for ts in reversed(window):
+        if ts < since:
+            break
+        count += 1
+    return count
+
+
+def _remaining_locked(provider, account, now):
+    # Резерв задания уменьшается по мере того, как оно тратит запросы:
+    # потраченные уже учтены в окнах использования
+    reserved = sum(
+        max(0, job.reservations.get((provider, account), 0) - job.account_calls(provider, account))
+        for job in _reservations.get((provider, account), {}).values()
+    )
+    return {
+        name: limit - _used(provider, account, seconds, now) - reserved
+        for name, seconds, limit in LIMITS.get(provider, [])
+    }
+
+
+def remaining(provider, account):
+    """Оставшаяся квота по окнам с учётом резервов запущенных заданий"""
+    with _lock:
+        return _remaining_locked(provider, account, time.time())
+
+
+def retry_after(provider, account, needed):
+    """Через сколько секунд в суточном окне освободится needed запросов"""
+    now = time.time()
+    with _lock:
+        window = list(_usage.get((provider, account), ()))
+    if needed <= 0 or not window:
+        return 0
+    index = min(needed, len(window)) - 1
+    return max(0, int(window[index] + 86400 - now) + 1)
+
+
+def throttle(provider, account):
+    """
+    Ожидание, пока во всех окнах провайдера не появится место для запроса
+
+    Резервы заданий не учитываются - это ограничение темпа, а не проверка
+    бюджета. Ждёт не дольше дедлайна текущего задания/домена.
+
+    Raises:
+        DeadlineExceeded: место освободится позже дедлайна
+    """
+    while True:
+        now = time.time()
+        wait = 0
+        with _lock:
+            window = _usage.get((provider, account)) or ()
+            for _name, seconds, limit in LIMITS.get(provider, []):
+                if limit > 0 and _used(provider, account, seconds, now) >= limit:
+                    # Место освободится, когда самый старый запрос в окне выйдет из него
+                    oldest = window[len(window) - limit]
+                    wait = max(wait, oldest + seconds - now)
+        if wait <= 0:
+            return
+        left = deadlines.remaining()
+        if left is not None and wait > left:
+            raise deadlines.DeadlineExceeded(
+                f'Лимит запросов к {provider} исчерпан, место освободится через {int(wait) + 1} с'
+            )
+        time.sleep(wait)
+
+
+def estimate_job(stages, domains, api_keys, records_per_domain=1, seed_from_registrar=False):
+    """
+    Оценка числа исходящих запросов задания
+
+    records_per_domain - число записей в шаблоне этапа 1.
+    seed_from_registrar - этап 2 засевает зоны данными регистратора
+    (без этапа 1 в том же задании списки читаются у регистратора).
+
+    Returns:
+        {'ukraine': n, 'cloudflare': m, 'per_stage': {stage: {provider: n}}}
+    """
+    per_stage = {}
+    for stage in stages:
+        registrar_calls = 0
+        if stage == 'stage1':
+            registrar_calls = sum(ukraine_registrar.ukraine_expected_calls('update_a_record', d, api_keys, records_per_domain) for d in domains)
+        elif stage == 'stage2' and seed_from_registrar and 'stage1' not in stages:
+            registrar_calls = sum(ukraine_registrar.ukraine_expected_calls('get_records', d, api_keys) for d in domains)
+        elif stage == 'snapshot':
+            registrar_calls = sum(ukraine_registrar.ukraine_expected_calls('snapshot', d, api_keys) for d in domains)
+        elif stage == 'stage3':
+            registrar_calls = sum(ukraine_registrar.ukraine_expected_calls('update_nameservers', d, api_keys) for d in domains)
+        per_stage[stage] = {
+            'ukraine': registrar_calls,
+            'cloudflare': CLOUDFLARE_CALLS_PER_DOMAIN.get(stage, 0) * len(domains),
+        }
+    return {
+        'ukraine': sum(s['ukraine'] for s in per_stage.values()),
+        'cloudflare': sum(s['cloudflare'] for s in per_stage.values()),
+        'per_stage': per_stage,
+    }
+
+
+def reserve(job, estimate, api_keys):
+    """
+    Проверка оценки против оставшейся квоты и резервирование
+
+    Повторные вызовы для того же задания (импорт пачками, разные аккаунты)
+    добавляют оценку к уже зарезервированной.
+
+    Raises:
+        QuotaExceeded: если задание не помещается в суточную квоту
+    """
+    accounts = accounts_for(api_keys)
+    exceeded = None
+    now = time.time()
+    # Проверка и резерв под одной блокировкой, чтобы параллельные задания
+    # не прошли проверку одновременно
+    with _lock:
+        for provider in LIMITS:
+            needed = estimate.get(provider, 0)
+            left = _remaining_locked(provider, accounts[provider], now)
+            for window, value in left.items():
+                if window in ENFORCED_WINDOWS and needed > value:
+                    exceeded = (provider, window, needed, max(value, 0))
+                    break
+            if exceeded:
+                break
+        else:
+            for provider in LIMITS:
+                if estimate.get(provider):
+                    key = (provider, accounts[provider])
+                    job.reservations[key] = job.reservations.get(key, 0) + estimate[provider]
+                    _reservations.setdefault(key, {})[job.id] = job
+
+    if exceeded:
+        provider, window, needed, left = exceeded
+        details = {
+            'provider': provider,
+            'window': window,
+            'estimated': needed,
+            'remaining': left,
+            'retry_after': retry_after(provider, accounts[provider], needed - left),
+        }
+        raise QuotaExceeded(
+            f'Задание потребует ~{needed} запросов к {provider}, '
+            f'а осталось {left} (окно: {window}). Уменьшите список доменов или повторите позже.',
+            details
+        )
+
+    if job.budget_estimate is None:
+        job.budget_estimate = estimate
+        job.accounts = accounts
+    else:
+        job.budget_estimate = _merge_estimates(job.budget_estimate, estimate)
+
+
+def _merge_estimates(a, b):
+    per_stage = {stage: dict(values) for stage, values in a.get('per_stage', {}).items()}
+    for stage, values in b.get('per_stage', {}).items():
+        target = per_stage.setdefault(stage, {})
+        for provider, count in values.items():
+            target[provider] = target.get(provider, 0) + count
+    merged = {p: a.get(p, 0) + b.get(p, 0) for p in LIMITS}
+    merged['per_stage'] = per_stage
+    return merged
+
+
+def release(job):
+    """Снятие резерва задания (фактические запросы уже учтены в окнах)"""
+    with _lock:
+        for key in job.reservations:
+            _reservations.get(key, {}).pop(job.id, None)
+
+
+def restore(job):
+    """Возврат резерва задания после паузы (без проверки - задание уже начато)"""
+    with _lock:
+        for key in job.reservations:
+            _reservations.setdefault(key, {})[job.id] = job
+
+
+def report(job):
+    """Фактическое число запросов задания против оценки"""
+    estimate = job.budget_estimate or {}
+    calls = job.call_counts()
+    actual = {}
+    by_endpoint = {}
+    for (provider, endpoint, _domain), count in calls.items():
+        actual[provider] = actual.get(provider, 0) + count
+        by_endpoint.setdefault(provider, {})
+        by_endpoint[provider][endpoint] = by_endpoint[provider].get(endpoint, 0) + count
+    accounts = job.accounts or {}
+    return {
+        'estimated': {p: estimate.get(p, 0) for p in LIMITS},
+        'actual': {p: actual.get(p, 0) for p in LIMITS},
+        'by_endpoint': by_endpoint,
+        'remaining': {p: remaining(p, a) for p, a in accounts.items()},
+    }
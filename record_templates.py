@@ -0,0 +1,139 @@
+"""
+Шаблоны наборов DNS записей для этапа 1
+
+Шаблон - список записей, в полях которых можно использовать переменные
+домена в фигурных скобках:
+
+    [
+        {"type": "A",    "name": "@",   "content": "{ip}"},
+        {"type": "A",    "name": "www", "content": "{ip}"},
+        {"type": "AAAA", "name": "@",   "content": "{ipv6}"},
+        {"type": "MX",   "name": "@",   "content": "mx.{domain}", "priority": 10}
+    ]
+
+Шаблон компилируется один раз на задание (разбор строк, проверка типов,
+список нужных переменных), затем разворачивается для каждого домена
+подстановкой его переменных ({domain} доступна всегда).
+"""
+
+from string import Formatter
+
+DEFAULT_TTL = 3600
+
+SUPPORTED_TYPES = {'A', 'AAAA', 'CNAME', 'MX', 'TXT', 'SRV', 'CAA', 'NS'}
+
+# Шаблон по умолчанию - прежнее поведение этапа 1: одна A запись для корня
+DEFAULT_TEMPLATE = [{'type': 'A', 'name': '@', 'content': '{ip}', 'ttl': DEFAULT_TTL}]
+
+_formatter = Formatter()
+
+
+class TemplateError(ValueError):
+    """Ошибка в шаблоне или не хватает переменных домена"""
+
+
+def _compile_field(value):
+    """Разбор строки в список (литерал, имя переменной) для быстрой подстановки"""
+    parts = []
+    try:
+        for literal, field, spec, conversion in _formatter.parse(str(value)):
+            if spec or conversion:
+                raise TemplateError(f'Форматирование не поддерживается: {value}')
+            parts.append((literal, field))
+    except ValueError as e:
+        raise TemplateError(f'Некорректный шаблон "{value}": {e}')
+    return parts
+
+
+def _render_field(parts, variables):
+    out = []
+    for literal, field in parts:
+        out.append(literal)
+        if field is not None:
+            out.append(variables[field])
+    return ''.join(out)
+
+
+class CompiledTemplate:
+    """Скомпилированный шаблон набора записей"""
+
+    def __init__(self, records):
+        self.records = []
+        self.variables = set()
+        for record in records:
+            record_type = str(record.get('type', '')).upper()
+            if record_type not in SUPPORTED_TYPES:
+                raise TemplateError(f'Неподдерживаемый тип записи: {record.get("type")}')
+            if 'content' not in record:
+                raise TemplateError(f'У записи {record_type} нет поля content')
+            name = _compile_field(record.get('name', '@'))
+            content = _compile_field(record['content'])
+            try:
+                ttl = int(record.get('ttl', DEFAULT_TTL))
+                priority = int(record.get('priority', 0))
+            except (TypeError, ValueError):
+                raise TemplateError(f'ttl и priority должны быть числами: {record}')
+            for parts in (name, content):
+                self.variables.update(field for _, field in parts if field is not None)
+            self.records.append((record_type, name, content, ttl, priority))
+        if not self.records:
+            raise TemplateError('Шаблон не содержит записей')
+
+    def __len__(self):
+        return len(self.records)
+
+    def missing(self, variables):
+        """Переменные шаблона, которых нет у домена"""
+        return sorted(v for v in self.variables if v != 'domain' and not variables.get(v))
+
+    def expand(self, domain, variables):
+        """
+        Набор записей для домена
+
+        Returns:
+            список dict(type, name, content, ttl, priority)
+
+        Raises:
+            TemplateError: если не хватает переменных
+        """
+        missing = self.missing(variables)
+        if missing:
+            raise TemplateError(f'Не заданы переменные шаблона: {", ".join(missing)}')
+        values = dict(variables, domain=domain)
+        return [
+            {
+                'type': record_type,
+                'name': _render_field(name, values) or '@',
+                'content': _render_field(content, values),
+                'ttl': ttl,
+                'priority': priority,
+            }
+            for record_type, name, content, ttl, priority in self.records
+        ]
+
+
+def compile_template(records=None):
+    """Компиляция шаблона (None - шаблон по умолчанию с одной A записью)"""
+    if records is None:
+        records = DEFAULT_TEMPLATE
+    if not isinstance(records, list):
+        raise TemplateError('Шаблон должен быть списком записей')
+    return CompiledTemplate(records)
+
+
+def domain_variables(domain, targets, default_ip=''):
+    """
+    Переменные домена для шаблона
+
+    targets[domain] может быть строкой (целевой IP) или словарём переменных.
+    """
+    target = (targets or {}).get(domain)
+    if isinstance(target, dict):
+        variables = {k: str(v) for k, v in target.items() if v is not None}
+    elif target:
+        variables = {'ip': str(target)}
+    else:
+        variables = {}
+    if not variables.get('ip') and default_ip:
+        variables['ip'] = default_ip
+    return variables
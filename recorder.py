@@ -0,0 +1,365 @@
+"""
+Запись исходящего трафика в JSONL и воспроизведение записей
+
+Запись (RECORD_TRAFFIC=1): каждый исходящий запрос к Cloudflare и
+регистраторам пишется одной строкой JSON - провайдер, endpoint, метод, URL,
+тело запроса, статус, тело ответа, длительность, задание и домен. Учётные
+данные (заголовки не пишутся, параметры и поля *key*/*token*/*secret*/*email*
+в запросах и в JSON ответах) заменяются на '***'. Файлы ротируются по
+размеру: traffic.jsonl, traffic.jsonl.1, ...
+Входящие вызовы /api/stage* и /api/run-all тоже пишутся (тип inbound), чтобы
+пакет можно было прогнать заново.
+
+Воспроизведение (REPLAY_FROM=файлы через запятую, REPLAY_SPEED): вместо
+сети outbound_request() отдаёт записанные ответы с записанной задержкой,
+делённой на REPLAY_SPEED (0 - без задержек). Квота провайдеров не тратится.
+
+Прогон записанного пакета офлайн:
+
+    python recorder.py replay recordings/traffic.jsonl* --speed 10
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+
+import jobs
+from config import (
+    RECORD_TRAFFIC, RECORDINGS_DIR, RECORDING_MAX_MB, RECORDING_BACKUPS,
+    REPLAY_FROM, REPLAY_SPEED
+)
+
+REDACTED = '***'
+
+_SECRET_KEY_RE = re.compile(r'key|token|secret|password|auth|email', re.I)
+
+# Заголовки ответа, которые имеет смысл сохранять
+_RESPONSE_HEADERS = ('Content-Type', 'Retry-After')
+
+
+def redact_mapping(mapping):
+    """Копия словаря с замаскированными значениями секретных ключей (рекурсивно)"""
+    if isinstance(mapping, list):
+        return [redact_mapping(item) for item in mapping]
+    if not isinstance(mapping, dict):
+        return mapping
+    return {
+        k: redact_mapping(v) if isinstance(v, (dict, list)) or not _SECRET_KEY_RE.search(str(k)) or v in (None, '')
+        else REDACTED
+        for k, v in mapping.items()
+    }
+
+
+def redact_url(url):
+    """URL с замаскированными секретными параметрами query string"""
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = [(k, REDACTED if _SECRET_KEY_RE.search(k) else v) for k, v in parse_qsl(parts.query, keep_blank_values=True)]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _redact_body(kwargs):
+    """Тело запроса (json/data/params) в виде, пригодном для записи и сравнения"""
+    body = {}
+    if kwargs.get('json') is not None:
+        body['json'] = redact_mapping(kwargs['json'])
+    data = kwargs.get('data')
+    if data not in (None, ''):
+        if isinstance(data, dict):
+            body['data'] = redact_mapping(data)
+        else:
+            text = data.decode('utf-8', 'replace') if isinstance(data, bytes) else str(data)
+            body['data'] = urlencode(redact_mapping(dict(parse_qsl(text, keep_blank_values=True)))) if '=' in text else text
+    if kwargs.get('params'):
+        body['params'] = redact_mapping(dict(kwargs['params']))
+    return body
+
+
+def _redact_response_body(text):
+    """Тело ответа для записи: в JSON маскируются те же поля, что и в запросах"""
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return text
+    if not isinstance(value, (dict, list)):
+        return text
+    return json.dumps(redact_mapping(value), ensure_ascii=False)
+
+
+def _exchange_key(provider, method, url, body):
+    return (provider, method, redact_url(url), json.dumps(body, sort_keys=True, ensure_ascii=False))
+
+
+class RotatingJsonlWriter:
+    """Потокобезопасная запись JSONL с ротацией по размеру"""
+
+    def __init__(self, directory, basename='traffic.jsonl', max_bytes=50 * 1024 * 1024, backups=10):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, basename)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = f'{self.path}.{index}'
+            if os.path.exists(source):
+                os.replace(source, f'{self.path}.{index + 1}')
+        if self.backups:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def write(self, entry):
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_writer = None
+_replayer = None
+
+
+def start_recording(directory=RECORDINGS_DIR):
+    """Включение записи трафика"""
+    global _writer
+    if _writer is None:
+        _writer = RotatingJsonlWriter(directory, max_bytes=RECORDING_MAX_MB * 1024 * 1024, backups=RECORDING_BACKUPS)
+    return _writer.path
+
+
+def stop_recording():
+    global _writer
+    writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+
+def recording():
+    return _writer is not None and _replayer is None
+
+
+def record_exchange(provider, endpoint, method, url, attempt, kwargs, response, error, duration):
+    """Запись одного исходящего запроса и ответа (или ошибки)"""
+    writer = _writer
+    if writer is None:
+        return
+    job = jobs.current_job()
+    entry = {
+        'type': 'outbound',
+        'ts': time.time(),
+        'job_id': job.id if job else None,
+        'domain': jobs.current_domain(),
+        'provider': provider,
+        'endpoint': endpoint,
+        'method': method,
+        'url': redact_url(url),
+        'request': _redact_body(kwargs),
+        'attempt': attempt,
+        'duration': round(duration, 6),
+    }
+    if response is not None:
+        entry['status'] = response.status_code
+        entry['headers'] = {h: response.headers[h] for h in _RESPONSE_HEADERS if h in response.headers}
+        entry['body'] = _redact_response_body(response.content.decode('utf-8', 'replace'))
+    if error is not None:
+        entry['error'] = str(error)
+        entry['error_type'] = 'timeout' if isinstance(error, requests.exceptions.Timeout) else 'connection'
+    writer.write(entry)
+
+
+def record_inbound(path, payload):
+    """Запись входящего вызова API (ключи замаскированы) для повторного прогона"""
+    writer = _writer
+    if writer is None:
+        return
+    writer.write({'type': 'inbound', 'ts': time.time(), 'path': path, 'payload': redact_mapping(payload)})
+
+
+def iter_entries(paths):
+    """Записи из файлов в порядке времени"""
+    entries = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entries.append(json.loads(line))
+    entries.sort(key=lambda e: e.get('ts', 0))
+    return entries
+
+
+class Replayer:
+    """
+    Выдача записанных ответов вместо сетевых запросов
+
+    Ответы на одинаковые запросы (метод, URL, тело) отдаются в порядке
+    записи; последний повторяется, если запросов больше, чем записей.
+    """
+
+    def __init__(self, entries, speed=1.0):
+        self.speed = speed
+        self._exact = {}
+        self._by_url = {}
+        self._lock = threading.Lock()
+        self.misses = 0
+        for entry in entries:
+            if entry.get('type') != 'outbound':
+                continue
+            key = (entry['provider'], entry['method'], entry['url'],
+                   json.dumps(entry.get('request', {}), sort_keys=True, ensure_ascii=False))
+            self._exact.setdefault(key, deque()).append(entry)
+            self._by_url.setdefault(key[:3], deque()).append(entry)
+
+    def _take(self, queue):
+        if len(queue) > 1:
+            return queue.popleft()
+        return queue[0]
+
+    def find(self, provider, method, url, kwargs):
+        key = _exchange_key(provider, method, url, _redact_body(kwargs))
+        with self._lock:
+            queue = self._exact.get(key) or self._by_url.get(key[:3])
+            if not queue:
+                self.misses += 1
+                return None
+            return self._take(queue)
+
+    def response(self, provider, method, url, kwargs):
+        """Ответ из записи (с задержкой) в виде requests.Response"""
+        entry = self.find(provider, method, url, kwargs)
+        if entry is None:
+            raise requests.exceptions.ConnectionError(f'Нет записи для {method} {redact_url(url)}')
+
+        delay = entry.get('duration', 0) / self.speed if self.speed else 0
+        timeout = kwargs.get('timeout')
+        limit = min(timeout) if isinstance(timeout, tuple) else timeout
+        if limit is not None and delay > limit:
+            time.sleep(limit)
+            raise requests.exceptions.ReadTimeout(f'Таймаут воспроизведения {method} {redact_url(url)}')
+        if delay:
+            time.sleep(delay)
+
+        if 'status' not in entry:
+            if entry.get('error_type') == 'timeout':
+                raise requests.exceptions.ReadTimeout(entry.get('error', 'timeout'))
+            raise requests.exceptions.ConnectionError(entry.get('error', 'connection error'))
+
+        response = requests.models.Response()
+        response.status_code = entry['status']
+        response._content = entry.get('body', '').encode('utf-8')
+        response.headers.update(entry.get('headers', {}))
+        response.encoding = 'utf-8'
+        response.url = url
+        response.request = requests.Request(
+            method, url, headers=kwargs.get('headers'), json=kwargs.get('json'),
+            data=kwargs.get('data'), params=kwargs.get('params')
+        ).prepare()
+        return response
+
+
+def start_replay(paths, speed=1.0):
+    """Включение режима воспроизведения из файлов записи"""
+    global _replayer
+    _replayer = Replayer(iter_entries(paths), speed)
+    return _replayer
+
+
+def stop_replay():
+    global _replayer
+    _replayer = None
+
+
+def replaying():
+    return _replayer is not None
+
+
+def replay_response(provider, method, url, kwargs):
+    return _replayer.response(provider, method, url, kwargs)
+
+
+def configure():
+    """Включение записи или воспроизведения по переменным окружения"""
+    if REPLAY_FROM:
+        start_replay([p.strip() for p in REPLAY_FROM.split(',') if p.strip()], REPLAY_SPEED)
+    elif RECORD_TRAFFIC:
+        start_recording()
+
+
+def _restore_secrets(value):
+    """Подстановка заглушек вместо замаскированных ключей при воспроизведении"""
+    if isinstance(value, dict):
+        return {k: 'replay' if v == REDACTED else _restore_secrets(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_restore_secrets(v) for v in value]
+    return value
+
+
+def replay_batch(paths, speed):
+    """Повторный прогон записанных вызовов API на записанных ответах"""
+    import app as web_app
+
+    stop_recording()
+    entries = iter_entries(paths)
+    replayer = start_replay(paths, speed)
+    client = web_app.app.test_client()
+    inbound = [e for e in entries if e.get('type') == 'inbound']
+    if not inbound:
+        print('В записи нет входящих вызовов /api/stage* или /api/run-all')
+        return 1
+
+    for entry in inbound:
+        start = time.perf_counter()
+        response = client.post(entry['path'], json=_restore_secrets(entry['payload']))
+        elapsed = time.perf_counter() - start
+        body = response.get_json(silent=True) or {}
+        results = body.get('results') or [
+            r for stage in ('stage1', 'stage2', 'stage3', 'stage4')
+            for r in (body.get(stage) or {}).get('results', [])
+        ]
+        statuses = {}
+        for result in results:
+            statuses[result.get('status')] = statuses.get(result.get('status'), 0) + 1
+        print(json.dumps({
+            'path': entry['path'],
+            'http_status': response.status_code,
+            'job_id': body.get('job_id'),
+            'elapsed': round(elapsed, 3),
+            'statuses': statuses,
+        }, ensure_ascii=False))
+    print(json.dumps({'unmatched_requests': replayer.misses}))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Воспроизведение записанного трафика')
+    sub = parser.add_subparsers(dest='command', required=True)
+    replay = sub.add_parser('replay', help='прогнать записанные вызовы API на записанных ответах')
+    replay.add_argument('paths', nargs='+', help='файлы записи (traffic.jsonl*)')
+    replay.add_argument('--speed', type=float, default=1.0,
+                        help='ускорение относительно записанных задержек (0 - без задержек)')
+    args = parser.parse_args(argv)
+    return replay_batch(args.paths, args.speed)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
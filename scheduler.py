@@ -0,0 +1,223 @@
+"""
+Справедливое распределение API между одновременными заданиями
+
+Два уровня, оба с взвешенной справедливой очередью (WFQ, self-clocked):
+
+- слоты обработки доменов: не больше TASK_SLOTS доменов всех заданий
+  обрабатываются одновременно; при конкуренции следующий слот получает
+  задание с наименьшим виртуальным временем завершения
+- бюджеты запросов: общий token bucket на (провайдер, аккаунт) с ёмкостью и
+  скоростью пополнения по лимиту провайдера; когда токенов нет, следующий
+  токен получает запрос с наименьшим виртуальным временем
+
+При SHARDING_ENABLED запрос, получивший локальный токен, берёт ещё токен
+из общего для всех узлов бюджета аккаунта (sharding.py), так что лимит
+провайдера соблюдается, сколько бы узлов ни работало.
+
+Вес задания задаётся приоритетом (urgent/high/normal/bulk): задание из
+5 доменов с приоритетом urgent получает токены в 64 раза чаще, чем импорт
+на 10 000 доменов с приоритетом bulk, и не ждёт, пока тот закончится.
+"""
+
+import abc
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+import deadlines
+import jobs
+import metrics
+import sharding
+from config import TASK_SLOTS, REGISTRAR_HOURLY_LIMIT, CLOUDFLARE_RATE_LIMIT, SHARDING_ENABLED
+
+# Приоритет задания -> вес в очереди
+PRIORITY_WEIGHTS = {
+    'urgent': 16.0,
+    'high': 4.0,
+    'normal': 1.0,
+    'bulk': 0.25,
+}
+DEFAULT_PRIORITY = 'normal'
+
+# Запросы вне заданий (фоновая проверка дрейфа)
+BACKGROUND_FLOW = ('background', PRIORITY_WEIGHTS['bulk'])
+
+# Ёмкость и скорость пополнения (токенов в секунду) бюджетов запросов
+RATE_BUDGETS = {
+    'ukraine': (REGISTRAR_HOURLY_LIMIT, REGISTRAR_HOURLY_LIMIT / 3600.0),
+    'cloudflare': (CLOUDFLARE_RATE_LIMIT, CLOUDFLARE_RATE_LIMIT / 300.0),
+}
+
+
+def priority_weight(priority):
+    return PRIORITY_WEIGHTS.get(priority or DEFAULT_PRIORITY, PRIORITY_WEIGHTS[DEFAULT_PRIORITY])
+
+
+def _current_flow():
+    job = jobs.current_job()
+    if job is None:
+        return BACKGROUND_FLOW
+    return job.id, priority_weight(job.priority)
+
+
+class _FairQueue:
+    """Очередь ожидающих с метками виртуального времени завершения"""
+
+    def __init__(self):
+        self._heap = []
+        self._virtual = 0.0
+        self._last_finish = {}
+        self._seq = itertools.count()
+        self._cancelled = set()
+
+    def enqueue(self, flow, weight):
+        start = max(self._virtual, self._last_finish.get(flow, 0.0))
+        finish = start + 1.0 / weight
+        self._last_finish[flow] = finish
+        ticket = (finish, next(self._seq))
+        heapq.heappush(self._heap, ticket)
+        return ticket
+
+    def head(self):
+        while self._heap and self._heap[0] in self._cancelled:
+            self._cancelled.discard(heapq.heappop(self._heap))
+        return self._heap[0] if self._heap else None
+
+    def grant(self, ticket):
+        heapq.heappop(self._heap)
+        self._virtual = ticket[0]
+        if not self._heap:
+            # Очередь пуста - старые метки потоков больше не нужны
+            self._last_finish.clear()
+
+    def cancel(self, ticket):
+        self._cancelled.add(ticket)
+
+    def __len__(self):
+        return len(self._heap) - len(self._cancelled)
+
+
+class _Gate(abc.ABC):
+    """Общая часть: ожидание своей очереди под условной переменной"""
+
+    def __init__(self, name):
+        self.name = name
+        self._queue = _FairQueue()
+        self._cond = threading.Condition()
+
+    @abc.abstractmethod
+    def _ready(self, now):
+        """Можно ли выдать ресурс сейчас; иначе - через сколько секунд проверить снова (None - ждать сигнала)"""
+
+    @abc.abstractmethod
+    def _take(self):
+        """Выдача ресурса очереди (под условной переменной)"""
+
+    def acquire(self, flow, weight):
+        start = time.monotonic()
+        with self._cond:
+            ticket = self._queue.enqueue(flow, weight)
+            metrics.set_gauge('dns_scheduler_queue_depth', {'queue': self.name}, len(self._queue))
+            try:
+                while True:
+                    wait = None
+                    if self._queue.head() == ticket:
+                        ready, wait = self._ready(time.monotonic())
+                        if ready:
+                            self._queue.grant(ticket)
+                            self._take()
+                            self._cond.notify_all()
+                            break
+                    left = deadlines.remaining()
+                    if left is not None:
+                        if left <= 0:
+                            self._queue.cancel(ticket)
+                            self._cond.notify_all()
+                            deadlines.check('ожидание очереди')
+                        wait = left if wait is None else min(wait, left)
+                    self._cond.wait(wait)
+            finally:
+                metrics.set_gauge('dns_scheduler_queue_depth', {'queue': self.name}, len(self._queue))
+        metrics.observe('dns_scheduler_wait_seconds', {'queue': self.name}, time.monotonic() - start)
+
+
+class FairSlots(_Gate):
+    """Ограничение числа одновременно обрабатываемых доменов"""
+
+    def __init__(self, name, capacity):
+        super().__init__(name)
+        self.capacity = capacity
+        self.in_use = 0
+
+    def _ready(self, now):
+        return self.in_use < self.capacity, None
+
+    def _take(self):
+        self.in_use += 1
+
+    def release(self):
+        with self._cond:
+            self.in_use -= 1
+            self._cond.notify_all()
+
+
+class FairTokenBucket(_Gate):
+    """Общий бюджет запросов аккаунта: token bucket с очередью WFQ"""
+
+    def __init__(self, name, capacity, rate):
+        super().__init__(name)
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self.tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def _ready(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self.tokens >= 1:
+            return True, None
+        return False, (1 - self.tokens) / self.rate if self.rate > 0 else None
+
+    def _take(self):
+        self.tokens -= 1
+
+
+_task_slots = FairSlots('tasks', TASK_SLOTS)
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def _bucket(provider, account):
+    key = (provider, account)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.get(key)
+            if bucket is None:
+                capacity, rate = RATE_BUDGETS[provider]
+                bucket = _buckets[key] = FairTokenBucket(provider, capacity, rate)
+    return bucket
+
+
+@contextmanager
+def task_slot():
+    """Слот обработки одного домена для текущего задания"""
+    flow, weight = _current_flow()
+    _task_slots.acquire(flow, weight)
+    try:
+        yield
+    finally:
+        _task_slots.release()
+
+
+def acquire_request(provider, account):
+    """Токен на исходящий запрос из общего бюджета аккаунта провайдера"""
+    if provider not in RATE_BUDGETS:
+        return
+    flow, weight = _current_flow()
+    _bucket(provider, account).acquire(flow, weight)
+    if SHARDING_ENABLED:
+        capacity, rate = RATE_BUDGETS[provider]
+        sharding.acquire_global_token(provider, account, capacity, rate)
@@ -0,0 +1,497 @@
+"""
+Распределение доменов задания между узлами через общее хранилище
+
+При SHARDING_ENABLED=1 импорт из файла не обрабатывается целиком узлом,
+получившим запрос. Узел-координатор режет файл на задачи по
+SHARD_TASK_SIZE доменов и кладёт их в общее хранилище. Рабочие потоки всех
+узлов (включая координатора) забирают задачи в аренду:
+
+- задача захватывается с арендой на SHARD_LEASE_SECONDS, пока она
+  выполняется, владелец продлевает аренду (heartbeat) каждую треть срока;
+- аренда упавшего узла истекает, и задачу забирает другой узел; после
+  SHARD_MAX_ATTEMPTS истёкших аренд задача считается неудачной;
+- результат принимается только от текущего владельца аренды, так что
+  опоздавший узел не перезапишет результат нового владельца. Этапы
+  идемпотентны (сверка записей), поэтому повтор задачи безопасен.
+
+Координатор собирает результаты из хранилища в своё задание, статус
+задания можно получить и с любого другого узла. Пауза и отмена задания
+записываются в хранилище (pause_job/cancel_job): узлы не берут задачи
+приостановленного задания, а ещё не начатые задачи отменённого помечаются
+cancelled; задачи, уже взятые в работу, доделываются.
+
+Ключей API в хранилище нет: задача несёт имя аккаунта и отпечаток его
+ключей, каждый узел берёт ключи из своих настроек (см. app.shard_accounts).
+Завершённые задания удаляются из хранилища через SHARD_RETENTION секунд
+(purge).
+
+Лимиты API общие для всех узлов: перед каждым запросом берётся токен из
+общего token bucket аккаунта в том же хранилище (см. scheduler.py).
+
+Хранилище выбирается по SHARD_STORE: sqlite:///путь (по умолчанию, для
+узлов на одной машине или общем диске) или схема, зарегистрированная через
+register_backend().
+"""
+
+import abc
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import deadlines
+import metrics
+from config import (
+    SHARD_STORE, SHARD_LEASE_SECONDS, SHARD_MAX_ATTEMPTS, SHARD_WORKER_TASKS
+)
+
+# Идентификатор узла (процесса): хост, pid и случайный суффикс
+NODE_ID = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+
+# Пауза между опросами хранилища, когда задач нет (сек)
+POLL_INTERVAL = 1.0
+
+
+# Состояния задач, после которых задача больше не выполняется
+FINISHED_TASK_STATES = ('done', 'failed', 'cancelled')
+
+
+class WorkStore(abc.ABC):
+    """Интерфейс общего хранилища задач, результатов и бюджетов запросов"""
+
+    @abc.abstractmethod
+    def create_job(self, job_id, kind, deadline_at=None):
+        """Регистрация распределённого задания (deadline_at - unix time или None)"""
+
+    @abc.abstractmethod
+    def add_task(self, job_id, payload):
+        """Добавление задачи (payload - JSON-сериализуемый словарь без секретов)"""
+
+    @abc.abstractmethod
+    def seal(self, job_id):
+        """Все задачи задания добавлены"""
+
+    @abc.abstractmethod
+    def claim(self, node, limit, lease_seconds):
+        """
+        Аренда до limit свободных или просроченных задач выполняющихся заданий
+        (не приостановленных и не отменённых):
+        [{'id', 'job_id', 'payload', 'attempts', 'deadline_at'}]
+        """
+
+    @abc.abstractmethod
+    def renew(self, node, task_ids, lease_seconds):
+        """Продление аренды; возвращает множество задач, всё ещё принадлежащих узлу"""
+
+    @abc.abstractmethod
+    def complete(self, node, task_id, results):
+        """Сохранение результатов [(этап, результат)]; False, если аренда уже потеряна"""
+
+    @abc.abstractmethod
+    def fail(self, node, task_id, error):
+        """Задача не выполнена (только текущим владельцем аренды)"""
+
+    @abc.abstractmethod
+    def cancel_job(self, job_id):
+        """Отмена задания: ещё не начатые задачи - cancelled; состояние или None, если задания нет"""
+
+    @abc.abstractmethod
+    def pause_job(self, job_id, paused):
+        """Пауза (paused=True) или продолжение задания; состояние или None, если задания нет"""
+
+    @abc.abstractmethod
+    def job_status(self, job_id):
+        """Счётчики задач и состояние управления задания (None, если задания нет)"""
+
+    @abc.abstractmethod
+    def results(self, job_id, after=0, limit=1000, offset=0):
+        """Результаты задания после курсора: [(курсор, этап, результат)]"""
+
+    @abc.abstractmethod
+    def failed_tasks(self, job_id):
+        """Неудачные задачи задания: [(id, payload, ошибка)]"""
+
+    @abc.abstractmethod
+    def purge(self, before):
+        """
+        Удаление заданий, созданных до before (unix time), без ожидающих и
+        выполняющихся задач; возвращает число удалённых заданий
+        """
+
+    @abc.abstractmethod
+    def take_token(self, key, capacity, rate):
+        """Токен из общего token bucket: 0 - получен, иначе через сколько секунд повторить"""
+
+
+_SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS shard_jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    deadline_at REAL,
+    sealed INTEGER NOT NULL DEFAULT 0,
+    control TEXT NOT NULL DEFAULT 'running'
+);
+CREATE TABLE IF NOT EXISTS shard_tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_until REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS shard_tasks_state ON shard_tasks(state, lease_until);
+CREATE INDEX IF NOT EXISTS shard_tasks_job ON shard_tasks(job_id, state);
+CREATE TABLE IF NOT EXISTS shard_results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    task_id INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    result TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shard_results_job ON shard_results(job_id, id);
+CREATE INDEX IF NOT EXISTS shard_jobs_created ON shard_jobs(created_at);
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+'''
+
+
+class SqliteWorkStore(WorkStore):
+    """Хранилище в файле SQLite (WAL, транзакции BEGIN IMMEDIATE)"""
+
+    def __init__(self, path):
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SQLITE_SCHEMA)
+            # Хранилище, созданное до паузы и отмены заданий
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(shard_jobs)')}
+            if 'control' not in columns:
+                conn.execute("ALTER TABLE shard_jobs ADD COLUMN control TEXT NOT NULL DEFAULT 'running'")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _write(self, fn):
+        """fn(conn) в транзакции с блокировкой на запись"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = fn(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+        finally:
+            conn.close()
+
+    def _read(self, sql, params=()):
+        conn = self._connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def create_job(self, job_id, kind, deadline_at=None):
+        self._write(lambda conn: conn.execute(
+            'INSERT OR IGNORE INTO shard_jobs (job_id, kind, created_at, deadline_at) VALUES (?, ?, ?, ?)',
+            (job_id, kind, time.time(), deadline_at)
+        ))
+
+    def add_task(self, job_id, payload):
+        return self._write(lambda conn: conn.execute(
+            'INSERT INTO shard_tasks (job_id, payload) VALUES (?, ?)', (job_id, json.dumps(payload))
+        ).lastrowid)
+
+    def seal(self, job_id):
+        self._write(lambda conn: conn.execute('UPDATE shard_jobs SET sealed = 1 WHERE job_id = ?', (job_id,)))
+
+    def claim(self, node, limit, lease_seconds):
+        def claim_tasks(conn):
+            now = time.time()
+            rows = conn.execute(
+                '''SELECT t.id, t.job_id, t.payload, t.attempts, t.state, j.deadline_at
+                   FROM shard_tasks t JOIN shard_jobs j ON j.job_id = t.job_id
+                   WHERE j.control = 'running'
+                     AND (t.state = 'pending' OR (t.state = 'claimed' AND t.lease_until < ?))
+                   ORDER BY t.id LIMIT ?''',
+                (now, limit)
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                if row['state'] == 'claimed' and row['attempts'] >= SHARD_MAX_ATTEMPTS:
+                    # Аренда истекала слишком часто - узлы падают на этой задаче
+                    conn.execute(
+                        "UPDATE shard_tasks SET state = 'failed', owner = NULL, error = ? WHERE id = ?",
+                        (f'Аренда истекла {row["attempts"]} раз, задача не выполнена', row['id'])
+                    )
+                    continue
+                if row['state'] == 'claimed':
+                    metrics.inc('dns_shard_leases_reclaimed_total', {})
+                conn.execute(
+                    '''UPDATE shard_tasks SET state = 'claimed', owner = ?, lease_until = ?,
+                           attempts = attempts + 1 WHERE id = ?''',
+                    (node, now + lease_seconds, row['id'])
+                )
+                claimed.append({
+                    'id': row['id'],
+                    'job_id': row['job_id'],
+                    'payload': json.loads(row['payload']),
+                    'attempts': row['attempts'] + 1,
+                    'deadline_at': row['deadline_at'],
+                })
+            return claimed
+        return self._write(claim_tasks)
+
+    def renew(self, node, task_ids, lease_seconds):
+        if not task_ids:
+            return set()
+
+        def renew_leases(conn):
+            owned = set()
+            lease_until = time.time() + lease_seconds
+            for task_id in task_ids:
+                if conn.execute(
+                    "UPDATE shard_tasks SET lease_until = ? WHERE id = ? AND owner = ? AND state = 'claimed'",
+                    (lease_until, task_id, node)
+                ).rowcount:
+                    owned.add(task_id)
+            return owned
+        return self._write(renew_leases)
+
+    def complete(self, node, task_id, results):
+        def save(conn):
+            # Строки задачи после выполнения не нужны: результаты хранятся отдельно
+            updated = conn.execute(
+                """UPDATE shard_tasks SET state = 'done', owner = NULL, payload = '{}'
+                   WHERE id = ? AND owner = ? AND state = 'claimed'""",
+                (task_id, node)
+            ).rowcount
+            if not updated:
+                return False
+            job_id = conn.execute('SELECT job_id FROM shard_tasks WHERE id = ?', (task_id,)).fetchone()['job_id']
+            conn.executemany(
+                'INSERT INTO shard_results (job_id, task_id, stage, result) VALUES (?, ?, ?, ?)',
+                [(job_id, task_id, stage, json.dumps(result, ensure_ascii=False)) for stage, result in results]
+            )
+            return True
+        return self._write(save)
+
+    def fail(self, node, task_id, error):
+        self._write(lambda conn: conn.execute(
+            "UPDATE shard_tasks SET state = 'failed', owner = NULL, error = ? WHERE id = ? AND owner = ?",
+            (str(error), task_id, node)
+        ))
+
+    def cancel_job(self, job_id):
+        def cancel(conn):
+            if not conn.execute("UPDATE shard_jobs SET control = 'cancelling' WHERE job_id = ?", (job_id,)).rowcount:
+                return None
+            conn.execute(
+                "UPDATE shard_tasks SET state = 'cancelled' WHERE job_id = ? AND state = 'pending'", (job_id,)
+            )
+            return 'cancelling'
+        return self._write(cancel)
+
+    def pause_job(self, job_id, paused):
+        def pause(conn):
+            # Отменённое задание не продолжается
+            conn.execute(
+                "UPDATE shard_jobs SET control = ? WHERE job_id = ? AND control != 'cancelling'",
+                ('paused' if paused else 'running', job_id)
+            )
+            row = conn.execute('SELECT control FROM shard_jobs WHERE job_id = ?', (job_id,)).fetchone()
+            return row['control'] if row else None
+        return self._write(pause)
+
+    def job_status(self, job_id):
+        job = self._read('SELECT * FROM shard_jobs WHERE job_id = ?', (job_id,))
+        if not job:
+            return None
+        counts = {state: count for state, count in self._read(
+            'SELECT state, COUNT(*) FROM shard_tasks WHERE job_id = ? GROUP BY state', (job_id,))}
+        results_total = self._read('SELECT COUNT(*) FROM shard_results WHERE job_id = ?', (job_id,))[0][0]
+        return {
+            'job_id': job_id,
+            'kind': job[0]['kind'],
+            'created_at': job[0]['created_at'],
+            'sealed': bool(job[0]['sealed']),
+            'control': job[0]['control'],
+            'tasks': {state: counts.get(state, 0) for state in ('pending', 'claimed') + FINISHED_TASK_STATES},
+            'results_total': results_total,
+        }
+
+    def results(self, job_id, after=0, limit=1000, offset=0):
+        return [
+            (row['id'], row['stage'], json.loads(row['result']))
+            for row in self._read(
+                'SELECT id, stage, result FROM shard_results WHERE job_id = ? AND id > ? ORDER BY id LIMIT ? OFFSET ?',
+                (job_id, after, limit, offset)
+            )
+        ]
+
+    def failed_tasks(self, job_id):
+        return [
+            (row['id'], json.loads(row['payload']), row['error'])
+            for row in self._read(
+                "SELECT id, payload, error FROM shard_tasks WHERE job_id = ? AND state = 'failed' ORDER BY id",
+                (job_id,)
+            )
+        ]
+
+    def purge(self, before):
+        def delete_finished(conn):
+            # Просроченная аренда отменённого задания никем не будет подхвачена
+            finished = [row['job_id'] for row in conn.execute(
+                """SELECT job_id FROM shard_jobs j WHERE created_at < ? AND NOT EXISTS (
+                       SELECT 1 FROM shard_tasks t WHERE t.job_id = j.job_id
+                         AND (t.state = 'pending' OR (t.state = 'claimed' AND t.lease_until >= ?)))""",
+                (before, time.time())
+            )]
+            for job_id in finished:
+                conn.execute('DELETE FROM shard_results WHERE job_id = ?', (job_id,))
+                conn.execute('DELETE FROM shard_tasks WHERE job_id = ?', (job_id,))
+                conn.execute('DELETE FROM shard_jobs WHERE job_id = ?', (job_id,))
+            return len(finished)
+        return self._write(delete_finished)
+
+    def take_token(self, key, capacity, rate):
+        def take(conn):
+            now = time.time()
+            row = conn.execute('SELECT tokens, updated FROM rate_buckets WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row['tokens'] + (now - row['updated']) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate if rate > 0 else POLL_INTERVAL
+            conn.execute('INSERT OR REPLACE INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            return wait
+        return self._write(take)
+
+
+_backends = {
+    'sqlite': lambda location: SqliteWorkStore(location),
+}
+_store = None
+_store_lock = threading.Lock()
+
+
+def register_backend(scheme, factory):
+    """Подключение другого хранилища: factory(строка после 'схема://') -> WorkStore"""
+    _backends[scheme] = factory
+
+
+def get_store():
+    """Хранилище по SHARD_STORE (создаётся один раз на процесс)"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                scheme, _, location = SHARD_STORE.partition('://')
+                if scheme not in _backends:
+                    raise ValueError(f'Неизвестное хранилище SHARD_STORE: {scheme}')
+                _store = _backends[scheme](location)
+    return _store
+
+
+def acquire_global_token(provider, account, capacity, rate):
+    """
+    Ожидание токена общего для всех узлов бюджета аккаунта
+
+    Raises:
+        DeadlineExceeded: токен появится позже дедлайна
+    """
+    key = f'{provider}:{account}'
+    while True:
+        wait = get_store().take_token(key, capacity, rate)
+        if not wait:
+            return
+        left = deadlines.remaining()
+        if left is not None and wait > left:
+            raise deadlines.DeadlineExceeded(
+                f'Общий лимит запросов к {provider} исчерпан, токен появится через {int(wait) + 1} с'
+            )
+        time.sleep(wait)
+
+
+class ShardWorker(threading.Thread):
+    """
+    Рабочий поток узла: аренда задач, выполнение, heartbeat
+
+    execute(task) -> [(этап, результат)] выполняет задачу (см. app.run_shard_task).
+    """
+
+    def __init__(self, execute, slots=SHARD_WORKER_TASKS, lease_seconds=SHARD_LEASE_SECONDS):
+        super().__init__(name='shard-worker', daemon=True)
+        self.execute = execute
+        self.slots = slots
+        self.lease_seconds = lease_seconds
+        self.stop_event = threading.Event()
+        self._active = {}
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run_task(self, task):
+        store = get_store()
+        try:
+            results = self.execute(task)
+        except Exception as e:
+            store.fail(NODE_ID, task['id'], e)
+            metrics.inc('dns_shard_tasks_total', {'result': 'failed'})
+            return
+        if store.complete(NODE_ID, task['id'], results):
+            metrics.inc('dns_shard_tasks_total', {'result': 'done'})
+        else:
+            # Аренду забрал другой узел - его результат и будет принят
+            metrics.inc('dns_shard_tasks_total', {'result': 'lease_lost'})
+
+    def run(self):
+        store = get_store()
+        renewed_at = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.slots, thread_name_prefix='shard') as pool:
+            while not self.stop_event.is_set():
+                self._active = {task_id: f for task_id, f in self._active.items() if not f.done()}
+                claimed = []
+                try:
+                    free = self.slots - len(self._active)
+                    if free > 0:
+                        claimed = store.claim(NODE_ID, free, self.lease_seconds)
+                        for task in claimed:
+                            self._active[task['id']] = pool.submit(self._run_task, task)
+                    if time.monotonic() - renewed_at >= self.lease_seconds / 3:
+                        renewed_at = time.monotonic()
+                        store.renew(NODE_ID, list(self._active), self.lease_seconds)
+                except Exception as e:
+                    print(f"Ошибка рабочего потока распределённых задач: {e}")
+                self.stop_event.wait(0.05 if claimed else min(POLL_INTERVAL, self.lease_seconds / 3))
+
+
+_worker = None
+
+
+def start(execute):
+    """Запуск рабочего потока узла (один на процесс)"""
+    global _worker
+    if _worker is None:
+        _worker = ShardWorker(execute)
+        _worker.start()
+    return _worker
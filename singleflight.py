@@ -0,0 +1,75 @@
+"""
+Объединение одинаковых одновременных запросов (single-flight)
+
+Если несколько потоков одновременно запрашивают одно и то же (например
+GET /zones?name= одного домена или список записей регистратора), запрос
+выполняет только первый поток (лидер), остальные ждут и получают его
+результат или исключение. Завершённые вызовы не кэшируются - это не кэш,
+а только склейка запросов, которые уже летят.
+"""
+
+import threading
+
+import deadlines
+import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.shared = 0
+
+
+class Group:
+    """Группа вызовов, объединяемых по ключу"""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Выполнение fn() или ожидание уже идущего вызова с тем же ключом
+
+        Returns:
+            (результат, shared) - shared=True, если результат получен от
+            чужого вызова
+
+        Raises:
+            исключение лидера; DeadlineExceeded, если дедлайн ожидающего
+            истёк раньше, чем лидер закончил
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                else:
+                    call.shared += 1
+
+            if leader:
+                try:
+                    call.result = fn()
+                    return call.result, False
+                except BaseException as e:
+                    call.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._calls[key]
+                    call.event.set()
+
+            timeout = deadlines.remaining()
+            if not call.event.wait(None if timeout is None else max(0.0, timeout)):
+                deadlines.check()
+            if isinstance(call.error, deadlines.DeadlineExceeded):
+                # У лидера кончилось его собственное время - пробуем сами
+                continue
+            metrics.inc('dns_singleflight_shared_total', {'group': self.name})
+            if call.error is not None:
+                raise call.error
+            return call.result, True
@@ -0,0 +1,153 @@
+"""
+Снимки DNS записей регистратора и откат из них
+
+Перед изменением записей (этап 1 удаляет всё, что не входит в шаблон)
+текущие записи доменов пакета читаются параллельно и сохраняются в
+хранилище с адресацией по содержимому:
+
+    SNAPSHOTS_DIR/objects/ab/abcdef...json.gz  - набор записей домена
+    SNAPSHOTS_DIR/manifests/<id>.json          - снимок: домен -> хеш набора
+
+Имена записей хранятся относительно домена ('@', 'www'), поэтому
+одинаковые зоны разных доменов занимают один объект.
+
+Откат приводит записи домена к набору из снимка через сверку
+(ukraine_reconcile_dns_records): совпадающие записи не трогаются.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+import uuid
+
+import outcomes
+import quota
+from circuit_breaker import CircuitOpenError
+from config import SNAPSHOTS_DIR
+from deadlines import DeadlineExceeded
+from ukraine_registrar import (
+    ukraine_get_dns_records,
+    ukraine_reconcile_dns_records,
+    extract_dns_records,
+    normalize_dns_record
+)
+
+
+class SnapshotNotFound(Exception):
+    """Снимок или его объект не найден"""
+
+
+def _objects_dir():
+    return os.path.join(SNAPSHOTS_DIR, 'objects')
+
+
+def _manifests_dir():
+    return os.path.join(SNAPSHOTS_DIR, 'manifests')
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def canonical_records(records):
+    """Набор записей в каноническом порядке (для одинакового хеша одинаковых зон)"""
+    return sorted(
+        ({k: r[k] for k in ('type', 'name', 'content', 'ttl', 'priority')} for r in records),
+        key=lambda r: (r['type'], r['name'], r['content'], r['priority'], r['ttl'])
+    )
+
+
+def put_records(records):
+    """Сохранение набора записей; возвращает sha256 содержимого"""
+    payload = json.dumps(canonical_records(records), ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    digest = hashlib.sha256(payload).hexdigest()
+    path = os.path.join(_objects_dir(), digest[:2], f'{digest}.json.gz')
+    if not os.path.exists(path):
+        _write_atomic(path, gzip.compress(payload, mtime=0))
+    return digest
+
+
+def get_records(digest):
+    path = os.path.join(_objects_dir(), digest[:2], f'{digest}.json.gz')
+    try:
+        with open(path, 'rb') as f:
+            return json.loads(gzip.decompress(f.read()).decode('utf-8'))
+    except FileNotFoundError:
+        raise SnapshotNotFound(f'Объект снимка не найден: {digest}')
+    except (OSError, EOFError, ValueError) as e:
+        # Обрезанный или испорченный объект - для отката это тот же отсутствующий снимок
+        raise SnapshotNotFound(f'Объект снимка повреждён: {digest} ({e})')
+
+
+def snapshot_domain(domain, api_keys):
+    """
+    Снимок записей одного домена (чтение в обход кэша, в пределах лимита API)
+
+    Returns:
+        результат домена с полем hash
+    """
+    try:
+        quota.throttle('ukraine', quota.accounts_for(api_keys)['ukraine'])
+        records = extract_dns_records(ukraine_get_dns_records(domain, api_keys, fresh=True))
+        normalized = [r for r in (normalize_dns_record(raw, domain) for raw in records) if r and r['type']]
+        digest = put_records(normalized)
+        return outcomes.success(domain, 'snapshot_saved', len(normalized), hash=digest, records=len(normalized))
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        return outcomes.error(domain, 'snapshot_failed', e)
+
+
+def save_manifest(job, api_keys, results):
+    """Сохранение снимка пакета по результатам snapshot_domain"""
+    manifest = {
+        'id': time.strftime('%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:6],
+        'created_at': time.time(),
+        'job_id': job.id if job else None,
+        'account': quota.accounts_for(api_keys)['ukraine'],
+        'domains': {r.domain: r.get('hash') for r in results if r.get('hash')},
+        'failed': [r.domain for r in results if not r.get('hash')],
+    }
+    data = json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+    _write_atomic(os.path.join(_manifests_dir(), f"{manifest['id']}.json"), data)
+    return manifest
+
+
+def load_manifest(snapshot_id):
+    if not snapshot_id or os.path.basename(snapshot_id) != snapshot_id:
+        raise SnapshotNotFound(f'Снимок не найден: {snapshot_id}')
+    try:
+        with open(os.path.join(_manifests_dir(), f'{snapshot_id}.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise SnapshotNotFound(f'Снимок не найден: {snapshot_id}')
+
+
+def snapshot_records(manifest, domain):
+    """Набор записей домена из снимка (None, если домена в снимке нет)"""
+    digest = manifest['domains'].get(domain)
+    if not digest:
+        return None
+    return get_records(digest)
+
+
+def rollback_domain(domain, manifest, api_keys):
+    """Откат записей домена к снимку с минимумом запросов"""
+    try:
+        records = snapshot_records(manifest, domain)
+        if records is None:
+            return outcomes.error(domain, 'rollback_not_in_snapshot')
+        quota.throttle('ukraine', quota.accounts_for(api_keys)['ukraine'])
+        changes = ukraine_reconcile_dns_records(domain, records, api_keys, fresh=True)
+        return outcomes.success(domain, 'rollback_done', changes=changes)
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        return outcomes.error(domain, 'rollback_failed', e)
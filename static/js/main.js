@@ -141,12 +141,29 @@ document.addEventListener('DOMContentLoaded', function() {
     loadApiSettings();
 });
 
+// Строки вида "example.com" или "example.com 1.2.3.4" (свой IP для домена)
+function parseDomainLines() {
+    const domains = [];
+    const targets = {};
+    document.getElementById('domains').value.split('\n').forEach(line => {
+        const parts = line.trim().split(/[\s,;]+/).filter(p => p);
+        if (!parts.length) {
+            return;
+        }
+        domains.push(parts[0]);
+        if (parts[1]) {
+            targets[parts[0]] = parts[1];
+        }
+    });
+    return { domains, targets };
+}
+
 async function runStage(stageNumber) {
     if (!checkApiKeys()) {
         return;
     }
     
-    const domains = document.getElementById('domains').value.trim().split('\n').filter(d => d.trim());
+    const { domains, targets } = parseDomainLines();
     const ipAddress = document.getElementById('ip_address').value.trim();
     
     if (!domains.length) {
@@ -154,16 +171,15 @@ async function runStage(stageNumber) {
         return;
     }
     
-    if (stageNumber === 1 && !ipAddress) {
+    if (stageNumber === 1 && !ipAddress && !Object.keys(targets).length) {
         showError('Пожалуйста, введите IP адрес');
         return;
     }
     
-    const resultsDiv = document.getElementById('results');
-    resultsDiv.innerHTML = '<div class="loading">Выполняется этап ' + stageNumber + '...</div>';
+    const stage = `stage${stageNumber}`;
+    const view = new ResultsView(document.getElementById('results'), `Этап ${stageNumber}`, domains, [stage]);
     
     try {
-        let url = `/api/stage${stageNumber}`;
         let data = { 
             domains: domains,
             api_keys: getApiKeys()
@@ -171,24 +187,10 @@ async function runStage(stageNumber) {
         
         if (stageNumber === 1) {
             data.ip_address = ipAddress;
+            data.targets = targets;
         }
         
-        const response = await fetch(url, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify(data)
-        });
-        
-        const result = await response.json();
-        
-        if (result.error) {
-            showError(result.error);
-            return;
-        }
-        
-        displayResults(`Этап ${stageNumber}`, result.results || result);
+        await streamResults(`/api/${stage}`, data, view);
         
     } catch (error) {
         showError('Ошибка: ' + error.message);
@@ -200,7 +202,7 @@ async function runAllStages() {
         return;
     }
     
-    const domains = document.getElementById('domains').value.trim().split('\n').filter(d => d.trim());
+    const { domains, targets } = parseDomainLines();
     const ipAddress = document.getElementById('ip_address').value.trim();
     
     if (!domains.length) {
@@ -208,99 +210,27 @@ async function runAllStages() {
         return;
     }
     
-    if (!ipAddress) {
+    if (!ipAddress && !Object.keys(targets).length) {
         showError('Пожалуйста, введите IP адрес');
         return;
     }
     
-    const resultsDiv = document.getElementById('results');
-    resultsDiv.innerHTML = '<div class="loading">Запуск всех этапов...</div>';
+    const view = new ResultsView(document.getElementById('results'), 'Результаты всех этапов', domains,
+                                 ['stage1', 'stage2', 'stage3', 'stage4']);
     
     try {
-        const response = await fetch('/api/run-all', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                domains: domains,
-                ip_address: ipAddress,
-                api_keys: getApiKeys()
-            })
-        });
-        
-        const result = await response.json();
-        
-        if (result.error) {
-            showError(result.error);
-            return;
-        }
-        
-        let html = '<h2>Результаты всех этапов</h2>';
-        
-        if (result.stage1) {
-            html += '<div class="stage-result">';
-            html += '<h3>Этап 1: Обновление A записей</h3>';
-            html += displayResultsHTML(result.stage1.results || result.stage1);
-            html += '</div>';
-        }
-        
-        if (result.stage2) {
-            html += '<div class="stage-result">';
-            html += '<h3>Этап 2: Добавление в Cloudflare</h3>';
-            html += displayResultsHTML(result.stage2.results || result.stage2);
-            html += '</div>';
-        }
-        
-        if (result.stage3) {
-            html += '<div class="stage-result">';
-            html += '<h3>Этап 3: Обновление NS записей</h3>';
-            html += displayResultsHTML(result.stage3.results || result.stage3);
-            html += '</div>';
-        }
-        
-        if (result.stage4) {
-            html += '<div class="stage-result">';
-            html += '<h3>Этап 4: Настройка TLS/HTTPS</h3>';
-            html += displayResultsHTML(result.stage4.results || result.stage4);
-            html += '</div>';
-        }
-        
-        resultsDiv.innerHTML = html;
+        await streamResults('/api/run-all', {
+            domains: domains,
+            ip_address: ipAddress,
+            targets: targets,
+            api_keys: getApiKeys()
+        }, view);
         
     } catch (error) {
         showError('Ошибка: ' + error.message);
     }
 }
 
-function displayResults(title, results) {
-    const resultsDiv = document.getElementById('results');
-    let html = `<div class="stage-result"><h3>${title}</h3>`;
-    html += displayResultsHTML(results);
-    html += '</div>';
-    resultsDiv.innerHTML = html;
-}
-
-function displayResultsHTML(results) {
-    if (!Array.isArray(results)) {
-        return '<div class="error-message">Неверный формат результатов</div>';
-    }
-    
-    let html = '';
-    results.forEach(result => {
-        const statusClass = result.status === 'success' ? 'success' : 'error';
-        html += `<div class="domain-result ${statusClass}">`;
-        html += `<div class="domain-name">${result.domain}</div>`;
-        html += `<div class="message">${result.message}</div>`;
-        if (result.nameservers) {
-            html += `<div class="message">NS: ${result.nameservers.join(', ')}</div>`;
-        }
-        html += '</div>';
-    });
-    
-    return html;
-}
-
 function showError(message) {
     const resultsDiv = document.getElementById('results');
     resultsDiv.innerHTML = `<div class="error-message">${message}</div>`;
@@ -0,0 +1,378 @@
+// Просмотр результатов этапов: потоковое получение (NDJSON), компактный
+// индекс статусов и виртуальный список - в DOM только видимые строки
+
+const STAGE_TITLES = {
+    stage1: 'Этап 1: A записи',
+    stage2: 'Этап 2: Cloudflare',
+    stage3: 'Этап 3: NS записи',
+    stage4: 'Этап 4: TLS/HTTPS'
+};
+
+// Коды статусов в индексе (по байту на домен и этап)
+const STATUS_PENDING = 0;
+const STATUS_SUCCESS = 1;
+const STATUS_ERROR = 2;
+const STATUS_DEFERRED = 3;
+const STATUS_CANCELLED = 4;
+
+const STATUS_LABELS = ['ожидает', 'успех', 'ошибка', 'отложен', 'не выполнен'];
+const STATUS_CLASSES = ['pending', 'success', 'error', 'deferred', 'cancelled'];
+
+// Какой статус этапа определяет статус строки (по убыванию важности)
+const ROW_STATUS_ORDER = [STATUS_ERROR, STATUS_DEFERRED, STATUS_CANCELLED, STATUS_PENDING];
+
+const ROW_HEIGHT = 56;
+const OVERSCAN_ROWS = 10;
+
+function statusCode(status) {
+    switch (status) {
+        case 'success': return STATUS_SUCCESS;
+        case 'deferred': return STATUS_DEFERRED;
+        case 'cancelled':
+        case 'deadline_exceeded': return STATUS_CANCELLED;
+        default: return STATUS_ERROR;
+    }
+}
+
+// Имя домена так, как его вернёт сервер (см. domains.py): нижний регистр,
+// без точки на конце, IDN в punycode, без префикса www.
+function displayDomain(value) {
+    let name = String(value == null ? '' : value).trim().replace(/\.+$/, '').toLowerCase();
+    try {
+        name = new URL(`http://${name}`).hostname;
+    } catch (error) {
+        // Некорректное имя показываем как есть - сервер его отклонит
+    }
+    return name.startsWith('www.') ? name.slice(4) : name;
+}
+
+function escapeHtml(text) {
+    return String(text == null ? '' : text)
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;');
+}
+
+class ResultsView {
+    constructor(container, title, domains, stages) {
+        this.container = container;
+        this.stages = stages;
+        this.domains = [];
+        this.rowByDomain = new Map();
+        // Индекс: по Uint8Array статусов и массиву сообщений на каждый этап
+        this.capacity = Math.max(domains.length, 16);
+        this.statuses = {};
+        this.messages = {};
+        stages.forEach(stage => {
+            this.statuses[stage] = new Uint8Array(this.capacity);
+            this.messages[stage] = [];
+        });
+        this.counts = {};
+        stages.forEach(stage => {
+            this.counts[stage] = new Uint32Array(STATUS_LABELS.length);
+        });
+        this.filterStage = '';
+        this.errorsOnly = false;
+        this.visible = null;
+        this.renderQueued = false;
+        this.filterDirty = true;
+        this.finished = false;
+        this.note = '';
+        // ID задания (заголовок X-Job-Id) и состояние управления
+        this.jobId = null;
+        this.control = 'running';
+
+        domains.forEach(domain => this.addRow(displayDomain(domain)));
+        this.build(title);
+    }
+
+    addRow(domain) {
+        if (this.rowByDomain.has(domain)) {
+            return this.rowByDomain.get(domain);
+        }
+        const row = this.domains.length;
+        if (row >= this.capacity) {
+            this.capacity *= 2;
+            this.stages.forEach(stage => {
+                const grown = new Uint8Array(this.capacity);
+                grown.set(this.statuses[stage]);
+                this.statuses[stage] = grown;
+            });
+        }
+        this.domains.push(domain);
+        this.rowByDomain.set(domain, row);
+        this.stages.forEach(stage => this.counts[stage][STATUS_PENDING]++);
+        return row;
+    }
+
+    build(title) {
+        const stageOptions = this.stages.length > 1
+            ? '<option value="">Все этапы</option>' + this.stages.map(
+                stage => `<option value="${stage}">${STAGE_TITLES[stage] || stage}</option>`).join('')
+            : '';
+        this.container.innerHTML = `
+            <div class="stage-result">
+                <h3>${escapeHtml(title)}</h3>
+                <div class="results-toolbar">
+                    ${stageOptions ? `<select class="results-stage">${stageOptions}</select>` : ''}
+                    <label class="results-errors"><input type="checkbox"> Только ошибки</label>
+                    <span class="results-controls">
+                        <button type="button" class="btn-control" data-action="pause">Пауза</button>
+                        <button type="button" class="btn-control" data-action="resume">Продолжить</button>
+                        <button type="button" class="btn-control btn-cancel" data-action="cancel">Отменить</button>
+                    </span>
+                    <span class="results-summary"></span>
+                </div>
+                <div class="results-viewport">
+                    <div class="results-spacer"><div class="results-rows"></div></div>
+                </div>
+            </div>`;
+        this.viewport = this.container.querySelector('.results-viewport');
+        this.spacer = this.container.querySelector('.results-spacer');
+        this.rowsEl = this.container.querySelector('.results-rows');
+        this.summaryEl = this.container.querySelector('.results-summary');
+
+        const stageSelect = this.container.querySelector('.results-stage');
+        if (stageSelect) {
+            stageSelect.addEventListener('change', () => {
+                this.filterStage = stageSelect.value;
+                this.filterDirty = true;
+                this.scheduleRender();
+            });
+        }
+        this.container.querySelector('.results-errors input').addEventListener('change', event => {
+            this.errorsOnly = event.target.checked;
+            this.filterDirty = true;
+            this.scheduleRender();
+        });
+        this.viewport.addEventListener('scroll', () => this.scheduleRender());
+        this.controlButtons = this.container.querySelectorAll('.btn-control');
+        this.controlButtons.forEach(button => {
+            button.addEventListener('click', () => this.sendControl(button.dataset.action));
+        });
+        this.renderControls();
+        this.scheduleRender();
+    }
+
+    setJob(jobId) {
+        this.jobId = jobId;
+        this.renderControls();
+    }
+
+    // Пауза, продолжение или отмена задания (действует перед следующим доменом)
+    async sendControl(action) {
+        if (!this.jobId || this.finished) {
+            return;
+        }
+        const response = await fetch(`/api/jobs/${this.jobId}/${action}`, { method: 'POST' });
+        const result = await response.json().catch(() => ({}));
+        if (response.ok) {
+            this.control = result.control;
+        }
+        this.renderControls();
+        this.scheduleRender();
+    }
+
+    renderControls() {
+        const active = this.jobId && !this.finished && this.control !== 'cancelling';
+        this.controlButtons.forEach(button => {
+            const action = button.dataset.action;
+            button.hidden = !active
+                || (action === 'pause' && this.control === 'paused')
+                || (action === 'resume' && this.control !== 'paused');
+        });
+    }
+
+    // Результат одного домена на этапе: обновление индекса и видимой строки
+    update(stage, result) {
+        if (!this.statuses[stage]) {
+            return;
+        }
+        const row = this.addRow(result.domain);
+        const previous = this.statuses[stage][row];
+        const code = statusCode(result.status);
+        this.statuses[stage][row] = code;
+        this.counts[stage][previous]--;
+        this.counts[stage][code]++;
+        let message = result.message || '';
+        if (result.nameservers) {
+            message += ` NS: ${result.nameservers.join(', ')}`;
+        }
+        this.messages[stage][row] = message;
+        if (this.errorsOnly) {
+            this.filterDirty = true;
+        }
+        this.scheduleRender();
+    }
+
+    // Строки, отклонённые сервером до запуска этапов (некорректное имя, поддомен)
+    reject(errors) {
+        (errors || []).forEach(error => {
+            this.stages.forEach(stage => this.update(stage, {
+                domain: displayDomain(error.domain),
+                status: 'error',
+                message: error.message
+            }));
+        });
+    }
+
+    finish(note) {
+        this.finished = true;
+        this.note = note || '';
+        this.renderControls();
+        this.scheduleRender();
+    }
+
+    matches(row) {
+        if (!this.errorsOnly) {
+            return true;
+        }
+        const stages = this.filterStage ? [this.filterStage] : this.stages;
+        return stages.some(stage => {
+            const code = this.statuses[stage][row];
+            return code !== STATUS_PENDING && code !== STATUS_SUCCESS;
+        });
+    }
+
+    // Строки, проходящие фильтр (null - все строки)
+    visibleRows() {
+        if (this.filterDirty) {
+            this.filterDirty = false;
+            if (!this.errorsOnly) {
+                this.visible = null;
+            } else {
+                const rows = [];
+                for (let row = 0; row < this.domains.length; row++) {
+                    if (this.matches(row)) {
+                        rows.push(row);
+                    }
+                }
+                this.visible = Int32Array.from(rows);
+            }
+        }
+        return this.visible;
+    }
+
+    scheduleRender() {
+        if (this.renderQueued) {
+            return;
+        }
+        this.renderQueued = true;
+        requestAnimationFrame(() => {
+            this.renderQueued = false;
+            this.render();
+        });
+    }
+
+    renderRow(row) {
+        const stages = this.filterStage ? [this.filterStage] : this.stages;
+        const codes = stages.map(stage => this.statuses[stage][row]);
+        // Статус строки - худший из этапов; сообщение - этапа с этим статусом
+        const found = ROW_STATUS_ORDER.find(code => codes.includes(code));
+        const rowCode = found === undefined ? STATUS_SUCCESS : found;
+        const messageStage = rowCode === STATUS_PENDING || rowCode === STATUS_SUCCESS
+            ? stages.filter((stage, index) => codes[index] !== STATUS_PENDING).pop()
+            : stages[codes.indexOf(rowCode)];
+        const message = messageStage ? this.messages[messageStage][row] : '';
+        const badges = stages.map((stage, index) => {
+            const code = codes[index];
+            const label = stages.length > 1 ? stage.replace('stage', '') : STATUS_LABELS[code];
+            return `<span class="status-badge ${STATUS_CLASSES[code]}" title="${escapeHtml(STAGE_TITLES[stage] || stage)}: ${STATUS_LABELS[code]}">${label}</span>`;
+        }).join('');
+        return `<div class="domain-result ${STATUS_CLASSES[rowCode]}" style="height:${ROW_HEIGHT - 10}px">
+            <div class="domain-name">${escapeHtml(this.domains[row])} ${badges}</div>
+            <div class="message">${escapeHtml(message)}</div>
+        </div>`;
+    }
+
+    render() {
+        const visible = this.visibleRows();
+        const total = visible ? visible.length : this.domains.length;
+        this.spacer.style.height = `${total * ROW_HEIGHT}px`;
+
+        const first = Math.max(0, Math.floor(this.viewport.scrollTop / ROW_HEIGHT) - OVERSCAN_ROWS);
+        const last = Math.min(total, Math.ceil((this.viewport.scrollTop + this.viewport.clientHeight) / ROW_HEIGHT) + OVERSCAN_ROWS);
+        let html = '';
+        for (let index = first; index < last; index++) {
+            html += this.renderRow(visible ? visible[index] : index);
+        }
+        this.rowsEl.style.transform = `translateY(${first * ROW_HEIGHT}px)`;
+        this.rowsEl.innerHTML = html;
+        this.renderSummary(total);
+    }
+
+    renderSummary(shown) {
+        const parts = this.stages.map(stage => {
+            const counts = this.counts[stage];
+            const done = this.domains.length - counts[STATUS_PENDING];
+            const title = this.stages.length > 1 ? `${stage.replace('stage', 'Этап ')}: ` : '';
+            return `${title}${done}/${this.domains.length}, ошибок ${counts[STATUS_ERROR] + counts[STATUS_DEFERRED] + counts[STATUS_CANCELLED]}`;
+        });
+        if (shown !== this.domains.length) {
+            parts.push(`показано ${shown}`);
+        }
+        const running = { paused: 'на паузе', cancelling: 'отменяется...' }[this.control] || 'выполняется...';
+        parts.push(this.finished ? (this.note || 'готово') : running);
+        this.summaryEl.textContent = parts.join(' · ');
+    }
+}
+
+// Запрос этапа с потоковым чтением результатов (NDJSON) в ResultsView
+async function streamResults(url, data, view) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'application/x-ndjson'
+        },
+        body: JSON.stringify(data)
+    });
+
+    if (!response.ok) {
+        const result = await response.json().catch(() => ({}));
+        throw new Error(result.error || `HTTP ${response.status}`);
+    }
+
+    const jobId = response.headers.get('X-Job-Id');
+    if (jobId) {
+        view.setJob(jobId);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let summary = null;
+
+    const handleLine = line => {
+        if (!line.trim()) {
+            return;
+        }
+        const message = JSON.parse(line);
+        if (message.summary) {
+            summary = message.summary;
+        } else {
+            view.update(message.stage, message.result);
+        }
+    };
+
+    for (;;) {
+        const { done, value } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.forEach(handleLine);
+    }
+    handleLine(buffer + decoder.decode());
+
+    if (summary && summary.input) {
+        view.reject(summary.input.errors);
+    }
+
+    const finished = view.control === 'cancelling' ? 'отменено' : 'готово';
+    view.finish(summary ? `${finished}, задание ${summary.job_id}` : 'ответ прерван');
+    return summary;
+}
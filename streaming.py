@@ -0,0 +1,120 @@
+"""
+Потоковая отдача результатов этапов
+
+Ответ этапа описывается обычным словарем, в котором:
+
+- Items(stage, iterable) - массив результатов, элементы кодируются по мере
+  получения из генератора и в памяти не накапливаются;
+- callable - значение вычисляется, когда кодировщик до него дошёл (например
+  отчёт о квоте после того, как все домены обработаны).
+
+Форматы:
+
+- JSON (по умолчанию) - тот же документ, что отдавал jsonify, только
+  собранный по частям;
+- NDJSON (Accept: application/x-ndjson) - строка {"stage": ..., "result": ...}
+  на каждый домен и последняя строка {"summary": {...}} с остальными полями.
+
+При Accept-Encoding: gzip поток сжимается. Части ответа отдаются блоками
+по 16 КБ, но не реже раза в STREAM_FLUSH_SECONDS.
+"""
+
+import json
+import time
+import zlib
+
+import outcomes
+from config import STREAM_FLUSH_SECONDS
+
+# Мелкие части ответа отдаются блоками не меньше этого размера (или по времени)
+CHUNK_SIZE = 16 * 1024
+
+
+class Items:
+    """Массив результатов этапа, кодируемый по мере получения элементов"""
+
+    def __init__(self, stage, iterable):
+        self.stage = stage
+        self.iterable = iterable
+
+
+def _dumps(value):
+    # Результаты доменов (outcomes.DomainResult) - с текстом сообщения
+    return json.dumps(value, ensure_ascii=False, default=outcomes.to_json)
+
+
+def _resolve(value):
+    return value() if callable(value) else value
+
+
+def iter_json(value):
+    """Части JSON документа со значениями Items и callable"""
+    value = _resolve(value)
+    if isinstance(value, Items):
+        yield '['
+        for index, item in enumerate(value.iterable):
+            yield (',' if index else '') + _dumps(item)
+        yield ']'
+    elif isinstance(value, dict):
+        yield '{'
+        for index, (key, item) in enumerate(value.items()):
+            yield (', ' if index else '') + _dumps(str(key)) + ': '
+            yield from iter_json(item)
+        yield '}'
+    else:
+        yield _dumps(value)
+
+
+def _iter_ndjson(value, summary):
+    """Строки результатов; остальные поля собираются в summary"""
+    for key, item in value.items():
+        item = _resolve(item)
+        if isinstance(item, Items):
+            for result in item.iterable:
+                yield _dumps({'stage': item.stage, 'result': result}) + '\n'
+        elif isinstance(item, dict):
+            nested = {}
+            yield from _iter_ndjson(item, nested)
+            if nested:
+                summary[key] = nested
+        else:
+            summary[key] = item
+
+
+def iter_ndjson(document):
+    """Строки NDJSON: по строке на результат и итоговая строка summary"""
+    summary = {}
+    yield from _iter_ndjson(document, summary)
+    yield _dumps({'summary': summary}) + '\n'
+
+
+def _batched(chunks):
+    """Объединение мелких частей в блоки (по размеру или по времени)"""
+    buffered = []
+    size = 0
+    flushed_at = time.monotonic()
+    for chunk in chunks:
+        buffered.append(chunk)
+        size += len(chunk)
+        now = time.monotonic()
+        if size >= CHUNK_SIZE or now - flushed_at >= STREAM_FLUSH_SECONDS:
+            yield ''.join(buffered)
+            buffered = []
+            size = 0
+            flushed_at = now
+    if buffered:
+        yield ''.join(buffered)
+
+
+def iter_encoded(chunks):
+    """Блоки ответа в UTF-8 без сжатия"""
+    for block in _batched(chunks):
+        yield block.encode('utf-8')
+
+
+def iter_gzip(chunks):
+    """Блоки ответа, сжатые gzip (каждый блок сбрасывается клиенту)"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for block in _batched(chunks):
+        yield compressor.compress(block.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
@@ -19,13 +19,102 @@
 - Данные: POST в формате http_build_query, параметры в GET
 """
 
+import copy
 import requests
 from urllib.parse import urlencode
-from config import REGISTRAR_API_URL, REGISTRAR_API_KEY
+from config import REGISTRAR_API_URL, REGISTRAR_API_KEY, REGISTRAR_CACHE_TTL, REGISTRAR_CACHE_SIZE
+from cache import TTLCache
+from circuit_breaker import CircuitOpenError
+from deadlines import DeadlineExceeded
+from http_client import outbound_request
+import metrics
+import quota
+import singleflight
 
 # Базовый URL API ukraine.com.ua
 UKRAINE_API_BASE = 'https://adm.tools/action'
 
+# Сколько записей считаем у домена, если список ещё ни разу не получали
+DEFAULT_RECORDS_PER_DOMAIN = 5
+
+# Вариант endpoint/формата данных, который уже сработал:
+# (api_base, операция) -> (endpoint_url, индекс формата данных)
+# Его пробуем первым, чтобы не тратить квоту на перебор
+_working_variants = {}
+
+# Число записей домена при последнем получении списка (для оценки квоты)
+_record_counts = {}
+
+# Кэш ответов dns/record_list: (домен, аккаунт) -> ответ API.
+# Сбрасывается при любом создании/изменении/удалении записи домена
+_records_cache = TTLCache(REGISTRAR_CACHE_SIZE, REGISTRAR_CACHE_TTL)
+
+# Одновременные чтения списка записей одного домена (весь перебор вариантов)
+_records_inflight = singleflight.Group('ukraine.record_list')
+
+def _records_cache_key(domain, api_keys):
+    token = api_keys.get('registrar_api_key', '') if api_keys else REGISTRAR_API_KEY
+    return (domain, quota.account_key(token))
+
+def invalidate_dns_records_cache(domain, api_keys=None):
+    """Сброс закэшированного списка записей домена"""
+    _records_cache.invalidate(_records_cache_key(domain, api_keys))
+
+def _prefer_known_variant(api_base, operation, endpoints, variants):
+    """
+    Переставляет уже сработавший вариант endpoint/формата в начало перебора
+    
+    Возвращает список endpoints и список пар (индекс формата, данные).
+    """
+    indexed = list(enumerate(variants))
+    known = _working_variants.get((api_base, operation))
+    if not known:
+        return endpoints, indexed
+    endpoint_url, index = known
+    endpoints = [endpoint_url] + [e for e in endpoints if e != endpoint_url]
+    indexed = [indexed[index]] + [v for v in indexed if v[0] != index]
+    return endpoints, indexed
+
+def ukraine_expected_calls(operation, domain, api_keys=None, desired_count=1):
+    """
+    Оценка количества запросов к API для операции над доменом
+    
+    Используется для учёта дневной квоты до запуска задания.
+    Опирается на закэшированное состояние: известный рабочий вариант
+    endpoint и число записей домена при прошлом запуске.
+    
+    Args:
+        operation: 'update_a_record', 'get_records', 'update_nameservers',
+            'snapshot' (чтение в обход кэша) или 'restore' (откат из снимка)
+        domain: доменное имя
+        api_keys: словарь с API ключами (опционально)
+        desired_count: число записей в желаемом наборе (для update_a_record/restore)
+    """
+    api_base = get_ukraine_api_base(api_keys)
+    if operation == 'update_a_record':
+        # Список из кэша бесплатен; иначе 4 endpoint'а x 3 формата данных при переборе
+        if _records_cache.contains(_records_cache_key(domain, api_keys)):
+            list_calls = 0
+        else:
+            list_calls = 1 if (api_base, 'record_list') in _working_variants else 12
+        # Худший случай сверки: удалить все текущие и создать все желаемые
+        deletes = _record_counts.get(domain, DEFAULT_RECORDS_PER_DOMAIN)
+        return list_calls + deletes + desired_count
+    if operation == 'get_records':
+        if _records_cache.contains(_records_cache_key(domain, api_keys)):
+            return 0
+        return 1 if (api_base, 'record_list') in _working_variants else 12
+    if operation in ('snapshot', 'restore'):
+        # Чтение в обход кэша; restore - затем сверка с набором из снимка
+        list_calls = 1 if (api_base, 'record_list') in _working_variants else 12
+        if operation == 'snapshot':
+            return list_calls
+        return list_calls + _record_counts.get(domain, DEFAULT_RECORDS_PER_DOMAIN) + desired_count
+    if operation == 'update_nameservers':
+        # 2 endpoint'а x 4 формата данных при переборе
+        return 1 if (api_base, 'nameservers_set') in _working_variants else 8
+    return 1
+
 def get_ukraine_headers(api_keys=None):
     """
     Получение заголовков для API ukraine.com.ua
@@ -62,15 +151,40 @@ def get_ukraine_api_base(api_keys=None):
     
     return api_url.rstrip('/')
 
-def ukraine_get_dns_records(domain, api_keys=None):
+def ukraine_get_dns_records(domain, api_keys=None, fresh=False):
     """
     Получение DNS записей домена через API ukraine.com.ua
     
     API endpoint: dns/record_list
     
+    Ответ кэшируется на REGISTRAR_CACHE_TTL секунд, повторные запуски
+    в пределах этого времени не тратят квоту на чтение.
+    
     Args:
         domain: доменное имя
         api_keys: словарь с API ключами (опционально)
+        fresh: не использовать кэш (принудительное чтение из API)
+    """
+    cache_key = _records_cache_key(domain, api_keys)
+    if not fresh:
+        cached = _records_cache.get(cache_key)
+        if cached is not None:
+            metrics.inc('dns_registrar_cache_total', {'result': 'hit'})
+            return copy.deepcopy(cached)
+        metrics.inc('dns_registrar_cache_total', {'result': 'miss'})
+    
+    # Одновременные промахи по одному домену и аккаунту читают список один раз
+    generation = _records_cache.generation(cache_key)
+    result, shared = _records_inflight.do(
+        (cache_key, fresh), lambda: _fetch_dns_records(domain, api_keys, cache_key, generation))
+    return copy.deepcopy(result) if shared else result
+
+def _fetch_dns_records(domain, api_keys, cache_key, generation):
+    """
+    Чтение списка записей из API с перебором endpoints и форматов
+
+    Список кэшируется, только если записи домена не менялись с начала чтения
+    (generation - поколение ключа кэша до запроса).
     """
     api_base = get_ukraine_api_base(api_keys)
     
@@ -95,30 +209,38 @@ def ukraine_get_dns_records(domain, api_keys=None):
         urlencode({}),  # Пустой объект как query string
         None,  # Без данных вообще
     ]
+    endpoints, post_data_variants = _prefer_known_variant(api_base, 'record_list', endpoints, post_data_variants)
     
     last_error = None
+    attempt = -1  # Номер попытки для метрик повторов
     for endpoint_url in endpoints:
         url_with_params = f"{endpoint_url}?{urlencode(get_params)}"
         
-        for post_data in post_data_variants:
+        for variant_index, post_data in post_data_variants:
+            attempt += 1
             try:
                 if post_data is None:
                     # Пробуем без POST данных вообще
-                    response = requests.post(
+                    response = outbound_request(
+                        'ukraine', endpoint_url[len(api_base) + 1:].rstrip('/'), 'POST',
                         url_with_params,
-                        headers=headers,
-                        timeout=30
+                        attempt=attempt,
+                        headers=headers
                     )
                 else:
-                    response = requests.post(
+                    response = outbound_request(
+                        'ukraine', endpoint_url[len(api_base) + 1:].rstrip('/'), 'POST',
                         url_with_params,
+                        attempt=attempt,
                         headers=headers,
-                        data=post_data,
-                        timeout=30
+                        data=post_data
                     )
                 
                 response.raise_for_status()
-                return response.json()
+                result = response.json()
+                _working_variants[(api_base, 'record_list')] = (endpoint_url, variant_index)
+                _records_cache.set(cache_key, copy.deepcopy(result), generation=generation)
+                return result
             except requests.exceptions.RequestException as e:
                 last_error = e
                 # Если 400 ошибка, пробуем следующий вариант
@@ -171,11 +293,11 @@ def ukraine_delete_dns_record(domain, record_id, api_keys=None):
     }
     
     try:
-        response = requests.post(
+        response = outbound_request(
+            'ukraine', 'dns/record_delete', 'POST',
             url_with_params,
             headers=headers,
-            data=urlencode(post_data),
-            timeout=30
+            data=urlencode(post_data)
         )
         response.raise_for_status()
         result = response.json()
@@ -186,8 +308,10 @@ def ukraine_delete_dns_record(domain, record_id, api_keys=None):
     except requests.exceptions.RequestException:
         # Игнорируем ошибки удаления, если запись уже не существует
         return False
+    finally:
+        invalidate_dns_records_cache(domain, api_keys)
 
-def ukraine_create_dns_record(domain, record_type, name, content, ttl=3600, api_keys=None):
+def ukraine_create_dns_record(domain, record_type, name, content, ttl=3600, api_keys=None, priority=0):
     """
     Создание DNS записи через API ukraine.com.ua
     
@@ -200,6 +324,7 @@ def ukraine_create_dns_record(domain, record_type, name, content, ttl=3600, api_
         content: содержимое записи (IP для A записи)
         ttl: время жизни записи в секундах
         api_keys: словарь с API ключами (опционально)
+        priority: приоритет (для MX записей)
     """
     api_base = get_ukraine_api_base(api_keys)
     url = f"{api_base}/dns/record_add/"
@@ -218,22 +343,24 @@ def ukraine_create_dns_record(domain, record_type, name, content, ttl=3600, api_
         'subdomain': name if name != '@' else '',  # @ означает корень домена
         'data': content,
         'ttl': ttl,
-        'priority': 0  # Для MX записей
+        'priority': priority  # Для MX записей
     }
     
     try:
-        response = requests.post(
+        response = outbound_request(
+            'ukraine', 'dns/record_add', 'POST',
             url_with_params,
             headers=headers,
-            data=urlencode(post_data),
-            timeout=30
+            data=urlencode(post_data)
         )
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         raise Exception(f"Ошибка создания DNS записи: {str(e)}")
+    finally:
+        invalidate_dns_records_cache(domain, api_keys)
 
-def ukraine_update_dns_record(domain, record_id, record_type, name, content, ttl=3600, api_keys=None):
+def ukraine_update_dns_record(domain, record_id, record_type, name, content, ttl=3600, api_keys=None, priority=0):
     """
     Обновление DNS записи через API ukraine.com.ua
     
@@ -247,6 +374,7 @@ def ukraine_update_dns_record(domain, record_id, record_type, name, content, ttl
         content: содержимое записи
         ttl: время жизни записи
         api_keys: словарь с API ключами (опционально)
+        priority: приоритет (для MX записей)
     """
     api_base = get_ukraine_api_base(api_keys)
     url = f"{api_base}/dns/record_edit/"
@@ -266,20 +394,22 @@ def ukraine_update_dns_record(domain, record_id, record_type, name, content, ttl
         'subdomain': name if name != '@' else '',
         'data': content,
         'ttl': ttl,
-        'priority': 0
+        'priority': priority
     }
     
     try:
-        response = requests.post(
+        response = outbound_request(
+            'ukraine', 'dns/record_edit', 'POST',
             url_with_params,
             headers=headers,
-            data=urlencode(post_data),
-            timeout=30
+            data=urlencode(post_data)
         )
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         raise Exception(f"Ошибка обновления DNS записи: {str(e)}")
+    finally:
+        invalidate_dns_records_cache(domain, api_keys)
 
 def ukraine_update_nameservers(domain, nameservers, api_keys=None):
     """
@@ -314,22 +444,27 @@ def ukraine_update_nameservers(domain, nameservers, api_keys=None):
         {'ns': ','.join(nameservers)},
         {'ns': nameservers},
     ]
+    endpoints, data_variants = _prefer_known_variant(api_base, 'nameservers_set', endpoints, data_variants)
     
     last_error = None
+    attempt = -1  # Номер попытки для метрик повторов
     for endpoint_url in endpoints:
         url_with_params = f"{endpoint_url}?{urlencode(get_params)}"
         
-        for post_data in data_variants:
+        for variant_index, post_data in data_variants:
+            attempt += 1
             try:
-                response = requests.post(
+                response = outbound_request(
+                    'ukraine', endpoint_url[len(api_base) + 1:].rstrip('/'), 'POST',
                     url_with_params,
+                    attempt=attempt,
                     headers=headers,
-                    data=urlencode(post_data) if isinstance(post_data.get(list(post_data.keys())[0]), str) else urlencode({k: ','.join(v) if isinstance(v, list) else v for k, v in post_data.items()}),
-                    timeout=30
+                    data=urlencode(post_data) if isinstance(post_data.get(list(post_data.keys())[0]), str) else urlencode({k: ','.join(v) if isinstance(v, list) else v for k, v in post_data.items()})
                 )
                 if response.status_code in [200, 201]:
                     result = response.json()
                     if result.get('status') == 'success' or 'success' in str(result).lower():
+                        _working_variants[(api_base, 'nameservers_set')] = (endpoint_url, variant_index)
                         return result
             except requests.exceptions.RequestException as e:
                 last_error = e
@@ -338,9 +473,167 @@ def ukraine_update_nameservers(domain, nameservers, api_keys=None):
     error_msg = str(last_error) if last_error else "Неизвестная ошибка"
     raise Exception(f"Ошибка обновления NS записей: {error_msg}")
 
+def extract_dns_records(records_data):
+    """
+    Извлечение списка записей из ответа dns/record_list
+    
+    Структура ответа может отличаться: result/data/records, вложенный list,
+    или response при result = "success".
+    """
+    records = []
+    if isinstance(records_data, dict):
+        # Пробуем разные варианты структуры ответа
+        records = records_data.get('result', records_data.get('data', records_data.get('records', [])))
+        if isinstance(records, dict):
+            records = records.get('list', [])
+        if not isinstance(records, list):
+            response = records_data.get('response')
+            if isinstance(response, dict):
+                response = response.get('list', [])
+            records = response if isinstance(response, list) else []
+    elif isinstance(records_data, list):
+        records = records_data
+    return records
+
+def _record_id(record):
+    if isinstance(record, dict):
+        return record.get('subdomain_id', record.get('id', record.get('record_id', record.get('_id'))))
+    if isinstance(record, str):
+        return record
+    return None
+
+def _normalize_name(name, domain):
+    """Имя записи относительно домена: '@' для корня"""
+    name = str(name or '').strip().rstrip('.').lower()
+    if name in ('', '@', domain):
+        return '@'
+    if name.endswith('.' + domain):
+        name = name[:-len(domain) - 1]
+    return name
+
+def normalize_dns_record(record, domain):
+    """Запись регистратора в виде dict(type, name, content, ttl, priority) или None"""
+    if not isinstance(record, dict):
+        return None
+    try:
+        ttl = int(record.get('ttl', 3600) or 3600)
+        priority = int(record.get('priority', 0) or 0)
+    except (TypeError, ValueError):
+        ttl, priority = 3600, 0
+    return {
+        'type': str(record.get('type', '')).upper(),
+        'name': _normalize_name(record.get('subdomain', record.get('record', record.get('name', ''))), domain),
+        'content': str(record.get('data', record.get('content', record.get('value', '')))).strip().rstrip('.'),
+        'ttl': ttl,
+        'priority': priority,
+    }
+
+def _same_record(current, desired, domain):
+    if current['type'] != desired['type'] or current['name'] != _normalize_name(desired['name'], domain):
+        return False
+    if current['content'].lower() != str(desired['content']).strip().rstrip('.').lower():
+        return False
+    if current['ttl'] != int(desired.get('ttl', 3600)):
+        return False
+    return desired['type'] != 'MX' or current['priority'] == int(desired.get('priority', 0))
+
+def dns_records_drift(domain, records, desired):
+    """
+    Расхождение записей регистратора с желаемым набором (без запросов к API)
+    
+    Args:
+        records: записи из ответа API (extract_dns_records)
+        desired: список dict(type, name, content, ttl, priority)
+    
+    Returns:
+        dict(missing, extra) - число недостающих и лишних записей
+    """
+    pending = list(desired)
+    extra = 0
+    for record in (normalize_dns_record(r, domain) for r in records):
+        match = next((d for d in pending if record and _same_record(record, d, domain)), None)
+        if match is not None:
+            pending.remove(match)
+        else:
+            extra += 1
+    return {'missing': len(pending), 'extra': extra}
+
+def ukraine_reconcile_dns_records(domain, desired, api_keys=None, fresh=False):
+    """
+    Приведение записей домена к желаемому набору с минимумом запросов
+    
+    - совпадающие записи не трогаются
+    - запись того же типа и имени с другим содержимым редактируется
+    - лишние записи удаляются, недостающие создаются
+    
+    Args:
+        domain: доменное имя
+        desired: список dict(type, name, content, ttl, priority)
+        api_keys: словарь с API ключами (опционально)
+        fresh: читать текущие записи из API, минуя кэш
+    
+    Returns:
+        dict с количеством kept/updated/created/deleted
+    """
+    summary = {'kept': 0, 'updated': 0, 'created': 0, 'deleted': 0}
+    current = []
+    try:
+        records = extract_dns_records(ukraine_get_dns_records(domain, api_keys, fresh=fresh))
+        _record_counts[domain] = len(records)
+        current = [(r, normalize_dns_record(r, domain)) for r in records]
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
+    except Exception as get_error:
+        # Если не удалось получить список (400), создаём записи напрямую
+        # Возможно API позволяет создавать запись без предварительного удаления
+        if '400' in str(get_error) or 'Bad Request' in str(get_error):
+            pass
+        else:
+            raise
+    
+    # Точные совпадения оставляем как есть
+    pending = list(desired)
+    unmatched = []
+    for raw, record in current:
+        match = next((d for d in pending if record and _same_record(record, d, domain)), None)
+        if match is not None:
+            pending.remove(match)
+            summary['kept'] += 1
+        else:
+            unmatched.append((raw, record))
+    
+    # Запись того же типа и имени редактируем вместо удаления и создания
+    edits = []
+    for desired_record in list(pending):
+        name = _normalize_name(desired_record['name'], domain)
+        candidate = next((u for u in unmatched if u[1] and u[1]['type'] == desired_record['type'] and u[1]['name'] == name and _record_id(u[0])), None)
+        if candidate is not None:
+            unmatched.remove(candidate)
+            pending.remove(desired_record)
+            edits.append((_record_id(candidate[0]), desired_record))
+    
+    # Сначала удаляем лишнее (освобождает имена для CNAME), потом редактируем и создаём
+    for raw, _ in unmatched:
+        record_id = _record_id(raw)
+        if record_id:
+            ukraine_delete_dns_record(domain, record_id, api_keys)
+            summary['deleted'] += 1
+    
+    for record_id, record in edits:
+        ukraine_update_dns_record(domain, record_id, record['type'], record['name'], record['content'],
+                                  record.get('ttl', 3600), api_keys, priority=record.get('priority', 0))
+        summary['updated'] += 1
+    
+    for record in pending:
+        ukraine_create_dns_record(domain, record['type'], record['name'], record['content'],
+                                  record.get('ttl', 3600), api_keys, priority=record.get('priority', 0))
+        summary['created'] += 1
+    
+    return summary
+
 def ukraine_update_domain_a_record(domain, ip_address, api_keys=None):
     """
-    Обновление A записи домена: удаление всех записей и создание новой A записи
+    Обновление A записи домена: удаление всех остальных записей и A запись для корня
     
     Args:
         domain: доменное имя
@@ -348,42 +641,10 @@ def ukraine_update_domain_a_record(domain, ip_address, api_keys=None):
         api_keys: словарь с API ключами (опционально)
     """
     try:
-        # Сначала пытаемся получить список записей для удаления
-        try:
-            records_data = ukraine_get_dns_records(domain, api_keys)
-            
-            # Извлекаем список записей (структура может отличаться)
-            records = []
-            if isinstance(records_data, dict):
-                # Пробуем разные варианты структуры ответа
-                records = records_data.get('result', records_data.get('data', records_data.get('records', [])))
-                if isinstance(records, dict):
-                    records = records.get('list', [])
-            elif isinstance(records_data, list):
-                records = records_data
-            
-            # Удаляем все существующие записи
-            for record in records:
-                record_id = None
-                if isinstance(record, dict):
-                    record_id = record.get('subdomain_id', record.get('id', record.get('record_id', record.get('_id'))))
-                elif isinstance(record, str):
-                    record_id = record
-                
-                if record_id:
-                    ukraine_delete_dns_record(domain, record_id, api_keys)
-        except Exception as get_error:
-            # Если не удалось получить список, пробуем создать запись напрямую
-            # Возможно API позволяет создавать запись без предварительного удаления
-            if '400' in str(get_error) or 'Bad Request' in str(get_error):
-                # Если ошибка 400 при получении списка, пробуем создать запись напрямую
-                pass
-            else:
-                raise
-        
-        # Создаем новую A запись для корня домена
-        result = ukraine_create_dns_record(domain, 'A', '@', ip_address, 3600, api_keys)
+        ukraine_reconcile_dns_records(domain, [{'type': 'A', 'name': '@', 'content': ip_address, 'ttl': 3600, 'priority': 0}], api_keys)
         return {'status': 'success', 'message': 'A запись успешно обновлена'}
         
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
     except Exception as e:
         raise Exception(f"Ошибка обновления A записи: {str(e)}")
@@ -0,0 +1,170 @@
+"""
+Прогрев процесса (воркера gunicorn) перед приёмом трафика
+
+После старта воркера в фоне:
+
+- читаются настройки (settings.json/.env)
+- в пулы сессий http_client заранее открываются соединения к Cloudflare и
+  регистратору (DNS, TCP и TLS handshake), по WARMUP_CONNECTIONS на провайдера
+- индекс зон планировщика дрейфа (drift.ZoneIndex) заполняется первыми
+  WARMUP_ZONE_PAGES страницами списка зон - только если планировщик работает
+  в этом процессе (DRIFT_CHECK_ENABLED) и только в одном воркере на хост
+  (блокировка WARMUP_LOCK_FILE, пока воркер жив): запросы списка зон тратят
+  квоту Cloudflare при каждом рестарте. Этапы индекс не используют - они
+  ищут зону запросом zones?name= с ключами из запроса и свежим статусом
+
+Пока прогрев не закончен, /healthz/ready отвечает 503 и балансировщик не
+направляет на воркер запросы. Ошибки прогрева готовность не блокируют: они
+видны в ответе /healthz/ready, а через WARMUP_TIMEOUT секунд воркер считается
+готовым в любом случае.
+
+Запуск: start() только из post_worker_init (gunicorn.conf.py) - в воркере
+после fork и загрузки приложения, когда recorder уже настроен. При импорте
+app.py прогрев не начинается: скрипты и flask run не ждут сети, а потоки,
+запущенные в мастере при preload_app, после fork всё равно не существуют.
+"""
+
+import fcntl
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import drift
+import metrics
+import recorder
+from config import (
+    CLOUDFLARE_API_BASE, OUTBOUND_TIMEOUT, WARMUP_CONNECTIONS, WARMUP_ZONE_PAGES, WARMUP_TIMEOUT,
+    WARMUP_LOCK_FILE
+)
+from http_client import get_session
+
+_lock = threading.Lock()
+_started_pid = None
+_state = {}
+# Открытый файл блокировки хоста (держится до конца процесса)
+_host_lock = None
+
+
+def _reset_state():
+    _state.clear()
+    _state.update({
+        'ready': False,
+        'started_at': time.time(),
+        'finished_at': None,
+        'steps': {},
+    })
+
+
+def _step(name, fn, *args):
+    started = time.monotonic()
+    try:
+        detail = fn(*args)
+        result = {'ok': True, 'detail': detail}
+    except Exception as e:
+        result = {'ok': False, 'error': str(e)}
+    result['seconds'] = round(time.monotonic() - started, 3)
+    with _lock:
+        _state['steps'][name] = result
+    return result['ok']
+
+
+def _open_connections(provider, url, count):
+    """Параллельные запросы к хосту провайдера: count соединений остаются в пуле"""
+    session = get_session(provider)
+
+    def touch(_):
+        # Ответ не важен (HEAD к корню API), важно установленное соединение
+        session.head(url, timeout=OUTBOUND_TIMEOUT, allow_redirects=False)
+
+    with ThreadPoolExecutor(max_workers=count, thread_name_prefix=f'warmup-{provider}') as pool:
+        list(pool.map(touch, range(count)))
+    return {'connections': count}
+
+
+def _take_host_lock():
+    """Блокировка WARMUP_LOCK_FILE без ожидания: True - этот воркер первый на хосте"""
+    global _host_lock
+    if _host_lock is not None:
+        return True
+    handle = open(WARMUP_LOCK_FILE, 'a')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+    _host_lock = handle
+    return True
+
+
+def _prefetch_zone_index(api_keys, max_pages):
+    """Страницы списка зон в индекс drift (проход останавливается на последней)"""
+    if not _take_host_lock():
+        return {'skipped': 'индекс заполняет другой воркер хоста'}
+    headers = {
+        'X-Auth-Email': api_keys['cloudflare_email'],
+        'X-Auth-Key': api_keys['cloudflare_api_key'],
+        'Content-Type': 'application/json'
+    }
+    index = drift.zone_index()
+    pages = 0
+    while pages < max_pages:
+        if not index.fetch_page(headers):
+            raise RuntimeError('Cloudflare не отдал список зон')
+        pages += 1
+        if index.next_page == 1:
+            break
+    return {'pages': pages, 'zones': len(index.zones)}
+
+
+def warm_up():
+    """Прогрев (блокирующий); возвращает состояние"""
+    api_keys = {}
+
+    def load_settings():
+        nonlocal api_keys
+        api_keys = drift.configured_api_keys()
+        return {'configured': bool(api_keys['cloudflare_api_key'] and api_keys['registrar_api_key'])}
+
+    _step('settings', load_settings)
+    # При воспроизведении записи трафика в сеть не ходим
+    if not recorder.replaying():
+        registrar_url = api_keys.get('registrar_api_url') or 'https://adm.tools/action'
+        targets = [('cloudflare', CLOUDFLARE_API_BASE), ('ukraine', registrar_url)]
+        with ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix='warmup') as pool:
+            list(pool.map(lambda t: _step(f'connections.{t[0]}', _open_connections, t[0], t[1],
+                                          WARMUP_CONNECTIONS), targets))
+        if api_keys.get('cloudflare_api_key') and WARMUP_ZONE_PAGES > 0 and drift.scheduler_running():
+            _step('zone_index', _prefetch_zone_index, api_keys, WARMUP_ZONE_PAGES)
+
+    with _lock:
+        _state['ready'] = True
+        _state['finished_at'] = time.time()
+    metrics.set_gauge('dns_worker_ready', {}, 1)
+    metrics.observe('dns_warmup_duration_seconds', {}, _state['finished_at'] - _state['started_at'])
+    return state()
+
+
+def start():
+    """Прогрев в фоне (один раз на процесс, в том числе после fork)"""
+    global _started_pid
+    with _lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+        _reset_state()
+    metrics.set_gauge('dns_worker_ready', {}, 0)
+    threading.Thread(target=warm_up, name='warmup', daemon=True).start()
+
+
+def state():
+    """Состояние прогрева для /healthz/ready"""
+    with _lock:
+        if _started_pid is None:
+            # Прогрев выключен (WARMUP_ENABLED=0) - процесс готов сразу
+            return {'ready': True, 'pid': os.getpid(), 'steps': {}}
+        result = dict(_state, steps=dict(_state['steps']), pid=os.getpid())
+    if not result['ready'] and time.time() - result['started_at'] >= WARMUP_TIMEOUT:
+        result['ready'] = True
+        result['timed_out'] = True
+    return result